@@ -2,7 +2,8 @@
 import sys,time
 sys.path.append('/home/pi/Adafruit-Raspberry-Pi-Python-Code/Adafruit_PWM_Servo_Driver/')
 
-from Adafruit_PWM_Servo_Driver import PWM
+import HardwareRegistry as hw
+import HardwareBackend as backend
 
 # PWM board configuration values. 
 freqPWM = 50    #Frequency of PWM pulses (default is 50 Hz)
@@ -14,27 +15,158 @@ motorPowerLimiting = 50 #Default limits motors to 50 power
 maxPulseLength = 4090 #Length of an always on pulse for the pwm board (cap below true max of 4096 as pwm cuts out at this pulse length)
 channelPulseLengths = [0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0] #Store pulse lengths sent to each channel (for debug info)
 
-# Initialise the PWM device using the default address
-pwm = PWM(0x40, debug=False)
+# PCA9685 registers used for block writes
+regMode1 = 0x00
+regLed0OnL = 0x06 #First of 4 registers (ON_L, ON_H, OFF_L, OFF_H) for channel 0, each channel follows on
+mode1AutoIncrement = 0x20 #MODE1 bit to auto increment the register address during block writes
+maxBlockChannels = 8 #SMBus block writes are limited to 32 data bytes (4 bytes per channel)
+
+# Shadow registers. channelPulseLengths holds the last pulse sent to each channel, and is only
+# trusted to match the board when the channel's shadowValid flag is set. Writes which would not
+# change a valid shadow register are skipped.
+shadowValid = [False] * 16
+skippedWrites = 0
+
+# I2C bus usage tracking (bytes sent including device address and register bytes)
+busBytesThisFrame = 0
+lastFrameBusBytes = 0
+busTransactionsThisFrame = 0
+lastFrameBusTransactions = 0
+
+def initPWM():
+    """ Open and configure the PWM board """
+    # Initialise the PWM device using the default address
+    device = backend.createPWM(0x40, debug=False)
+    
+    # Set frequency to 50 Hz 
+    device.setPWMFreq(freqPWM)
+    
+    enableAutoIncrement(device)
+    return device
+
+
+def enableAutoIncrement(device):
+    """ Turns on register auto increment on the PWM board so multiple channels
+        can be written in a single block write
+    """
+    mode = device.i2c.readU8(regMode1)
+    device.i2c.write8(regMode1, mode | mode1AutoIncrement)
+
+
+# PWM board is opened on first use (or in the background by HardwareRegistry.startInBackground)
+pwm = hw.LazyDevice("pca9685", initPWM)
+
+
+def startBusFrame():
+    """ Starts a new frame for I2C bus usage tracking.
+        The totals for the frame just finished are kept in lastFrameBusBytes and lastFrameBusTransactions.
+    """
+    global busBytesThisFrame, lastFrameBusBytes, busTransactionsThisFrame, lastFrameBusTransactions
+    
+    lastFrameBusBytes = busBytesThisFrame
+    lastFrameBusTransactions = busTransactionsThisFrame
+    busBytesThisFrame = 0
+    busTransactionsThisFrame = 0
+
+
+def invalidateShadow():
+    """ Marks all shadow registers as unknown, so the next write to every channel is sent """
+    for channel in range(len(shadowValid)):
+        shadowValid[channel] = False
+
+
+def isUnchanged(channel, pulse):
+    """ Returns True if the channel is known to be set to this pulse length already """
+    return shadowValid[channel] and channelPulseLengths[channel] == pulse
+
+
+def writePWM(channel, pulse):
+    """ Sends a pulse length to a single channel (skipped if unchanged) """
+    global busBytesThisFrame, busTransactionsThisFrame, skippedWrites
+    
+    if isUnchanged(channel, pulse):
+        skippedWrites += 1
+        return
     
-# Set frequency to 50 Hz 
-pwm.setPWMFreq(freqPWM)
+    pwm.setPWM(channel, 0, pulse)
+    channelPulseLengths[channel] = pulse
+    shadowValid[channel] = True
+    #setPWM writes each of the 4 channel registers separately (address, register and value bytes)
+    busBytesThisFrame += 12
+    busTransactionsThisFrame += 4
+
+
+def contiguousRuns(channels):
+    """ Splits a sorted list of channels into runs of consecutive channels
+        which can each be sent in one block write
+    """
+    runs = []
+    for channel in channels:
+        if len(runs) > 0 and channel == runs[-1][-1] + 1 and len(runs[-1]) < maxBlockChannels:
+            runs[-1].append(channel)
+        else:
+            runs.append([channel])
+    return runs
+
+
+def setMultiplePWM(pulses):
+    """ Sends pulse lengths to several channels using as few block writes as possible.
+        pulses is a dictionary of channel: pulse length. Channels which are unchanged are skipped.
+    """
+    global busBytesThisFrame, busTransactionsThisFrame, skippedWrites
+    
+    changed = []
+    for channel in sorted(pulses):
+        if isUnchanged(channel, pulses[channel]):
+            skippedWrites += 1
+        else:
+            changed.append(channel)
+    
+    for run in contiguousRuns(changed):
+        data = []
+        for channel in run:
+            pulse = pulses[channel]
+            data += [0, 0, pulse & 0xFF, pulse >> 8]
+        pwm.i2c.writeList(regLed0OnL + 4 * run[0], data)
+        for channel in run:
+            channelPulseLengths[channel] = pulses[channel]
+            shadowValid[channel] = True
+        busBytesThisFrame += 2 + len(data)
+        busTransactionsThisFrame += 1
 
 
 def setServoPosition(channel, position):
     """ Sets the position of a servo in degrees
     """
-    global channelPulseLengths
+    pulse = servoPulse(position)
+    if pulse is not None:
+        # print("Setting servo {} pulse to {}".format(channel,pulse) )
+        writePWM(channel, pulse)
+    
     
+def setServoPositions(positions):
+    """ Sets the positions of several servos in degrees, using block writes.
+        positions is a dictionary of channel: position
+    """
+    pulses = {}
+    for channel, position in positions.items():
+        pulse = servoPulse(position)
+        if pulse is not None:
+            pulses[channel] = pulse
+    setMultiplePWM(pulses)
+    
+    
+def servoPulse(position):
+    """ Converts a servo position in degrees to a pulse length.
+        Returns None if the position is outside the supported range.
+    """
     #Convert position in degrees to value in range min-max
     pulse = int( ( (servoMax - servoMin) * position / servoRange ) + servoMin)
     
     if (pulse < servoMin) or (pulse > servoMax):
         print("Calculated servo pulse {} is outside supported range of {} to {}".format(pulse,servoMin,servoMax) )
-    else:
-        # print("Setting servo {} pulse to {}".format(channel,pulse) )
-        pwm.setPWM(channel, 0, pulse)
-        channelPulseLengths[channel] = pulse
+        return None
+    return pulse
     
     
 def setMotorPowerLimiting(percentage):
@@ -58,8 +190,12 @@ def setPercentageOn(channel, percent):
     """ Sets the percentage of time a channel is on per cycle.
         For use with PWM motor speed control.
     """
-    global channelPulseLengths
+    #print("Setting servo {} pulse to {}".format(channel,pulse) )
+    writePWM(channel, percentagePulse(percent))
+ 
     
+def percentagePulse(percent):
+    """ Converts a percentage on time to a pulse length, applying motor power limiting """
     #Scale down fully on pulse using percentage power limiting global variable value
     maxPulse = maxPulseLength * motorPowerLimiting / 100
     
@@ -70,18 +206,15 @@ def setPercentageOn(channel, percent):
     if (percent < 0):
         pulse = 0
     elif (percent > 100):
-        pulse = maxPulse
+        pulse = int(maxPulse)
 
-    #print("Setting servo {} pulse to {}".format(channel,pulse) )
-    pwm.setPWM(channel, 0, pulse)
-    channelPulseLengths[channel] = pulse
+    return pulse
  
     
 def setConstantOn(channel):
     """ Sets a channel to completely on (for logical high).
     """
-    pwm.setPWM(channel, 0, maxPulseLength)
-    channelPulseLengths[channel] = maxPulseLength
+    writePWM(channel, maxPulseLength)
     
     
 def allOff():
@@ -90,6 +223,7 @@ def allOff():
     
     pwm.setAllPWM(0,0)
     channelPulseLengths = [0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0]
+    invalidateShadow()
     
     
 def main():
@@ -105,6 +239,11 @@ def main():
     print("Setting servo on channel {} to 90 degrees position.".format(testChannel))
     setServoPosition(testChannel, 90);
     time.sleep(1)
+    print("Setting servos on channels 0-3 to 90 degrees position in one block write.")
+    startBusFrame()
+    setServoPositions({0: 90, 1: 90, 2: 90, 3: 90})
+    startBusFrame()
+    print("Bus usage: {} bytes in {} transactions".format(lastFrameBusBytes, lastFrameBusTransactions))
     
     
 if __name__ == '__main__':
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+""" Image and text asset cache for the Rocky Rover UI.
+    Decoded images are converted to the display pixel format once and kept in a
+    bounded least recently used cache, so redrawing the screen only costs a blit.
+    Fonts are created once per size, and rendered text is cached in the same way.
+"""
+
+import pygame
+from collections import OrderedDict
+
+# Maximum number of converted surfaces held in the cache
+maxCachedSurfaces = 32
+# Maximum number of rendered text surfaces held in the cache
+maxCachedTexts = 256
+
+# Images used by the UI, loaded up front by preload()
+uiImages = [
+    "mars_hubble_canyon.jpg",
+    "LagoonNebula.jpg",
+    "iss_solar_panel.jpg",
+    "iss_solar_panel_orange.jpg",
+    "jupiter1_btn180.gif",
+    "mars1_btn180.gif",
+    "mars2_btn180.gif",
+    "mercury1_btn180.gif",
+    "moon_btn180.gif",
+    "moon-farside_btn180.gif",
+    "neptune_btn180.gif",
+    "pluto_btn180.gif",
+    "saturn_btn180.gif",
+    "uranus_btn180.gif",
+    "venus1_btn180.gif",
+    "venus2_btn180.gif",
+    ]
+
+surfaceCache = OrderedDict()
+cacheHits = 0
+cacheMisses = 0
+
+fontPool = {}
+textCache = OrderedDict()
+textHits = 0
+textMisses = 0
+
+
+def pixelFormat():
+    """ Returns a key describing the pixel format of the current display surface """
+    display = pygame.display.get_surface()
+    if display is None:
+        return None
+    return (display.get_bitsize(), display.get_masks())
+
+
+def getImage(filename):
+    """ Returns the image converted to the display pixel format.
+        Loads and converts the image from disk only if it is not already cached.
+    """
+    global cacheHits, cacheMisses
+
+    key = (filename, pixelFormat())
+    image = surfaceCache.get(key)
+    if image is not None:
+        cacheHits += 1
+        surfaceCache.move_to_end(key)
+        return image
+
+    cacheMisses += 1
+    image = pygame.image.load( filename ).convert()
+    surfaceCache[key] = image
+    if len(surfaceCache) > maxCachedSurfaces:
+        #Drop least recently used surface
+        surfaceCache.popitem(last=False)
+
+    return image
+
+
+def getFont(size):
+    """ Returns the default font at the given size, creating it on first use """
+    font = fontPool.get(size)
+    if font is None:
+        font = pygame.font.Font(None, size)
+        fontPool[size] = font
+    return font
+
+
+def getText(text, size, colour, shadowCol=None):
+    """ Returns a (shadow, text) pair of rendered text surfaces.
+        The shadow surface is None if no shadow colour is given.
+        Text is only rendered if it is not already cached.
+    """
+    global textHits, textMisses
+
+    key = (text, size, tuple(colour), None if shadowCol is None else tuple(shadowCol))
+    rendered = textCache.get(key)
+    if rendered is not None:
+        textHits += 1
+        textCache.move_to_end(key)
+        return rendered
+
+    textMisses += 1
+    font = getFont(size)
+    shadow = None
+    if shadowCol is not None:
+        shadow = font.render(text, True, shadowCol)
+    rendered = (shadow, font.render(text, True, colour))
+    textCache[key] = rendered
+    if len(textCache) > maxCachedTexts:
+        #Drop least recently used text
+        textCache.popitem(last=False)
+
+    return rendered
+
+
+def preload(filenames = uiImages):
+    """ Load and convert a list of images into the cache.
+        Must be called after the display mode has been set.
+    """
+    for filename in filenames:
+        try:
+            getImage(filename)
+        except Exception as e:
+            print(f"Failed to preload image {filename}: {e}")
+
+
+def clear():
+    """ Empty the caches (e.g. after the display mode has changed) """
+    surfaceCache.clear()
+    textCache.clear()
+
+
+def getStats():
+    """ Returns a dictionary of cache statistics """
+    return {
+        "hits": cacheHits,
+        "misses": cacheMisses,
+        "size": len(surfaceCache),
+        "capacity": maxCachedSurfaces,
+        "textHits": textHits,
+        "textMisses": textMisses,
+        "textSize": len(textCache),
+        "textCapacity": maxCachedTexts,
+        "fonts": len(fontPool),
+        }
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 
 import RobotControl as rc
-import PID
+import PID, LoopTiming, RingLogger
+import threading, time
+from collections import deque, namedtuple
 
 minSideDist = 100
 maxSideDist = 200
@@ -12,6 +14,22 @@ targetWallDistance = 0
 Pk = 0.35
 Ik = 0.05
 Dk = 0.1
+derivativeFilterTime = 0.0 #Time constant (s) of the PID derivative low pass filter (0 for no filtering)
+autoControlRate = 20 #Autonomous control steps per second
+mazeState = 0
+#Turn direction at each junction of the maze (True = clockwise)
+mazeTurnDirections = [False, False, True, True, False, False, False, True]
+mazeTurnTime = 0.6 #Time to spin on the spot for a 90 degree turn (seconds)
+mazeDriveOnTime = 0.25 #Time to drive forwards after a turn (seconds)
+
+log = RingLogger.getLogger("AutonomousDriving")
+pid = None
+pidLock = threading.Lock()
+autoDriver = None
+
+#Actuator command passed from the autonomous driving thread to the main loop.
+#Fields set to None are left unchanged. If spotTurn is set, steering is the spot turn angle.
+DriveCommand = namedtuple("DriveCommand", ["steering", "spotTurn", "leftPower", "rightPower"])
 
 
 def updatePk(increment):
@@ -24,6 +42,8 @@ def updatePk(increment):
     
     if Pk < 0:
         Pk = 0
+    
+    retunePID()
 
 
 def updateIk(increment):
@@ -36,6 +56,8 @@ def updateIk(increment):
     
     if Ik < 0:
         Ik = 0
+    
+    retunePID()
         
         
 def updateDk(increment):
@@ -48,6 +70,8 @@ def updateDk(increment):
     
     if Dk < 0:
         Dk = 0
+    
+    retunePID()
         
         
 def updateMinSideDist(increment):
@@ -94,12 +118,18 @@ def updateMinFrontDist(increment):
         minFrontDist = 1000
 
 
-def updateAutoCycles(increment):
-    """ Updates the value of autoCycles by the amount 'increment'.
+def updateAutoControlRate(increment):
+    """ Updates the value of autoControlRate by the amount 'increment'.
         Limits value to between a defined allowed range
     """
-    global autoCycles
+    global autoControlRate
     
+    autoControlRate += increment
+
+    if autoControlRate < 5:
+        autoControlRate = 5
+    elif autoControlRate > 100:
+        autoControlRate = 100
 
 
 def updateMaxSteeringAngle(increment):
@@ -116,49 +146,253 @@ def updateMaxSteeringAngle(increment):
         maxSteeringAngle = 60
     
     
-def initialisePID(setPoint=0.0):
+def initialisePID(setPoint=0.0, clock=time.monotonic):
     """ Initialise PID controller """
     global pid
     
-    pid = PID.PID(Pk, Ik, Dk)
-    
-    pid.SetPoint=setPoint
-    pid.setSampleTime(0.01)
+    with pidLock:
+        pid = PID.PID(Pk, Ik, Dk, clock)
+        
+        pid.SetPoint=setPoint
+        pid.setSampleTime(0.01)
+        pid.setDerivativeFilter(derivativeFilterTime)
     
 
-def wallMidPointPID(leftDist, rightDist, frontDist):
-    """ Update steering and motors based on sensor values to keep robot mid way between two walls """
-
-    #Control motor speed based on promixity of obstacle seen by front sensor
-    setMotorPower(frontDist)
+def retunePID():
+    """ Apply the current gains to the PID controller (safe to call while autonomous driving is running) """
+    with pidLock:
+        if pid is not None:
+            pid.setKp(Pk)
+            pid.setKi(Ik)
+            pid.setKd(Dk)
     
+
+def wallMidPointCommand(leftDist, rightDist, frontDist, motorPower, dt=None):
+    """ Calculate the steering and motor power to keep robot mid way between two walls.
+        motorPower is the power the motors are currently set to.
+        dt is the time since the last step (if None the PID controller reads its clock).
+        Returns a DriveCommand.
+    """
     #Calculate position between walls (L=-1.0, mid-point=0.0,R=1.0)
     wallSep = rightDist + leftDist
     position = (wallSep / 2) - rightDist
     ratio = position * 2 / wallSep
 
-    pid.update(ratio)
-    output = pid.output
+    with pidLock:
+        pid.update(ratio, dt)
+        output = pid.output
     angle = maxSteeringAngle * output * 2
     
     #print("PID ratio: {}, output: {}, angle: {}".format(ratio,output,angle) )
-    rc.setSteering(angle)
+    
+    #Control motor speed based on promixity of obstacle seen by front sensor
+    power = motorPowerCommand(frontDist, motorPower)
+    
+    return DriveCommand(angle, False, power, power)
+    
 
+@rc.driveUpdate()
+def wallMidPointPID(leftDist, rightDist, frontDist):
+    """ Update steering and motors based on sensor values to keep robot mid way between two walls """
+    applyDriveCommand( wallMidPointCommand(leftDist, rightDist, frontDist, rc.motorPowerL) )
 
-def setMotorPower(frontDist):
-    """ Sets motors to run if front sensor is not measuring obstacle ahead.
+
+def motorPowerCommand(frontDist, motorPower):
+    """ Returns the power to set the motors to based on the front sensor distance,
+        or None if the motors should be left at their current power.
     """
     if frontDist < minFrontDist:
         #Stop if closer than min front distance from obstacle
-        rc.setLeftMotorPower(0)
-        rc.setRightMotorPower(0)
-    elif rc.motorPowerL == 0:
+        return 0
+    elif motorPower == 0:
         #Start motors if nothing closer than min front distance from obstacle
         #and motors are stopped
-        rc.setLeftMotorPower(100)
-        rc.setRightMotorPower(100)
+        return 100
+    return None
+
+
+@rc.driveUpdate()
+def setMotorPower(frontDist):
+    """ Sets motors to run if front sensor is not measuring obstacle ahead.
+    """
+    power = motorPowerCommand(frontDist, rc.motorPowerL)
+    if power is not None:
+        rc.setLeftMotorPower(power)
+        rc.setRightMotorPower(power)
+
+
+@rc.driveUpdate()
+def applyDriveCommand(command):
+    """ Sets the steering and motors from a DriveCommand """
+    if command.steering is not None:
+        if command.spotTurn:
+            rc.spotTurnSteering(command.steering)
+        else:
+            rc.setSteering(command.steering)
+    if command.leftPower is not None:
+        rc.setLeftMotorPower(command.leftPower)
+    if command.rightPower is not None:
+        rc.setRightMotorPower(command.rightPower)
+
+
+class CommandMailbox:
+    """ Lock protected mailbox holding the latest drive command.
+        Posting a command merges it with any command which has not been taken yet,
+        so no actuator change is lost if the main loop falls behind. A spot turn is
+        never merged with a later command, which is kept to be taken after it instead,
+        so the turn is always applied.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = deque()
+        
+    def post(self, command):
+        with self.lock:
+            old = self.commands[-1] if self.commands else None
+            if old is None or (old.spotTurn and not command.spotTurn):
+                self.commands.append(command)
+                return
+            if command.steering is None:
+                command = command._replace(steering=old.steering, spotTurn=old.spotTurn)
+            if command.leftPower is None:
+                command = command._replace(leftPower=old.leftPower)
+            if command.rightPower is None:
+                command = command._replace(rightPower=old.rightPower)
+            self.commands[-1] = command
+            
+    def take(self):
+        """ Returns the oldest pending command (or None) and removes it from the mailbox """
+        with self.lock:
+            if self.commands:
+                return self.commands.popleft()
+            return None
+
+
+class AutonomousDriver(threading.Thread):
+    """ Thread which runs the autonomous driving steps at autoControlRate.
+        Reads sensors using the readSensors function, which must return a tuple of
+        (left, right, front) distances without blocking, or None if the sensors have
+        no readings yet (no steps are run until they have). Actuator commands are posted
+        to a mailbox for the main loop to apply. If a step raises an exception the
+        error is logged, a stop command is posted and the thread ends.
+    """
+    
+    def __init__(self, readSensors, maze=False):
+        super().__init__(daemon=True)
+        self.readSensors = readSensors
+        self.maze = maze
+        self.mailbox = CommandMailbox()
+        self.stopRequested = threading.Event()
+        self.lastSensors = (0,0,0)
+        self.motorPower = rc.motorPowerL
+        
+    def stop(self):
+        self.stopRequested.set()
+        
+    def post(self, command):
+        if command.leftPower is not None:
+            self.motorPower = command.leftPower
+        self.mailbox.post(command)
+        
+    def run(self):
+        try:
+            self.drive()
+        except Exception as e:
+            #Stop rather than leave the motors running on the last command with nothing steering
+            log.error("Autonomous driving stopped by error: {!r}", e)
+            self.post( DriveCommand(0, False, 0, 0) )
+            
+    def drive(self):
+        """ Run the driving steps until stopped """
+        nextStep = time.perf_counter()
+        while not self.stopRequested.is_set():
+            with LoopTiming.stage("sensors"):
+                sensors = self.readSensors()
+            #Nothing to steer by until the sensors have readings
+            if sensors is not None:
+                self.lastSensors = sensors
+                leftDist, rightDist, frontDist = sensors
+                if self.maze and frontDist < minFrontDist:
+                    self.mazeTurn()
+                    #Start the PID afresh, rather than carrying the error from before the turn across it
+                    with pidLock:
+                        pid.reset()
+                    nextStep = time.perf_counter()
+                else:
+                    #Step the PID at the nominal control period, so it behaves the same as in simulation
+                    with LoopTiming.stage("wallMidPointPID"):
+                        command = wallMidPointCommand(leftDist, rightDist, frontDist, self.motorPower, 1 / autoControlRate)
+                    self.post(command)
+            
+            #Wait until next step is due (re-reading rate so it can be retuned while running)
+            nextStep += 1 / autoControlRate
+            delay = nextStep - time.perf_counter()
+            if delay > 0:
+                self.stopRequested.wait(delay)
+            else:
+                nextStep = time.perf_counter()
+                
+    def mazeTurn(self):
+        """ Turn 90 degrees on the spot in the direction for the current maze state,
+            then drive on if the way ahead is clear.
+        """
+        global mazeState
+        
+        if mazeState < len(mazeTurnDirections):
+            if mazeTurnDirections[mazeState]:
+                speedR = -100
+            else:
+                speedR = 100
+            self.post( DriveCommand(40, True, -speedR, speedR) )
+            if self.stopRequested.wait(mazeTurnTime):
+                return
+            self.post( DriveCommand(0, False, 0, 0) )
+            
+        #Check forward is now clear
+        sensors = self.readSensors()
+        if sensors is not None and sensors[2] > minFrontDist:
+            #Increment state and drive forwards for a short time
+            self.post( DriveCommand(None, False, 100, 100) )
+            if self.stopRequested.wait(mazeDriveOnTime):
+                return
+            mazeState += 1
+
+
+def startAutonomous(readSensors, maze=False):
+    """ Start the autonomous driving thread (stopping any already running) """
+    global autoDriver
+    
+    stopAutonomous()
+    autoDriver = AutonomousDriver(readSensors, maze)
+    autoDriver.start()
+
+
+def stopAutonomous():
+    """ Stop the autonomous driving thread. Any commands not yet applied are discarded. """
+    global autoDriver
+    
+    if autoDriver is not None:
+        autoDriver.stop()
+        autoDriver.join()
+        autoDriver = None
+
+
+def applyPendingCommand():
+    """ Apply the latest command from the autonomous driving thread to the robot.
+        Must be called from the main loop. Returns False if the thread has stopped
+        (such as after an error) without being asked to, otherwise True.
+    """
+    if autoDriver is not None:
+        command = autoDriver.mailbox.take()
+        if command is not None:
+            applyDriveCommand(command)
+        if not autoDriver.is_alive() and not autoDriver.stopRequested.is_set():
+            return False
+    return True
 
 
+@rc.driveUpdate()
 def wallFollow(leftDist, rightDist, frontDist, left = False):
     """ Follow left or right wall.
         Steering attempts to keep robot the same distance from the wall as starting distance.
@@ -203,7 +437,7 @@ def wallFollow(leftDist, rightDist, frontDist, left = False):
         else:
             addn = int(maxTargetFactor * targetdiff / maxSteerDistance)
             
-        print("Target {}; Dist {}; Trend: {}; TrdCmp: {}; TrgCmp {}".format(targetWallDistance,distance,trendDist,angle,addn))
+        log.debug("Target {}; Dist {}; Trend: {}; TrdCmp: {}; TrgCmp {}", targetWallDistance, distance, trendDist, angle, addn)
     
         angle += addn
         
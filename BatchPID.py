@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+""" Vectorised PID controllers for simulating many controllers at once.
+    Holds the gains and state of N controllers in NumPy arrays and updates them all in
+    one step, with the same integral windup clamping, derivative filtering and output
+    as PID.PID.update with an explicit dt.
+"""
+
+import numpy as np
+
+
+class BatchPID:
+    """ N PID controllers updated together at a fixed time step """
+
+    def __init__(self, P, I, D, windup=20.0, derivativeFilter=0.0, setPoint=0.0):
+        self.Kp = np.asarray(P, dtype=float)
+        n = self.Kp.shape[0]
+        self.Ki = np.broadcast_to( np.asarray(I, dtype=float), (n,) ).copy()
+        self.Kd = np.broadcast_to( np.asarray(D, dtype=float), (n,) ).copy()
+        self.windupGuard = np.broadcast_to( np.asarray(windup, dtype=float), (n,) ).copy()
+        self.derivativeFilter = np.broadcast_to( np.asarray(derivativeFilter, dtype=float), (n,) ).copy()
+        self.setPoint = np.broadcast_to( np.asarray(setPoint, dtype=float), (n,) ).copy()
+        self.clear()
+
+    def __len__(self):
+        return self.Kp.shape[0]
+
+    def clear(self):
+        """ Clears the state of all the controllers """
+        n = len(self)
+        self.PTerm = np.zeros(n)
+        self.ITerm = np.zeros(n)
+        self.DTerm = np.zeros(n)
+        self.lastError = np.zeros(n)
+        self.output = np.zeros(n)
+
+    def select(self, keep):
+        """ Keep only the controllers selected by a boolean mask or index array """
+        for name in ("Kp", "Ki", "Kd", "windupGuard", "derivativeFilter", "setPoint",
+                     "PTerm", "ITerm", "DTerm", "lastError", "output"):
+            setattr(self, name, getattr(self, name)[keep])
+
+    def update(self, feedback, dt):
+        """ Update all the controllers with an array of feedback values after a time step dt.
+            Returns the array of outputs.
+        """
+        error = self.setPoint - feedback
+        deltaError = error - self.lastError
+
+        PTerm = self.Kp * error
+        ITerm = np.clip(self.ITerm + error * dt, -self.windupGuard, self.windupGuard)
+
+        if dt > 0:
+            derivative = deltaError / dt
+            alpha = dt / (self.derivativeFilter + dt)
+            DTerm = np.where(self.derivativeFilter > 0, self.DTerm + alpha * (derivative - self.DTerm), derivative)
+        else:
+            DTerm = np.zeros(len(self))
+
+        self.PTerm, self.ITerm, self.DTerm, self.lastError = PTerm, ITerm, DTerm, error
+        self.output = PTerm + self.Ki * ITerm + self.Kd * DTerm
+        return self.output
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+""" Background monitoring of the Rocky Rover motor battery voltage.
+    A sampler thread takes the median of a few voltage reads at a fixed interval and
+    stores it in a ring buffer. The mean and variance of the ring are kept up to date
+    incrementally, and readings too far from the mean are rejected as outliers, so the
+    filtered voltage is always available without reading the hardware. When the voltage
+    falls below deratingVoltage the monitor reports that motor power should be derated,
+    until it recovers by deratingHysteresis.
+"""
+
+import math, threading
+
+sampleInterval = 0.2 #Seconds between samples
+readsPerSample = 3 #Voltage reads per sample (the median is used)
+ringSize = 32 #Samples averaged
+minSamples = 8 #Samples needed before outliers are rejected and derating is checked
+outlierSigmas = 4 #Samples further than this many standard deviations from the mean are outliers
+outlierFloor = 0.15 #Volts. Samples this close to the mean are never outliers.
+maxConsecutiveOutliers = 10 #After this many outliers in a row the voltage is taken to have really changed
+deratingVoltage = 7.0 #Motor power is derated below this voltage (3.5V per cell of the 2S battery)
+deratingHysteresis = 0.2 #Voltage rise above deratingVoltage needed to end derating
+deratedPowerLimit = 40 #Maximum motor power limit (%) while derated
+
+
+class BatteryMonitor(threading.Thread):
+    """ Background thread which samples the battery voltage into a ring buffer.
+        readVoltage is a function returning one voltage reading. onDeratingChanged is
+        called from the monitor thread with True or False when derating starts or ends.
+    """
+
+    def __init__(self, readVoltage, onDeratingChanged=None, size=ringSize):
+        super().__init__(daemon=True)
+        self.readVoltage = readVoltage
+        self.onDeratingChanged = onDeratingChanged
+        self.size = size
+        self.samples = [0.0] * size
+        self.count = 0 #Total number of samples stored (index of next slot is count % size)
+        self.total = 0.0
+        self.totalSquares = 0.0
+        self.voltage = 0.0 #Mean of the samples in the ring (0 until the first sample)
+        self.variance = 0.0
+        self.rejected = 0
+        self.consecutiveOutliers = 0
+        self.derated = False
+        self.lock = threading.Lock()
+        self.stopRequested = threading.Event()
+
+    def run(self):
+        while not self.stopRequested.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Error reading battery voltage: {e}")
+            self.stopRequested.wait(sampleInterval)
+
+    def stop(self):
+        self.stopRequested.set()
+
+    def sample(self):
+        """ Take a sample and update derating """
+        readings = sorted( self.readVoltage() for i in range(readsPerSample) )
+        self.add( readings[len(readings) // 2] )
+        self.checkDerating()
+
+    def add(self, value):
+        """ Store a sample unless it is an outlier. Returns True if it was stored. """
+        with self.lock:
+            n = min(self.count, self.size)
+            if n >= minSamples:
+                if abs(value - self.voltage) > max(outlierSigmas * math.sqrt(self.variance), outlierFloor):
+                    self.rejected += 1
+                    self.consecutiveOutliers += 1
+                    if self.consecutiveOutliers < maxConsecutiveOutliers:
+                        return False
+                    #Voltage has really changed (e.g. battery swapped), so start again from this sample
+                    self.count = 0
+                    self.total = 0.0
+                    self.totalSquares = 0.0
+            self.consecutiveOutliers = 0
+
+            idx = self.count % self.size
+            if self.count >= self.size:
+                old = self.samples[idx]
+                self.total -= old
+                self.totalSquares -= old * old
+            self.samples[idx] = value
+            self.total += value
+            self.totalSquares += value * value
+            self.count += 1
+            if self.count % self.size == 0:
+                #Recalculate the sums once per pass of the ring so rounding errors cannot build up
+                self.total = math.fsum(self.samples)
+                self.totalSquares = math.fsum( v * v for v in self.samples )
+
+            n = min(self.count, self.size)
+            self.voltage = self.total / n
+            self.variance = max(0.0, self.totalSquares / n - self.voltage * self.voltage)
+            return True
+
+    def checkDerating(self):
+        """ Start or end derating when the voltage crosses the thresholds, and report changes """
+        if self.count < minSamples:
+            return
+        if not self.derated and self.voltage < deratingVoltage:
+            self.derated = True
+        elif self.derated and self.voltage > deratingVoltage + deratingHysteresis:
+            self.derated = False
+        else:
+            return
+        if self.onDeratingChanged is not None:
+            self.onDeratingChanged(self.derated)
+
+    def powerLimitCap(self):
+        """ Returns the maximum motor power limit (%) allowed at the current voltage """
+        return deratedPowerLimit if self.derated else 100
+
+    def getStats(self):
+        return {
+            "voltage": self.voltage,
+            "stdDev": math.sqrt(self.variance),
+            "samples": self.count,
+            "rejected": self.rejected,
+            "derated": self.derated,
+            }
@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+
+""" 2D course simulator for the Rocky Rover autonomous driving code.
+    A kinematic model of the four wheel steering rover is driven by the same steering
+    angle and motor power commands as the real robot, with the left, right and front
+    time of flight sensors modelled by ray casting against the walls of a course.
+    The simulation runs at a fixed time step with no sleeping, so a run over a course
+    takes milliseconds and can be repeated many times to tune the autonomous driving.
+
+    Usage:
+        python3 CourseSimulator.py [corridor|maze]
+"""
+
+import math, random, sys
+from collections import namedtuple
+import RobotControl as rc
+import AutonomousDriving as ad
+
+#Rover dimensions (mm)
+wheelBase = 200 #Distance between front and rear axles
+trackWidth = 180 #Distance between left and right wheels
+robotLength = 240
+robotWidth = 200
+#Speed (mm/s) at 100% motor power with the default power limiting
+fullPowerSpeed = 360
+#Time constant (s) of the motor speed response
+motorTimeConstant = 0.1
+
+#Time of flight sensor range (mm)
+sensorMaxRange = 4000
+
+#Default simulation settings
+defaultTimeStep = 0.005
+defaultMaxTime = 60
+
+#Result of a simulated run
+RunResult = namedtuple("RunResult", ["finished", "crashed", "time", "distance",
+    "meanOffset", "maxOffset", "steeringEffort", "mazeState", "trace"])
+
+
+class Course:
+    """ Walls of a course as a list of line segments, with a start pose (x, y, heading in
+        radians, anticlockwise from the x axis) and a finish point reached within finishRadius
+    """
+
+    def __init__(self, name, walls, start, finish, finishRadius=200):
+        self.name = name
+        self.walls = walls
+        self.start = start
+        self.finish = finish
+        self.finishRadius = finishRadius
+
+
+def polygonWalls(points, closed=True):
+    """ Returns the wall segments joining a list of points """
+    walls = [ (points[i], points[i+1]) for i in range(len(points) - 1) ]
+    if closed:
+        walls.append( (points[-1], points[0]) )
+    return walls
+
+
+def corridorCourse(path, width):
+    """ Returns a course following a path of axis aligned waypoints (mm), with walls
+        width apart either side of it. The corridor is closed at both ends.
+    """
+    def leftNormal(a, b):
+        dx, dy = b[0] - a[0], b[1] - a[1]
+        length = math.hypot(dx, dy)
+        return (-dy / length, dx / length)
+
+    half = width / 2
+    left = []
+    right = []
+    for i, point in enumerate(path):
+        normals = []
+        if i > 0:
+            normals.append( leftNormal(path[i-1], point) )
+        if i < len(path) - 1:
+            normals.append( leftNormal(point, path[i+1]) )
+        nx = sum(n[0] for n in normals)
+        ny = sum(n[1] for n in normals)
+        left.append( (point[0] + nx * half, point[1] + ny * half) )
+        right.append( (point[0] - nx * half, point[1] - ny * half) )
+
+    walls = polygonWalls(left + right[::-1])
+    heading = math.atan2(path[1][1] - path[0][1], path[1][0] - path[0][0])
+    #Start a little way into the corridor, and finish before the end wall
+    start = (path[0][0] + 200 * math.cos(heading), path[0][1] + 200 * math.sin(heading), heading)
+    endHeading = math.atan2(path[-1][1] - path[-2][1], path[-1][0] - path[-2][0])
+    finish = (path[-1][0] - 250 * math.cos(endHeading), path[-1][1] - 250 * math.sin(endHeading))
+    return walls, start, finish
+
+
+def straightCorridor(length=4000, width=600, startOffset=100):
+    """ Straight corridor for wall mid point following.
+        The robot starts startOffset mm to the right of the centre line.
+    """
+    walls, start, finish = corridorCourse([(0,0), (0,length)], width)
+    start = (start[0] + startOffset, start[1], start[2])
+    return Course("corridor", walls, start, finish)
+
+
+def mazeCourse(turnDirections=None, legLength=900, width=600):
+    """ Corridor with a 90 degree turn at the end of each leg, in the directions the
+        maze challenge turns are made (True = clockwise)
+    """
+    if turnDirections is None:
+        turnDirections = ad.mazeTurnDirections
+    x, y = 0, 0
+    heading = (0, 1)
+    path = [(x, y)]
+    for clockwise in turnDirections:
+        x, y = x + heading[0] * legLength, y + heading[1] * legLength
+        path.append( (x, y) )
+        if clockwise:
+            heading = (heading[1], -heading[0])
+        else:
+            heading = (-heading[1], heading[0])
+    path.append( (x + heading[0] * legLength, y + heading[1] * legLength) )
+    walls, start, finish = corridorCourse(path, width)
+    return Course("maze", walls, start, finish)
+
+
+def raycast(walls, x, y, angle, maxRange=sensorMaxRange):
+    """ Returns the distance from (x, y) along a ray at angle to the nearest wall, up to maxRange """
+    dx, dy = math.cos(angle), math.sin(angle)
+    nearest = maxRange
+    for (x1, y1), (x2, y2) in walls:
+        ex, ey = x2 - x1, y2 - y1
+        denom = dx * ey - dy * ex
+        if denom == 0:
+            continue
+        #Solve (x,y) + t(dx,dy) = (x1,y1) + u(ex,ey)
+        t = ((x1 - x) * ey - (y1 - y) * ex) / denom
+        u = ((x1 - x) * dy - (y1 - y) * dx) / denom
+        if 0 < t < nearest and 0 <= u <= 1:
+            nearest = t
+    return nearest
+
+
+def segmentsIntersect(a, b, c, d):
+    """ Returns True if line segment ab crosses segment cd """
+    def cross(o, p, q):
+        return (p[0] - o[0]) * (q[1] - o[1]) - (p[1] - o[1]) * (q[0] - o[0])
+    d1 = cross(c, d, a)
+    d2 = cross(c, d, b)
+    d3 = cross(a, b, c)
+    d4 = cross(a, b, d)
+    return (d1 > 0) != (d2 > 0) and (d3 > 0) != (d4 > 0)
+
+
+class SimulatedClock:
+    """ Clock which only advances when the simulation steps """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class SimRover:
+    """ Kinematic model of the four wheel steering rover.
+        Takes the same steering angles and motor powers as RobotControl.
+    """
+
+    def __init__(self, x, y, heading):
+        self.x = x
+        self.y = y
+        self.heading = heading
+        self.steering = 0
+        self.spotTurn = False
+        self.motorPowerL = 0
+        self.motorPowerR = 0
+        self.speedL = 0.0
+        self.speedR = 0.0
+        self.distance = 0.0
+
+    def setSteering(self, angle):
+        self.steering = angle
+        self.spotTurn = False
+
+    def spotTurnSteering(self, angle):
+        self.steering = angle
+        self.spotTurn = True
+
+    def setLeftMotorPower(self, power):
+        self.motorPowerL = power
+
+    def setRightMotorPower(self, power):
+        self.motorPowerR = power
+
+    def applyDriveCommand(self, command):
+        """ Sets the steering and motors from a DriveCommand, as AutonomousDriving.applyDriveCommand does """
+        if command.steering is not None:
+            if command.spotTurn:
+                self.spotTurnSteering(command.steering)
+            else:
+                self.setSteering(command.steering)
+        if command.leftPower is not None:
+            self.setLeftMotorPower(command.leftPower)
+        if command.rightPower is not None:
+            self.setRightMotorPower(command.rightPower)
+
+    def wheelAngles(self):
+        """ Returns the (front, rear) wheel angles in radians after the servo limits are applied.
+            Positive angles steer clockwise.
+        """
+        front = 90 - min(max(90 - self.steering, rc.servoMinAngle), rc.servoMaxAngle)
+        rear = min(max(90 + self.steering, rc.servoMinAngle), rc.servoMaxAngle) - 90
+        return math.radians(front), math.radians(rear)
+
+    def step(self, dt):
+        """ Advance the rover by a time step """
+        #Motor speeds respond with a first order lag
+        response = 1 - math.exp(-dt / motorTimeConstant)
+        self.speedL += (fullPowerSpeed * self.motorPowerL / 100 - self.speedL) * response
+        self.speedR += (fullPowerSpeed * self.motorPowerR / 100 - self.speedR) * response
+
+        if self.spotTurn:
+            #Wheels point tangential to a circle through all four wheels
+            radius = math.hypot(wheelBase / 2, trackWidth / 2)
+            speed = 0.0
+            yawRate = -(self.speedL - self.speedR) / (2 * radius)
+        else:
+            front, rear = self.wheelAngles()
+            speed = (self.speedL + self.speedR) / 2
+            yawRate = -speed * (math.tan(front) + math.tan(rear)) / wheelBase
+
+        self.heading += yawRate * dt
+        self.x += speed * math.cos(self.heading) * dt
+        self.y += speed * math.sin(self.heading) * dt
+        self.distance += abs(speed) * dt
+
+    def corners(self):
+        """ Returns the corners of the robot footprint """
+        c, s = math.cos(self.heading), math.sin(self.heading)
+        halfL, halfW = robotLength / 2, robotWidth / 2
+        return [ (self.x + c * l - s * w, self.y + s * l + c * w)
+            for l, w in ((halfL, halfW), (halfL, -halfW), (-halfL, -halfW), (-halfL, halfW)) ]
+
+    def sensorReadings(self, walls, noise=0.0, rng=None):
+        """ Returns the (left, right, front) sensor distances in mm """
+        c, s = math.cos(self.heading), math.sin(self.heading)
+        halfL, halfW = robotLength / 2, robotWidth / 2
+        left = raycast(walls, self.x - s * halfW, self.y + c * halfW, self.heading + math.pi / 2)
+        right = raycast(walls, self.x + s * halfW, self.y - c * halfW, self.heading - math.pi / 2)
+        front = raycast(walls, self.x + c * halfL, self.y + s * halfL, self.heading)
+        readings = [left, right, front]
+        if noise > 0 and rng is not None:
+            readings = [ max(0, d + rng.gauss(0, noise)) for d in readings ]
+        return tuple( int(d) for d in readings )
+
+
+def isColliding(rover, walls):
+    """ Returns True if the robot footprint crosses any wall """
+    corners = rover.corners()
+    reach = math.hypot(robotLength, robotWidth) / 2
+    for a, b in walls:
+        #Skip walls whose bounding box is out of reach of the robot
+        if (max(a[0], b[0]) < rover.x - reach or min(a[0], b[0]) > rover.x + reach or
+                max(a[1], b[1]) < rover.y - reach or min(a[1], b[1]) > rover.y + reach):
+            continue
+        for i in range(4):
+            if segmentsIntersect(corners[i], corners[(i+1) % 4], a, b):
+                return True
+    return False
+
+
+def runCourse(course, maze=False, controlRate=None, timeStep=defaultTimeStep, maxTime=defaultMaxTime,
+        noise=0.0, seed=0, keepTrace=False):
+    """ Drive a course with the autonomous driving code, using the current gains and
+        settings in AutonomousDriving. In maze mode the robot turns on the spot at each
+        junction as AutonomousDriver.mazeTurn does, in the directions of ad.mazeTurnDirections.
+        Returns a RunResult.
+    """
+    if controlRate is None:
+        controlRate = ad.autoControlRate
+    controlPeriod = 1 / controlRate
+    rng = random.Random(seed)
+    rover = SimRover(*course.start)
+    clock = SimulatedClock()
+
+    mazeState = 0
+    turnState = None #None while wall following, otherwise "turning" or "drivingOn"
+    turnEnds = 0.0
+    motorPower = 0 #Power the autonomous driving last set the motors to
+    lastSteering = 0
+    steeringEffort = 0.0
+    offsetTotal = 0.0
+    maxOffset = 0.0
+    controlSteps = 0
+    trace = []
+    nextControl = 0.0
+    finished = crashed = False
+
+    ad.initialisePID(clock=clock.time)
+    while clock.now < maxTime:
+        if clock.now >= nextControl:
+            nextControl += controlPeriod
+            leftDist, rightDist, frontDist = rover.sensorReadings(course.walls, noise, rng)
+            command = None
+
+            if turnState == "turning":
+                if clock.now >= turnEnds:
+                    rover.applyDriveCommand( ad.DriveCommand(0, False, 0, 0) )
+                    turnState = None
+                    ad.pid.reset()
+                    if frontDist > ad.minFrontDist:
+                        #Drive forwards for a short time after the turn
+                        command = ad.DriveCommand(None, False, 100, 100)
+                        turnState = "drivingOn"
+                        turnEnds = clock.now + ad.mazeDriveOnTime
+            elif turnState == "drivingOn":
+                if clock.now >= turnEnds:
+                    turnState = None
+                    mazeState += 1
+            elif maze and frontDist < ad.minFrontDist:
+                if mazeState < len(ad.mazeTurnDirections):
+                    speedR = -100 if ad.mazeTurnDirections[mazeState] else 100
+                    command = ad.DriveCommand(40, True, -speedR, speedR)
+                    turnState = "turning"
+                    turnEnds = clock.now + ad.mazeTurnTime
+                else:
+                    command = ad.DriveCommand(0, False, 0, 0)
+            else:
+                command = ad.wallMidPointCommand(leftDist, rightDist, frontDist, motorPower, controlPeriod)
+                #Measure how far off centre the robot is while following the walls
+                if leftDist < sensorMaxRange and rightDist < sensorMaxRange:
+                    offset = abs(leftDist - rightDist) / 2
+                    offsetTotal += offset
+                    maxOffset = max(maxOffset, offset)
+                    controlSteps += 1
+
+            if command is not None:
+                if command.leftPower is not None:
+                    motorPower = command.leftPower
+                if command.steering is not None and not command.spotTurn:
+                    steeringEffort += abs(command.steering - lastSteering)
+                    lastSteering = command.steering
+                rover.applyDriveCommand(command)
+
+        rover.step(timeStep)
+        clock.now += timeStep
+        if keepTrace:
+            trace.append( (clock.now, rover.x, rover.y, rover.heading) )
+
+        if isColliding(rover, course.walls):
+            crashed = True
+            break
+        if math.hypot(rover.x - course.finish[0], rover.y - course.finish[1]) < course.finishRadius:
+            finished = True
+            break
+
+    return RunResult(finished, crashed, clock.now, rover.distance,
+        offsetTotal / max(1, controlSteps), maxOffset, steeringEffort, mazeState, trace)
+
+
+def runCourseBatch(course, params, controlRate=None, timeStep=defaultTimeStep, maxTime=defaultMaxTime,
+        noise=0.0, seed=0):
+    """ Drive a course with many settings of the autonomous driving at once, stepping all the
+        rovers together with NumPy arrays and a BatchPID. params is a dictionary of per rover
+        values for any of Pk, Ik, Dk, maxSteeringAngle and minFrontDist (others are taken from
+        AutonomousDriving). Only wall mid point following is modelled (no maze turns).
+        Gives the same results as runCourse for each setting when there is no sensor noise.
+        Returns a list of RunResult (without traces).
+    """
+    import numpy as np
+    from BatchPID import BatchPID
+
+    if controlRate is None:
+        controlRate = ad.autoControlRate
+    controlPeriod = 1 / controlRate
+    n = len( next(iter(params.values())) )
+
+    def parameter(name):
+        return np.broadcast_to( np.asarray(params.get(name, getattr(ad, name)), dtype=float), (n,) )
+
+    pid = BatchPID(parameter("Pk"), parameter("Ik"), parameter("Dk"), derivativeFilter=ad.derivativeFilterTime)
+    rng = np.random.default_rng(seed)
+
+    walls = np.array(course.walls, dtype=float)
+    wallStart, wallEnd = walls[:,0,:], walls[:,1,:]
+    halfL, halfW = robotLength / 2, robotWidth / 2
+    response = 1 - math.exp(-timeStep / motorTimeConstant)
+    footprint = np.array([ (halfL, halfW), (halfL, -halfW), (-halfL, -halfW), (-halfL, halfW) ])
+
+    #State of the rovers still running. Rovers which crash or finish are removed, with their
+    #results stored at their index in the result arrays.
+    index = np.arange(n)
+    state = {
+        "maxSteeringAngle": parameter("maxSteeringAngle").copy(),
+        "minFrontDist": parameter("minFrontDist").copy(),
+        "x": np.full(n, float(course.start[0])),
+        "y": np.full(n, float(course.start[1])),
+        "heading": np.full(n, float(course.start[2])),
+        "speed": np.zeros(n),
+        "steering": np.zeros(n),
+        "motorPower": np.zeros(n),
+        "distance": np.zeros(n),
+        "steeringEffort": np.zeros(n),
+        "offsetTotal": np.zeros(n),
+        "maxOffset": np.zeros(n),
+        "controlSteps": np.zeros(n),
+        }
+    results = { name: np.zeros(n) for name in ("distance", "steeringEffort", "offsetTotal", "maxOffset", "controlSteps") }
+    crashed = np.zeros(n, dtype=bool)
+    finished = np.zeros(n, dtype=bool)
+    endTime = np.full(n, float(maxTime))
+
+    def storeResults(rows, now):
+        for name in results:
+            results[name][index[rows]] = state[name][rows]
+        endTime[index[rows]] = now
+
+    def raycastBatch(ox, oy, angle):
+        dx, dy = np.cos(angle)[:,None], np.sin(angle)[:,None]
+        ex, ey = (wallEnd - wallStart)[:,0], (wallEnd - wallStart)[:,1]
+        rx, ry = wallStart[:,0] - ox[:,None], wallStart[:,1] - oy[:,None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            denom = dx * ey - dy * ex
+            t = (rx * ey - ry * ex) / denom
+            u = (rx * dy - ry * dx) / denom
+        valid = (denom != 0) & (t > 0) & (t < sensorMaxRange) & (u >= 0) & (u <= 1)
+        return np.where(valid, t, sensorMaxRange).min(axis=1)
+
+    def cross(o, p, q):
+        return (p[...,0] - o[...,0]) * (q[...,1] - o[...,1]) - (p[...,1] - o[...,1]) * (q[...,0] - o[...,0])
+
+    now = 0.0
+    nextControl = 0.0
+    while now < maxTime and len(index) > 0:
+        x, y, heading = state["x"], state["y"], state["heading"]
+        if now >= nextControl:
+            nextControl += controlPeriod
+            c, s = np.cos(heading), np.sin(heading)
+            readings = [ raycastBatch(x - s * halfW, y + c * halfW, heading + math.pi / 2),
+                raycastBatch(x + s * halfW, y - c * halfW, heading - math.pi / 2),
+                raycastBatch(x + c * halfL, y + s * halfL, heading) ]
+            if noise > 0:
+                readings = [ np.maximum(0, d + rng.normal(0, noise, len(index))) for d in readings ]
+            leftDist, rightDist, frontDist = [ np.floor(d) for d in readings ]
+
+            #Vectorised wallMidPointCommand
+            wallSep = rightDist + leftDist
+            ratio = ((wallSep / 2) - rightDist) * 2 / wallSep
+            angle = state["maxSteeringAngle"] * pid.update(ratio, controlPeriod) * 2
+            motorPower = state["motorPower"]
+            state["motorPower"] = np.where(frontDist < state["minFrontDist"], 0, np.where(motorPower == 0, 100, motorPower))
+
+            offset = np.abs(leftDist - rightDist) / 2
+            measured = (leftDist < sensorMaxRange) & (rightDist < sensorMaxRange)
+            state["offsetTotal"] += np.where(measured, offset, 0)
+            state["maxOffset"] = np.where(measured, np.maximum(state["maxOffset"], offset), state["maxOffset"])
+            state["controlSteps"] += measured
+            state["steeringEffort"] += np.abs(angle - state["steering"])
+            state["steering"] = angle
+
+        #Vectorised SimRover.step
+        steering = state["steering"]
+        front = np.radians( 90 - np.clip(90 - steering, rc.servoMinAngle, rc.servoMaxAngle) )
+        rear = np.radians( np.clip(90 + steering, rc.servoMinAngle, rc.servoMaxAngle) - 90 )
+        speed = state["speed"] + (fullPowerSpeed * state["motorPower"] / 100 - state["speed"]) * response
+        heading = heading + -speed * (np.tan(front) + np.tan(rear)) / wheelBase * timeStep
+        x = x + speed * np.cos(heading) * timeStep
+        y = y + speed * np.sin(heading) * timeStep
+        state["speed"], state["heading"], state["x"], state["y"] = speed, heading, x, y
+        state["distance"] += np.abs(speed) * timeStep
+        now += timeStep
+
+        #Vectorised isColliding over the 4 footprint edges and all walls
+        c, s = np.cos(heading), np.sin(heading)
+        corners = np.stack([ x[:,None] + c[:,None] * footprint[:,0] - s[:,None] * footprint[:,1],
+            y[:,None] + s[:,None] * footprint[:,0] + c[:,None] * footprint[:,1] ], axis=-1)
+        a = corners[:,:,None,:]
+        b = np.roll(corners, -1, axis=1)[:,:,None,:]
+        d1 = cross(wallStart, wallEnd, a)
+        d2 = cross(wallStart, wallEnd, b)
+        d3 = cross(a, b, wallStart)
+        d4 = cross(a, b, wallEnd)
+        hit = (((d1 > 0) != (d2 > 0)) & ((d3 > 0) != (d4 > 0))).any(axis=(1,2))
+        done = hit | (np.hypot(x - course.finish[0], y - course.finish[1]) < course.finishRadius)
+
+        if done.any():
+            crashed[index[hit]] = True
+            finished[index[done & ~hit]] = True
+            storeResults(done, now)
+            keep = ~done
+            index = index[keep]
+            for name in state:
+                state[name] = state[name][keep]
+            pid.select(keep)
+
+    storeResults(np.ones(len(index), dtype=bool), now)
+    return [ RunResult(bool(finished[i]), bool(crashed[i]), float(endTime[i]), float(results["distance"][i]),
+        float(results["offsetTotal"][i] / max(1, results["controlSteps"][i])), float(results["maxOffset"][i]),
+        float(results["steeringEffort"][i]), 0, [])
+        for i in range(n) ]
+
+
+def main():
+    import time
+
+    courseName = sys.argv[1] if len(sys.argv) > 1 else "corridor"
+    if courseName == "maze":
+        course = mazeCourse()
+    else:
+        course = straightCorridor()
+
+    start = time.perf_counter()
+    result = runCourse(course, maze=(courseName == "maze"))
+    elapsed = time.perf_counter() - start
+
+    print("Course: {}  Pk {} Ik {} Dk {}  Max steer {}".format(course.name, ad.Pk, ad.Ik, ad.Dk, ad.maxSteeringAngle))
+    print("Finished: {}  Crashed: {}  Time: {:.2f}s  Distance: {:.0f}mm  Maze state: {}".format(
+        result.finished, result.crashed, result.time, result.distance, result.mazeState))
+    print("Mean offset: {:.1f}mm  Max offset: {:.1f}mm  Steering effort: {:.0f}".format(
+        result.meanOffset, result.maxOffset, result.steeringEffort))
+    print("Simulated in {:.1f}ms".format(elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
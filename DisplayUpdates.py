@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+""" Dirty rectangle tracking for the Rocky Rover display.
+    Drawing code marks the regions of the screen it changes, and update() pushes just
+    those regions to the display. When the changed area is a large part of the screen
+    a full flip is used instead, as it is quicker than many partial updates.
+"""
+
+import pygame
+
+#Fraction of the screen area above which a full flip is used instead of a partial update
+fullUpdateThreshold = 0.5
+
+dirtyRects = []
+fullUpdate = False
+fullUpdates = 0
+partialUpdates = 0
+
+
+def markDirty(rect):
+    """ Mark a region of the screen as changed """
+    if rect is not None:
+        dirtyRects.append( pygame.Rect(rect) )
+
+
+def markAllDirty(rects):
+    """ Mark a list of regions of the screen as changed """
+    for rect in rects:
+        markDirty(rect)
+
+
+def markFullScreen():
+    """ Mark the whole screen as changed """
+    global fullUpdate
+    fullUpdate = True
+
+
+def update():
+    """ Push the changed regions of the screen to the display """
+    global fullUpdate, fullUpdates, partialUpdates
+
+    screen = pygame.display.get_surface()
+    if screen is None:
+        return
+
+    if not fullUpdate and len(dirtyRects) > 0:
+        screenRect = screen.get_rect()
+        rects = [ rect.clip(screenRect) for rect in dirtyRects ]
+        area = sum( rect.width * rect.height for rect in rects )
+        if area > fullUpdateThreshold * screenRect.width * screenRect.height:
+            fullUpdate = True
+        else:
+            pygame.display.update(rects)
+            partialUpdates += 1
+
+    if fullUpdate:
+        pygame.display.flip()
+        fullUpdates += 1
+
+    fullUpdate = False
+    dirtyRects.clear()
+
+
+def getStats():
+    """ Returns a dictionary of the number of full and partial display updates made """
+    return {
+        "full": fullUpdates,
+        "partial": partialUpdates,
+        }
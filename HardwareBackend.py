@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+""" Selects the hardware used by the Rocky Rover robot code.
+    By default the real robot libraries are used. Setting the environment variable
+    ROCKY_HARDWARE=sim replaces every device with the models in SimulatedHardware,
+    so the full control loop can be run and benchmarked without a robot.
+    The hardware libraries are only imported when a device is created, so neither
+    backend needs the other's libraries to be installed.
+"""
+
+import os
+
+backendEnvVar = "ROCKY_HARDWARE"
+backendName = os.environ.get(backendEnvVar, "real").lower()
+
+
+def isSimulated():
+    return backendName == "sim"
+
+
+def useBackend(name):
+    """ Switch backend ('real' or 'sim'). Only affects devices created after the call. """
+    global backendName
+    backendName = name.lower()
+
+
+def createSentinelBoard():
+    """ Returns the Sentinel board driving the steering servos and motors """
+    if isSimulated():
+        import SimulatedHardware as sim
+        return sim.SimSentinelBoard()
+    from sentinelboard import SentinelBoard
+    return SentinelBoard()
+
+
+def createPWM(address, debug=False):
+    """ Returns a PCA9685 PWM board driver """
+    if isSimulated():
+        import SimulatedHardware as sim
+        return sim.SimPWM(address, debug=debug)
+    from Adafruit_PWM_Servo_Driver import PWM
+    return PWM(address, debug=debug)
+
+
+def createI2C():
+    """ Returns the I2C bus used by the time of flight sensors """
+    if isSimulated():
+        import SimulatedHardware as sim
+        return sim.bus
+    import board
+    return board.I2C()
+
+
+def createVL53L1X(i2c):
+    """ Returns a VL53L1X time of flight sensor on the I2C bus """
+    if isSimulated():
+        import SimulatedHardware as sim
+        return sim.SimVL53L1X(i2c)
+    import adafruit_vl53l1x
+    return adafruit_vl53l1x.VL53L1X(i2c)
+
+
+def createLEDMatrix(address):
+    """ Returns a 5x5 RGB LED matrix display """
+    if isSimulated():
+        import SimulatedHardware as sim
+        return sim.SimLEDMatrix(address)
+    from rgbmatrix5x5 import RGBMatrix5x5
+    return RGBMatrix5x5(address)
+
+
+def createRobotController(name, initStatus, **handlers):
+    """ Returns the game controller, which calls the handlers when its inputs change """
+    if isSimulated():
+        import SimulatedHardware as sim
+        return sim.SimRobotController(name, initStatus, **handlers)
+    from pygamecontroller import RobotController
+    return RobotController(name, initStatus, **handlers)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+""" Registry of the hardware devices used by the Rocky Rover robot.
+    Devices are opened on first use, or in parallel background threads by calling
+    startInBackground(), so slow device probing does not hold up start up.
+    The time taken to initialise each device is recorded for reporting.
+"""
+
+import threading, time
+
+devices = {}
+
+
+class LazyDevice:
+    """ Proxy for a hardware device which is created by calling factory() on first use.
+        Attribute access is passed through to the device, so the proxy can be used in
+        place of the device object itself.
+    """
+
+    def __init__(self, name, factory):
+        self._name = name
+        self._factory = factory
+        self._device = None
+        self._error = None
+        self._done = False
+        self._lock = threading.Lock()
+        self.initTime = None
+        devices[name] = self
+
+    def get(self):
+        """ Returns the device, initialising it first if needed.
+            Waits if the device is being initialised on another thread.
+            Raises the initialisation error if the device could not be opened.
+        """
+        if not self._done:
+            with self._lock:
+                if not self._done:
+                    start = time.perf_counter()
+                    try:
+                        self._device = self._factory()
+                    except Exception as e:
+                        self._error = e
+                    self.initTime = time.perf_counter() - start
+                    self._done = True
+        if self._error is not None:
+            raise self._error
+        return self._device
+
+    def tryGet(self):
+        """ Returns the device, or None if it could not be opened """
+        try:
+            return self.get()
+        except Exception:
+            return None
+
+    def isInitialised(self):
+        return self._done
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def startInBackground(names=None):
+    """ Initialise devices in parallel worker threads.
+        Initialises all registered devices unless a list of names is given.
+        Returns the list of threads started.
+    """
+    if names is None:
+        names = list(devices)
+
+    threads = []
+    for name in names:
+        device = devices[name]
+        if not device.isInitialised():
+            thread = threading.Thread(target=device.tryGet, daemon=True)
+            thread.start()
+            threads.append(thread)
+    return threads
+
+
+def report():
+    """ Returns a list of (name, init time in seconds, status) for each registered device """
+    lines = []
+    for name, device in devices.items():
+        if not device.isInitialised():
+            status = "pending"
+        elif device._error is not None:
+            status = "failed: {}".format(device._error)
+        else:
+            status = "ok"
+        lines.append( (name, device.initTime, status) )
+    return lines
+
+
+def printReport():
+    """ Print the initialisation time and status of each device """
+    for name, initTime, status in report():
+        if initTime is None:
+            print("{:<16} {}".format(name, status))
+        else:
+            print("{:<16} {:7.3f}s {}".format(name, initTime, status))
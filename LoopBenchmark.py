@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+""" Benchmark of the complete Rocky Rover main loop on simulated hardware.
+    Runs RockyRover.main() with the simulated hardware backend and a scripted game
+    controller under the SDL dummy video driver, then reports the rate each scheduled
+    task achieved, deadline misses and skips, main loop stage latencies and I2C bus usage.
+
+    Usage:
+        python3 LoopBenchmark.py [--duration SECONDS] [--no-bus-latency]
+"""
+
+import os, time, argparse
+
+os.environ["ROCKY_HARDWARE"] = "sim"
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Rocky Rover main loop on simulated hardware")
+    parser.add_argument("--duration", type=float, help="Seconds to run for (default is the length of the controller script)")
+    parser.add_argument("--no-bus-latency", action="store_true", help="Do not model I2C transaction times")
+    args = parser.parse_args()
+
+    #Images are loaded relative to the robot code folder
+    os.chdir( os.path.dirname( os.path.abspath(__file__) ) )
+
+    import SimulatedHardware as sim
+    if args.duration is not None:
+        os.environ[sim.simDurationEnvVar] = str(args.duration)
+    if args.no_bus_latency:
+        sim.bus.latencyScale = 0
+
+    import RockyRover as rr
+    import RobotControl as rc
+    import LoopTiming
+
+    start = time.perf_counter()
+    rr.main()
+    elapsed = time.perf_counter() - start
+
+    print()
+    print("Ran for {:.1f}s".format(elapsed))
+    print("{:<10} {:>8} {:>8} {:>8} {:>8} {:>10}".format("Task", "target", "achieved", "misses", "skips", "max ms"))
+    for task in rr.scheduler.tasks:
+        print("{:<10} {:>8.1f} {:>8.1f} {:>8} {:>8} {:>10.2f}".format(task.name, 1 / task.period,
+            task.runs / elapsed, task.misses, task.skips, task.maxDuration * 1000))
+
+    print()
+    print("{:<16} {:>9} {:>9} {:>9} {:>9}".format("Stage", "p50 ms", "p95 ms", "p99 ms", "Count"))
+    for name, p50, p95, p99, count in LoopTiming.summary():
+        print("{:<16} {:>9.2f} {:>9.2f} {:>9.2f} {:>9}".format(name, p50, p95, p99, count))
+
+    stats = sim.bus.getStats()
+    print()
+    print("I2C bus: {} transactions, {} bytes, {:.1f}% busy".format(stats["transactions"], stats["bytes"],
+        100 * stats["busyTime"] / elapsed))
+    if rc.sb.isInitialised():
+        print("Watchdog trips: {}".format(rc.sb.watchdogTrips))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+""" Fixed rate task scheduler for the Rocky Rover main loop.
+    Each task runs at a declared rate against time.perf_counter() deadlines. The
+    scheduler only sleeps for the time remaining until the next deadline, and skips
+    lower priority tasks when a higher priority task is already due again.
+"""
+
+import time
+
+
+class Task:
+    """ A callback run by the scheduler at a fixed rate """
+
+    def __init__(self, name, rate, callback, priority):
+        self.name = name
+        self.period = 1.0 / rate
+        self.callback = callback
+        self.priority = priority #Lower values are higher priority
+        self.nextDeadline = 0.0
+        self.runs = 0
+        self.misses = 0 #Number of times the task started more than one period late
+        self.skips = 0 #Number of times the task was skipped to keep higher priority tasks on time
+        self.lastDuration = 0.0
+        self.maxDuration = 0.0
+
+
+class Scheduler:
+    """ Runs tasks at fixed rates until stopped """
+
+    def __init__(self):
+        self.tasks = []
+        self.running = False
+
+    def addTask(self, name, rate, callback, priority=0):
+        """ Add a task to run 'rate' times per second.
+            Tasks with lower priority values run first, and are never skipped
+            in favour of tasks with higher priority values.
+        """
+        task = Task(name, rate, callback, priority)
+        task.nextDeadline = time.perf_counter()
+        self.tasks.append(task)
+        self.tasks.sort(key=lambda t: t.priority)
+        return task
+
+    def stop(self):
+        """ Stop the scheduler after the current task completes """
+        self.running = False
+
+    def runPending(self):
+        """ Runs all tasks which are due, in priority order.
+            Returns the time in seconds until the next task is due.
+        """
+        for task in self.tasks:
+            if not self.running:
+                break
+
+            now = time.perf_counter()
+            if now < task.nextDeadline:
+                continue
+
+            #Skip this task if a higher priority task is already due again
+            overBudget = False
+            for other in self.tasks:
+                if other.priority >= task.priority:
+                    break
+                if now >= other.nextDeadline:
+                    overBudget = True
+                    break
+
+            if overBudget:
+                task.skips += 1
+            else:
+                if now - task.nextDeadline > task.period:
+                    task.misses += 1
+                task.callback()
+                task.runs += 1
+                end = time.perf_counter()
+                task.lastDuration = end - now
+                if task.lastDuration > task.maxDuration:
+                    task.maxDuration = task.lastDuration
+
+            #Schedule next run, without trying to catch up on missed periods
+            task.nextDeadline += task.period
+            if task.nextDeadline < now:
+                task.nextDeadline = now + task.period
+
+        if len(self.tasks) == 0:
+            return 0.0
+        return min(task.nextDeadline for task in self.tasks) - time.perf_counter()
+
+    def run(self):
+        """ Run tasks until stop() is called, sleeping only for the time remaining until the next deadline """
+        self.running = True
+        start = time.perf_counter()
+        for task in self.tasks:
+            task.nextDeadline = start
+
+        while self.running:
+            remaining = self.runPending()
+            if remaining > 0 and self.running:
+                time.sleep(remaining)
+
+    def getStats(self):
+        """ Returns a dictionary of run, miss and skip counts for each task """
+        return { task.name: {
+                    "runs": task.runs,
+                    "misses": task.misses,
+                    "skips": task.skips,
+                    "maxDuration": task.maxDuration,
+                    } for task in self.tasks }
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+""" Low overhead timing of the stages of the Rocky Rover main loop.
+    Each stage keeps its most recent durations in a preallocated ring buffer,
+    from which rolling percentiles are calculated when requested. Stages can be
+    timed from several threads at once.
+
+    Usage:
+        with LoopTiming.stage("sensors"):
+            readSensors()
+"""
+
+import time, threading
+
+samplesPerStage = 512
+stages = {}
+stagesLock = threading.Lock()
+
+
+class StageSection:
+    """ Context manager timing one run of a stage. Each run has its own start time,
+        so overlapping runs on different threads do not disturb each other.
+    """
+
+    __slots__ = ("timer", "startTime")
+
+    def __init__(self, timer):
+        self.timer = timer
+        self.startTime = 0.0
+
+    def __enter__(self):
+        self.startTime = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.timer.record(time.perf_counter() - self.startTime)
+        return False
+
+
+class StageTimer:
+    """ Records durations of one stage. Use time() as a context manager around the stage. """
+
+    def __init__(self, name, size=samplesPerStage):
+        self.name = name
+        self.size = size
+        self.samples = [0.0] * size
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def time(self):
+        """ Returns a context manager which records the duration of the code it surrounds """
+        return StageSection(self)
+
+    def record(self, duration):
+        """ Store a duration (in seconds) """
+        with self.lock:
+            self.samples[self.count % self.size] = duration
+            self.count += 1
+
+    def percentiles(self, points=(50, 95, 99)):
+        """ Returns a list of the requested percentiles (in seconds) of the recorded durations """
+        with self.lock:
+            n = min(self.count, self.size)
+            ordered = sorted(self.samples[:n])
+        if n == 0:
+            return [0.0 for p in points]
+        return [ ordered[min(n - 1, int(n * p / 100))] for p in points ]
+
+
+def stage(name):
+    """ Returns a context manager timing one run of a named stage, creating the stage on first use """
+    timer = stages.get(name)
+    if timer is None:
+        with stagesLock:
+            timer = stages.get(name)
+            if timer is None:
+                timer = StageTimer(name)
+                stages[name] = timer
+    return StageSection(timer)
+
+
+def summary():
+    """ Returns a list of (name, p50, p95, p99, count) tuples, with times in milliseconds """
+    lines = []
+    with stagesLock:
+        timers = list( stages.items() )
+    for name, timer in timers:
+        p50, p95, p99 = timer.percentiles()
+        lines.append( (name, p50 * 1000, p95 * 1000, p99 * 1000, timer.count) )
+    return lines
+
+
+def dump(filename):
+    """ Write a table of the stage timing percentiles to a file """
+    with open(filename, "w") as f:
+        f.write("{:<16} {:>9} {:>9} {:>9} {:>9}\n".format("Stage", "p50 ms", "p95 ms", "p99 ms", "Count"))
+        for name, p50, p95, p99, count in summary():
+            f.write("{:<16} {:>9.2f} {:>9.2f} {:>9.2f} {:>9}\n".format(name, p50, p95, p99, count))
@@ -33,17 +33,26 @@ import time
 
 class PID:
     """PID Controller
+
+    The time between updates is read from clock (time.monotonic by default), or can be
+    passed to update() as dt to step the controller at a fixed rate (e.g. in simulation).
     """
 
-    def __init__(self, P=0.2, I=0.0, D=0.0):
+    __slots__ = ("Kp", "Ki", "Kd", "clock", "sample_time", "current_time", "last_time",
+                 "SetPoint", "PTerm", "ITerm", "DTerm", "last_error", "int_error",
+                 "windup_guard", "derivative_filter", "output")
+
+    def __init__(self, P=0.2, I=0.0, D=0.0, clock=time.monotonic):
 
         self.Kp = P
         self.Ki = I
         self.Kd = D
 
+        self.clock = clock
         self.sample_time = 0.00
-        self.current_time = time.time()
+        self.current_time = clock()
         self.last_time = self.current_time
+        self.derivative_filter = 0.0
 
         self.clear()
 
@@ -62,9 +71,24 @@ class PID:
 
         self.output = 0.0
 
-    def update(self, feedback_value):
+    def reset(self):
+        """Clears the accumulated error and timing, keeping the gains and set point.
+        The next update starts afresh, with no derivative kick from the old error."""
+        self.current_time = self.clock()
+        self.last_time = self.current_time
+        self.PTerm = 0.0
+        self.ITerm = 0.0
+        self.DTerm = 0.0
+        self.last_error = None
+        self.output = 0.0
+
+    def update(self, feedback_value, dt=None):
         """Calculates PID value for given reference feedback
 
+        If dt is given it is used as the time since the last update, and the update is always
+        made. Otherwise the time is read from the clock, and the update is skipped if less
+        than sample_time has passed.
+
         .. math::
             u(t) = K_p e(t) + K_i \int_{0}^{t} e(t)dt + K_d {de}/{dt}
 
@@ -76,28 +100,43 @@ class PID:
         """
         error = self.SetPoint - feedback_value
 
-        self.current_time = time.time()
-        delta_time = self.current_time - self.last_time
+        if dt is None:
+            self.current_time = self.clock()
+            delta_time = self.current_time - self.last_time
+            if delta_time < self.sample_time:
+                return
+        else:
+            delta_time = dt
+            self.current_time = self.last_time + dt
+        if self.last_error is None:
+            # First update after a reset, so there is no change of error yet
+            self.last_error = error
         delta_error = error - self.last_error
 
-        if (delta_time >= self.sample_time):
-            self.PTerm = self.Kp * error
-            self.ITerm += error * delta_time
-
-            if (self.ITerm < -self.windup_guard):
-                self.ITerm = -self.windup_guard
-            elif (self.ITerm > self.windup_guard):
-                self.ITerm = self.windup_guard
-
+        self.PTerm = self.Kp * error
+        self.ITerm += error * delta_time
+
+        if (self.ITerm < -self.windup_guard):
+            self.ITerm = -self.windup_guard
+        elif (self.ITerm > self.windup_guard):
+            self.ITerm = self.windup_guard
+
+        if delta_time > 0:
+            derivative = delta_error / delta_time
+            if self.derivative_filter > 0:
+                # First order low pass filter of the derivative, with time constant derivative_filter
+                alpha = delta_time / (self.derivative_filter + delta_time)
+                self.DTerm += alpha * (derivative - self.DTerm)
+            else:
+                self.DTerm = derivative
+        else:
             self.DTerm = 0.0
-            if delta_time > 0:
-                self.DTerm = delta_error / delta_time
 
-            # Remember last time and last error for next calculation
-            self.last_time = self.current_time
-            self.last_error = error
+        # Remember last time and last error for next calculation
+        self.last_time = self.current_time
+        self.last_error = error
 
-            self.output = self.PTerm + (self.Ki * self.ITerm) + (self.Kd * self.DTerm)
+        self.output = self.PTerm + (self.Ki * self.ITerm) + (self.Kd * self.DTerm)
 
     def setKp(self, proportional_gain):
         """Determines how aggressively the PID reacts to the current error with setting Proportional Gain"""
@@ -123,6 +162,12 @@ class PID:
         """
         self.windup_guard = windup
 
+    def setDerivativeFilter(self, time_constant):
+        """Time constant in seconds of a low pass filter on the derivative term, to reduce
+        the effect of sensor noise. Zero turns the filter off.
+        """
+        self.derivative_filter = time_constant
+
     def setSampleTime(self, sample_time):
         """PID that should be updated at a regular interval.
         Based on a pre-determined sampe time, the PID decides if it should compute or return immediately.
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+""" Tuning of the Rocky Rover autonomous driving parameters in simulation.
+    Candidate settings of Pk, Ik, Dk, maxSteeringAngle and minFrontDist are run over
+    simulated courses by CourseSimulator, spread across all CPU cores with a process
+    pool. Each candidate is scored on completing the courses, wall clearance,
+    oscillation of the steering and completion time, and a ranked table is written
+    to a CSV file.
+
+    Usage:
+        python3 PIDTuner.py --Pk 0.1:0.6:0.05 --Dk 0,0.05,0.1    #Grid search
+        python3 PIDTuner.py --adaptive --iterations 20            #Adaptive search from the current settings
+        python3 PIDTuner.py --batch --Pk 0:1.5:0.01 --Dk 0:0.5:0.01  #Large corridor grid with vectorised runs
+"""
+
+import os, csv, random, argparse
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("ROCKY_HARDWARE", "sim")
+
+import AutonomousDriving as ad
+import CourseSimulator as cs
+
+#Parameters which can be tuned, with the step used by the controller hat (the starting step for adaptive search)
+tunedParameters = {
+    "Pk": 0.05,
+    "Ik": 0.01,
+    "Dk": 0.01,
+    "maxSteeringAngle": 5,
+    "minFrontDist": 10,
+    }
+
+#Score weights (lower scores are better)
+crashPenalty = 1000
+unfinishedPenalty = 500
+timeWeight = 5 #Per second to complete a course
+offsetWeight = 0.5 #Per mm mean distance from the corridor centre line
+maxOffsetWeight = 0.1 #Per mm furthest distance from the corridor centre line
+effortWeight = 0.05 #Per degree per second of steering change (oscillation)
+
+defaultOutputFile = "pid_tuning.csv"
+corridorStartOffsets = [100, -150]
+
+
+def makeCourses(names):
+    """ Returns a list of (course, maze) to evaluate each candidate on """
+    courses = []
+    for name in names:
+        if name == "corridor":
+            for offset in corridorStartOffsets:
+                courses.append( (cs.straightCorridor(startOffset=offset), False) )
+        elif name == "maze":
+            courses.append( (cs.mazeCourse(), True) )
+        else:
+            raise ValueError("Unknown course: {}".format(name))
+    return courses
+
+
+def scoreRun(result):
+    """ Returns the score of one simulated run """
+    score = result.time * timeWeight
+    if result.crashed:
+        score += crashPenalty
+    elif not result.finished:
+        score += unfinishedPenalty
+    score += result.meanOffset * offsetWeight
+    score += result.maxOffset * maxOffsetWeight
+    score += result.steeringEffort / max(result.time, 0.1) * effortWeight
+    return score
+
+
+def evaluate(task):
+    """ Run one candidate over the courses. Runs in a worker process.
+        task is a tuple of (parameters dictionary, course names, sensor noise, seed).
+        Returns a dictionary of the parameters, score and run statistics.
+    """
+    params, courseNames, noise, seed = task
+    for name, value in params.items():
+        setattr(ad, name, value)
+
+    results = []
+    for index, (course, maze) in enumerate( makeCourses(courseNames) ):
+        results.append( cs.runCourse(course, maze=maze, noise=noise, seed=seed + index) )
+    return summariseRuns(params, results)
+
+
+def evaluateBatch(task):
+    """ Run a chunk of candidates over the corridor courses together with
+        CourseSimulator.runCourseBatch. Runs in a worker process.
+        task is a tuple of (list of parameters dictionaries, course names, sensor noise, seed).
+        Returns a list of result rows in the same order as the candidates.
+    """
+    candidates, courseNames, noise, seed = task
+    params = { name: [ candidate[name] for candidate in candidates ] for name in tunedParameters }
+
+    runs = []
+    for index, (course, maze) in enumerate( makeCourses(courseNames) ):
+        runs.append( cs.runCourseBatch(course, params, noise=noise, seed=seed + index) )
+    return [ summariseRuns(candidate, [ results[i] for results in runs ]) for i, candidate in enumerate(candidates) ]
+
+
+def summariseRuns(params, results):
+    """ Returns a result row of the parameters, score and run statistics for a candidate """
+    runs = len(results)
+    row = dict(params)
+    row["score"] = sum( scoreRun(result) for result in results ) / runs
+    row["crashes"] = sum( result.crashed for result in results )
+    row["finished"] = sum( result.finished for result in results )
+    row["meanTime"] = sum( result.time for result in results ) / runs
+    row["meanOffset"] = sum( result.meanOffset for result in results ) / runs
+    row["maxOffset"] = max( result.maxOffset for result in results )
+    row["steeringEffort"] = sum( result.steeringEffort for result in results ) / runs
+    return row
+
+
+def parseValues(spec):
+    """ Parses a list of values 'a,b,c' or a range 'start:stop:step' (inclusive of stop) """
+    if ":" in spec:
+        start, stop, step = [ float(v) for v in spec.split(":") ]
+        count = int( round((stop - start) / step) ) + 1
+        return [ round(start + i * step, 6) for i in range(count) ]
+    return [ float(v) for v in spec.split(",") ]
+
+
+def currentSettings():
+    """ Returns the current values of the tuned parameters in AutonomousDriving """
+    return { name: getattr(ad, name) for name in tunedParameters }
+
+
+def gridCandidates(grid):
+    """ Returns a list of parameter dictionaries for every combination of grid values.
+        grid is a dictionary of parameter: list of values. Parameters not in the grid
+        keep their current values.
+    """
+    candidates = [ currentSettings() ]
+    for name, values in grid.items():
+        candidates = [ dict(candidate, **{name: value}) for candidate in candidates for value in values ]
+    return candidates
+
+
+def clampParameters(params):
+    """ Apply the limits the controller hat applies to each parameter """
+    params["Pk"] = max(0, params["Pk"])
+    params["Ik"] = max(0, params["Ik"])
+    params["Dk"] = max(0, params["Dk"])
+    params["maxSteeringAngle"] = min(60, max(5, params["maxSteeringAngle"]))
+    params["minFrontDist"] = min(1000, max(10, params["minFrontDist"]))
+    return params
+
+
+def evaluateAll(executor, candidates, courseNames, noise, seed, batch=False):
+    """ Evaluate candidates in parallel. Returns the result rows in the same order.
+        In batch mode each worker runs a chunk of candidates together with evaluateBatch.
+    """
+    chunk = max(1, len(candidates) // (4 * (os.cpu_count() or 1)))
+    if batch:
+        tasks = [ (candidates[i:i + chunk], courseNames, noise, seed) for i in range(0, len(candidates), chunk) ]
+        return [ row for rows in executor.map(evaluateBatch, tasks) for row in rows ]
+    tasks = [ (candidate, courseNames, noise, seed) for candidate in candidates ]
+    return list( executor.map(evaluate, tasks, chunksize=chunk) )
+
+
+def adaptiveSearch(executor, start, courseNames, noise, seed, iterations, population, batch=False):
+    """ Search from a starting setting, evaluating a population of random perturbations of the
+        best setting found so far each iteration. Step sizes start at four controller hat steps,
+        and halve after an iteration finds no improvement.
+        Returns all the result rows evaluated.
+    """
+    rng = random.Random(seed)
+    steps = { name: step * 4 for name, step in tunedParameters.items() }
+    rows = evaluateAll(executor, [start], courseNames, noise, seed, batch)
+    best = rows[0]
+
+    for iteration in range(iterations):
+        candidates = []
+        for i in range(population):
+            candidate = { name: best[name] for name in tunedParameters }
+            for name, step in steps.items():
+                candidate[name] = round(candidate[name] + rng.choice((-1, 0, 1)) * step, 6)
+            candidates.append( clampParameters(candidate) )
+
+        newRows = evaluateAll(executor, candidates, courseNames, noise, seed, batch)
+        rows += newRows
+        bestNew = min(newRows, key=lambda row: row["score"])
+        if bestNew["score"] < best["score"]:
+            best = bestNew
+        else:
+            steps = { name: step / 2 for name, step in steps.items() }
+        print("Iteration {}: best score {:.2f}".format(iteration + 1, best["score"]))
+
+    return rows
+
+
+def writeResults(rows, filename):
+    """ Write result rows ranked by score to a CSV file """
+    ranked = sorted(rows, key=lambda row: row["score"])
+    fields = ["rank", "score"] + list(tunedParameters) + ["crashes", "finished", "meanTime", "meanOffset", "maxOffset", "steeringEffort"]
+    with open(filename, "w", newline="") as f:
+        writer = csv.DictWriter(f, fields, extrasaction="ignore")
+        writer.writeheader()
+        for rank, row in enumerate(ranked, 1):
+            writer.writerow( dict(row, rank=rank) )
+    return ranked
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune the autonomous driving parameters in simulation")
+    for name in tunedParameters:
+        parser.add_argument("--" + name, help="Values for {} to search, as 'a,b,c' or 'start:stop:step'".format(name))
+    parser.add_argument("--courses", default="corridor", help="Comma separated courses to run (corridor, maze)")
+    parser.add_argument("--adaptive", action="store_true", help="Adaptive search from the current settings instead of a grid")
+    parser.add_argument("--iterations", type=int, default=20, help="Adaptive search iterations")
+    parser.add_argument("--population", type=int, default=64, help="Candidates evaluated per adaptive search iteration")
+    parser.add_argument("--noise", type=float, default=0.0, help="Standard deviation (mm) of sensor noise")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for sensor noise and adaptive search")
+    parser.add_argument("--batch", action="store_true", help="Run chunks of candidates together with vectorised simulation (corridor only)")
+    parser.add_argument("--workers", type=int, help="Number of worker processes (default is all cores)")
+    parser.add_argument("--output", default=defaultOutputFile, help="Ranked results CSV file")
+    parser.add_argument("--top", type=int, default=10, help="Number of best results to print")
+    args = parser.parse_args()
+
+    courseNames = args.courses.split(",")
+    makeCourses(courseNames) #Check course names before starting workers
+    if args.batch and courseNames != ["corridor"]:
+        parser.error("--batch only supports the corridor course")
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        if args.adaptive:
+            rows = adaptiveSearch(executor, currentSettings(), courseNames, args.noise, args.seed,
+                args.iterations, args.population, args.batch)
+        else:
+            grid = {}
+            for name in tunedParameters:
+                spec = getattr(args, name)
+                if spec is not None:
+                    grid[name] = parseValues(spec)
+            candidates = gridCandidates(grid)
+            print("Evaluating {} candidates".format(len(candidates)))
+            rows = evaluateAll(executor, candidates, courseNames, args.noise, args.seed, args.batch)
+
+    ranked = writeResults(rows, args.output)
+    print("{} results written to {}".format(len(ranked), args.output))
+    for row in ranked[:args.top]:
+        print("Score {:8.2f}  ".format(row["score"]) + "  ".join( "{} {}".format(name, row[name]) for name in tunedParameters ) +
+            "  crashes {} finished {}".format(row["crashes"], row["finished"]))
+
+
+if __name__ == '__main__':
+    main()
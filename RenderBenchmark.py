@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+""" Headless benchmark of the Rocky Rover UI rendering.
+    Runs the robot graphic, sensor graphics, debug overlay, menus and the virtual LED
+    matrix display under the SDL dummy video driver with simulated hardware, so it runs
+    on any Linux box without a display or robot. Reports frames per second and per frame
+    latency percentiles, and compares them against a stored baseline to catch rendering
+    regressions.
+
+    Usage:
+        python3 RenderBenchmark.py --save-baseline   #Record a baseline
+        python3 RenderBenchmark.py                   #Compare against the baseline
+"""
+
+import os, sys, io, json, math, time, argparse, contextlib
+
+os.environ["ROCKY_HARDWARE"] = "sim"
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
+defaultBaselineFile = "render_baseline.json"
+defaultFrames = 300
+defaultTolerance = 0.2 #Fractional slow down of the median frame time reported as a regression
+
+screenSize = (800,480)
+
+
+def runBenchmark(name, frameCallback, frames):
+    """ Time frameCallback(frame) followed by a display update for a number of frames.
+        Returns a dictionary of the frame rate and latency percentiles in milliseconds.
+    """
+    import LoopTiming
+    import DisplayUpdates as du
+
+    timer = LoopTiming.StageTimer(name, frames)
+    #Warm up caches before timing, as the robot only pays these costs once
+    frameCallback(-1)
+    du.update()
+
+    with contextlib.redirect_stdout( io.StringIO() ):
+        start = time.perf_counter()
+        for frame in range(frames):
+            with timer.time():
+                frameCallback(frame)
+                du.update()
+        elapsed = time.perf_counter() - start
+
+    p50, p95, p99 = timer.percentiles()
+    return {
+        "fps": frames / elapsed,
+        "p50": p50 * 1000,
+        "p95": p95 * 1000,
+        "p99": p99 * 1000,
+        }
+
+
+def getBenchmarks():
+    """ Returns a list of (name, frame callback, setup function) for each rendering path benchmarked """
+    import RockyRover as rr
+    import RobotControl as rc
+    import ledMatrixDisplays
+
+    def setActuators(frame):
+        #Sweep the steering and motors so the wheel and motor layers change every frame
+        angle = 45 + (frame * 3) % 90
+        rc.servoPosFL = rc.servoPosFR = angle
+        rc.servoPosBL = rc.servoPosBR = 180 - angle
+        rc.motorPowerL = (frame % 200) - 100
+        rc.motorPowerR = 100 - (frame % 200)
+
+    def robotFull(frame):
+        setActuators(frame)
+        rc.drawVirtualRobot(rr.screen)
+
+    def robotPartial(frame):
+        setActuators(frame)
+        rc.drawVirtualRobot(rr.screen, full=False)
+
+    def sensorGraphics(frame):
+        setActuators(frame)
+        wave = int( 200 * math.sin(frame / 10) )
+        rr.showSensorGraphics(400 + wave, 400 - wave, 800 + wave)
+
+    def debugData(frame):
+        rr.showDebugData()
+
+    def menu(frame):
+        levels = list(rr.MenuLevel)
+        rr.showMenu( levels[frame % len(levels)] )
+
+    def menuRender(frame):
+        #Cost of rendering a menu screen from its layout (paid once per level at start up)
+        rr.menuSurfaces.clear()
+        rr.getMenuSurface(rr.MenuLevel.top)
+
+    eyes = ledMatrixDisplays.LEDMatrixDisplays()
+    eyePatterns = [ ledMatrixDisplays.eye_open, ledMatrixDisplays.eye_lid1, ledMatrixDisplays.eye_lid2 ]
+
+    def ledDisplay(frame):
+        eyes.showNow( eyePatterns[frame % len(eyePatterns)] )
+
+    def setupMode(mode):
+        rr.mode = mode
+        rr.setModeBackground()
+
+    return [
+        ("drawVirtualRobot", robotFull, lambda: setupMode(rr.Mode.manual)),
+        ("drawVirtualRobotPartial", robotPartial, lambda: setupMode(rr.Mode.manual)),
+        ("showSensorGraphics", sensorGraphics, lambda: setupMode(rr.Mode.sensorsTest)),
+        ("showDebugData", debugData, lambda: setupMode(rr.Mode.manual)),
+        ("showMenu", menu, lambda: setupMode(rr.Mode.menu)),
+        ("menuRender", menuRender, lambda: setupMode(rr.Mode.menu)),
+        ("ledVirtualDisplay", ledDisplay, lambda: setupMode(rr.Mode.manual)),
+        ]
+
+
+def compare(results, baseline, tolerance):
+    """ Print results alongside the baseline. Returns a list of the names of benchmarks
+        whose median frame time is slower than the baseline by more than the tolerance.
+    """
+    regressions = []
+    print("{:<24} {:>8} {:>8} {:>8} {:>8} {:>10}".format("Benchmark", "fps", "p50 ms", "p95 ms", "p99 ms", "vs base"))
+    for name, result in results.items():
+        change = ""
+        base = baseline.get(name)
+        if base is not None and base["p50"] > 0:
+            ratio = result["p50"] / base["p50"]
+            change = "{:+.0f}%".format( (ratio - 1) * 100 )
+            if ratio > 1 + tolerance:
+                change += " SLOWER"
+                regressions.append(name)
+        print("{:<24} {:>8.1f} {:>8.2f} {:>8.2f} {:>8.2f} {:>10}".format(name, result["fps"], result["p50"], result["p95"], result["p99"], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Rocky Rover UI rendering without a display")
+    parser.add_argument("--frames", type=int, default=defaultFrames, help="Frames timed for each benchmark")
+    parser.add_argument("--baseline", default=defaultBaselineFile, help="Baseline results file")
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=defaultTolerance, help="Allowed fractional slow down of median frame time")
+    parser.add_argument("--only", nargs="*", help="Names of benchmarks to run")
+    args = parser.parse_args()
+
+    #Images are loaded relative to the robot code folder
+    os.chdir( os.path.dirname( os.path.abspath(__file__) ) )
+
+    #Draw the LED matrices on screen, and leave out I2C bus time so only rendering is measured
+    import SimulatedHardware as sim
+    sim.virtualLEDDisplay = True
+    sim.bus.latencyScale = 0
+
+    pygame.init()
+    import RockyRover as rr
+    import RobotControl as rc
+    import AssetManager as assets
+
+    rr.screen = pygame.display.set_mode(screenSize)
+    rc.showRobotGraphic = True
+    assets.preload()
+    rr.prerenderMenus()
+
+    results = {}
+    for name, callback, setup in getBenchmarks():
+        if args.only and name not in args.only:
+            continue
+        setup()
+        results[name] = runBenchmark(name, callback, args.frames)
+
+    pygame.quit()
+
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print("Baseline saved to {}".format(args.baseline))
+    elif len(baseline) == 0:
+        print("No baseline found at {}. Run with --save-baseline to record one.".format(args.baseline))
+    elif len(regressions) > 0:
+        print("Rendering regressions: {}".format( ", ".join(regressions) ))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
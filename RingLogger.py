@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+""" Low overhead logging for the Rocky Rover main loop.
+    Log calls store the time, level, format string and arguments of a message in a
+    preallocated ring buffer without formatting it. A background thread formats the
+    messages and writes them out a few times a second, so slow terminal output (such as
+    over SSH) does not stall the loop. Messages below a logger's level return at once,
+    and messages which arrive when the ring is full are dropped and counted. Once logging
+    has been stopped (such as at exit) messages are formatted and written straight away.
+
+    Levels can be set per module in code or with the ROCKY_LOG_LEVELS environment
+    variable, e.g. ROCKY_LOG_LEVELS="AutonomousDriving=debug,RockyRover=info"
+
+    Usage:
+        log = RingLogger.getLogger("AutonomousDriving")
+        log.debug("Target {}; Dist {}", targetWallDistance, distance)
+"""
+
+import os, sys, time, atexit, threading
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+levelNames = { DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR" }
+
+levelsEnvVar = "ROCKY_LOG_LEVELS"
+defaultLevel = INFO
+ringSize = 1024 #Messages held waiting to be written
+flushInterval = 0.1 #Seconds between writes of the ring to the output
+
+loggers = {}
+output = sys.stdout
+ring = None
+formatter = None
+stopped = False #Set once logging has stopped, after which messages are written straight away
+startLock = threading.Lock()
+writeLock = threading.Lock()
+startTime = time.perf_counter()
+
+
+class Ring:
+    """ Preallocated ring buffer of unformatted messages, with one reader """
+
+    def __init__(self, size=ringSize):
+        self.size = size
+        self.times = [0.0] * size
+        self.loggers = [None] * size
+        self.levels = [0] * size
+        self.formats = [None] * size
+        self.args = [None] * size
+        self.head = 0 #Total number of messages added (index of next slot is head % size)
+        self.tail = 0 #Total number of messages taken
+        self.lock = threading.Lock()
+
+    def put(self, logger, level, fmt, args):
+        """ Store a message. Returns False if the ring is full. """
+        with self.lock:
+            if self.head - self.tail >= self.size:
+                return False
+            idx = self.head % self.size
+            self.times[idx] = time.perf_counter()
+            self.loggers[idx] = logger
+            self.levels[idx] = level
+            self.formats[idx] = fmt
+            self.args[idx] = args
+            self.head += 1
+            return True
+
+    def take(self):
+        """ Returns a list of (time, logger, level, format, args) for all the stored messages, oldest first """
+        with self.lock:
+            first, last = self.tail, self.head
+        messages = []
+        for i in range(first, last):
+            idx = i % self.size
+            messages.append( (self.times[idx], self.loggers[idx], self.levels[idx], self.formats[idx], self.args[idx]) )
+            #Release the arguments so objects are not kept alive by the ring
+            self.args[idx] = None
+        with self.lock:
+            self.tail = last
+        return messages
+
+
+class Logger:
+    """ Named logger with its own level and count of dropped messages """
+
+    def __init__(self, name, level):
+        self.name = name
+        self.level = level
+        self.dropped = 0
+        self.reportedDrops = 0
+
+    def isEnabledFor(self, level):
+        return level >= self.level
+
+    def log(self, level, fmt, *args):
+        """ Queue a message to be formatted with fmt.format(*args) on the background thread """
+        if level >= self.level:
+            self.put(level, fmt, args)
+
+    def debug(self, fmt, *args):
+        if DEBUG >= self.level:
+            self.put(DEBUG, fmt, args)
+
+    def info(self, fmt, *args):
+        if INFO >= self.level:
+            self.put(INFO, fmt, args)
+
+    def warning(self, fmt, *args):
+        if WARNING >= self.level:
+            self.put(WARNING, fmt, args)
+
+    def error(self, fmt, *args):
+        if ERROR >= self.level:
+            self.put(ERROR, fmt, args)
+
+    def put(self, level, fmt, args):
+        """ Store a message in the ring, or write it straight away if logging has stopped """
+        messages = ring #Read once, as another thread may stop logging
+        if messages is None:
+            write( [ formatMessage(time.perf_counter(), self, level, fmt, args) ] )
+        elif not messages.put(self, level, fmt, args):
+            self.dropped += 1
+
+
+def formatMessage(timestamp, logger, level, fmt, args):
+    """ Returns a message as a line of text """
+    try:
+        text = fmt.format(*args) if args else fmt
+    except Exception as e:
+        text = "{} (format error: {})".format(fmt, e)
+    return "{:9.3f} {:<7} {}: {}\n".format(timestamp - startTime, levelNames.get(level, level), logger.name, text)
+
+
+def write(lines):
+    """ Write lines of text to the output """
+    with writeLock:
+        output.write( "".join(lines) )
+        output.flush()
+
+
+class Formatter(threading.Thread):
+    """ Background thread which formats and writes the messages in a ring """
+
+    def __init__(self, ring):
+        super().__init__(daemon=True)
+        self.ring = ring
+        self.written = 0
+        self.stopRequested = threading.Event()
+        self.flushLock = threading.Lock()
+
+    def run(self):
+        while not self.stopRequested.wait(flushInterval):
+            self.flush()
+
+    def flush(self):
+        """ Format and write all the messages in the ring, and report any drops """
+        with self.flushLock:
+            lines = [ formatMessage(*message) for message in self.ring.take() ]
+            for logger in list( loggers.values() ):
+                if logger.dropped != logger.reportedDrops:
+                    lines.append( "{} messages from {} dropped\n".format(logger.dropped - logger.reportedDrops, logger.name) )
+                    logger.reportedDrops = logger.dropped
+            if lines:
+                write(lines)
+                self.written += len(lines)
+
+    def stop(self):
+        self.stopRequested.set()
+
+
+def parseLevels(spec):
+    """ Parses 'name=level,name=level' into a dictionary of name: level number """
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            level = level.strip().upper()
+            for number, levelName in levelNames.items():
+                if levelName == level:
+                    levels[name.strip()] = number
+    return levels
+
+moduleLevels = parseLevels( os.environ.get(levelsEnvVar, "") )
+
+
+def start():
+    """ Create the ring and start the formatter thread (called on first use) """
+    global ring, formatter
+
+    with startLock:
+        if formatter is None and not stopped:
+            ring = Ring()
+            formatter = Formatter(ring)
+            formatter.start()
+            atexit.register(stop)
+
+
+def stop():
+    """ Write out any queued messages and stop the formatter thread.
+        Messages logged after this are written straight away.
+    """
+    global ring, formatter, stopped
+
+    stopped = True
+    if formatter is not None:
+        ring = None
+        formatter.stop()
+        formatter.join()
+        formatter.flush()
+        formatter = None
+
+
+def getLogger(name):
+    """ Returns the logger for a module, creating it on first use """
+    logger = loggers.get(name)
+    if logger is None:
+        if formatter is None and not stopped:
+            start()
+        logger = Logger(name, moduleLevels.get(name, defaultLevel))
+        loggers[name] = logger
+    return logger
+
+
+def setLevel(name, level):
+    """ Set the level of a module's logger """
+    moduleLevels[name] = level
+    getLogger(name).level = level
+
+
+def getStats():
+    """ Returns a dictionary of logger name: number of dropped messages """
+    return { name: logger.dropped for name, logger in loggers.items() }
@@ -3,14 +3,25 @@
 """ PiWars Rocky Rover robot control functions module
 """
 
-from sentinelboard import SentinelBoard
-import pygame, statistics, time
+import HardwareBackend as backend
+import pygame
+import AssetManager as assets
+import HardwareRegistry as hw
+import DisplayUpdates as du
+import SessionLog, BatteryMonitor
+from contextlib import contextmanager
 
 
-sb = SentinelBoard()
+def initSentinelBoard():
+    """ Open the Sentinel board """
+    board = backend.createSentinelBoard()
+    
+    # Set voltage reading calibration for this specific board
+    board.sbHardware.voltage_multiplier = 1.125
+    return board
 
-# Set voltage reading calibration for this specific board
-sb.sbHardware.voltage_multiplier = 1.125
+# Board is opened on first use (or in the background by HardwareRegistry.startInBackground)
+sb = hw.LazyDevice("sentinelboard", initSentinelBoard)
 
 # PWM board channel configuration 
 servoFrontLeftChannel = 0
@@ -42,10 +53,43 @@ motorPowerL = 0
 motorPowerR = 0
 
 showRobotGraphic = False
+#When set, actuator changes only flag the robot graphic for redrawing and
+#the caller redraws it once per tick using refreshVirtualRobot()
+deferRobotGraphic = False
+robotGraphicDirty = False
+
+#Virtual robot wheel size and colour
+WHEEL_W = 30
+WHEEL_H = 70
+WHEEL_COLOUR = [0,0,0]
+#Pre-rendered rotated wheel images, keyed by rotation in whole degrees (see buildWheelAtlas)
+wheelAtlas = {}
+#Centres of the steered wheels (front left, front right, rear left, rear right)
+WHEEL_CENTRES = [(306,62), (494,62), (306,418), (494,418)]
+#Size of the square redrawn around a wheel when it turns
+WHEEL_REGION_SIZE = 80
+#Regions redrawn when the left or right motor power changes
+MOTOR_REGIONS = [pygame.Rect(140,85,95,290), pygame.Rect(600,85,95,290)]
+
+#Layered robot graphic. The background and robot body are drawn once into robotBodyLayer.
+#robotFrame holds the complete graphic, and only the wheel and motor layers which change are redrawn into it.
+robotBodyLayer = None
+robotFrame = None
+drawnServoPositions = [None,None,None,None]
+drawnMotorPowers = [None,None]
+
+#Drive update batching state (see driveUpdate)
+driveBatchDepth = 0
+pendingServoPositions = {}
+pendingMotorPowers = {}
 
-voltage_readings = []
-firstSetVoltReadings = True
-timeSinceLastRead = 0
+#Shadow copies of the last servo positions and motor powers sent to the board, so unchanged
+#values are not re-sent. Motor powers are stored with the power limit they were sent with.
+sentServoPositions = {}
+sentMotorPowers = {}
+skippedWrites = 0
+
+battery = None #BatteryMonitor sampling the motor supply voltage
 
 #==========================================================================================
 # Safe steering functions to ensure servos are not set beyond their limits of free movement
@@ -65,41 +109,47 @@ def setSteeringLegPositionSafely(angle, servoChannel, servoOffset):
     #Adjust servo position with offset so 90 degrees is when wheel is pointing straight ahead
     servoPos = servoPos + servoOffset
     
-    #Set servo position
-    sb.setServoPosition(servoChannel, servoPos)
+    #Set servo position (or hold it until the end of a batched drive update)
+    if driveBatchDepth > 0:
+        pendingServoPositions[servoChannel] = servoPos
+    else:
+        sendServoPosition(servoChannel, servoPos)
     
-    if showRobotGraphic:
-        drawVirtualRobot( pygame.display.get_surface() )
+    requestRobotRedraw()
     
     
 def setSteeringFrontLeft(angle):
     """ Sets the position of the front left steering servo """
     global servoPosFL
     
-    setSteeringLegPositionSafely(angle, servoFrontLeftChannel, servoFrontLeftOffset)
+    #Store the angle first, so the robot graphic is redrawn with it
     servoPosFL = angle
+    setSteeringLegPositionSafely(angle, servoFrontLeftChannel, servoFrontLeftOffset)
     
     
 def setSteeringFrontRight(angle):
     """ Sets the position of the front right steering servo """
     global servoPosFR
     
-    setSteeringLegPositionSafely(angle, servoFrontRightChannel, servoFrontRightOffset)
+    #Store the angle first, so the robot graphic is redrawn with it
     servoPosFR = angle
+    setSteeringLegPositionSafely(angle, servoFrontRightChannel, servoFrontRightOffset)
     
     
 def setSteeringRearLeft(angle):
     """ Sets the position of the rear left steering servo """
     global servoPosBL
     
-    setSteeringLegPositionSafely(angle, servoRearLeftChannel, servoRearLeftOffset)
+    #Store the angle first, so the robot graphic is redrawn with it
     servoPosBL = angle
+    setSteeringLegPositionSafely(angle, servoRearLeftChannel, servoRearLeftOffset)
     
     
 def setSteeringRearRight(angle):
     """ Sets the position of the rear right steering servo """
     global servoPosBR
     
+    #Store the angle first, so the robot graphic is redrawn with it
     servoPosBR = angle
     setSteeringLegPositionSafely(angle, servoRearRightChannel, servoRearRightOffset)
     #print("Rear Right angle: {}".format(angle) )
@@ -109,10 +159,11 @@ def setSteering(angle):
     """ Sets wheels to an angle to drive in a curve """
     frontAngle = -angle + 90
     rearAngle = angle + 90
-    setSteeringFrontLeft(frontAngle)
-    setSteeringFrontRight(frontAngle)
-    setSteeringRearLeft(rearAngle)
-    setSteeringRearRight(rearAngle)
+    with driveUpdate():
+        setSteeringFrontLeft(frontAngle)
+        setSteeringFrontRight(frontAngle)
+        setSteeringRearLeft(rearAngle)
+        setSteeringRearRight(rearAngle)
 
 
 def spotTurnSteering(angle):
@@ -122,26 +173,91 @@ def spotTurnSteering(angle):
     leftAngle = 90 + angle
     rightAngle = 90 - angle
 
-    setSteeringFrontLeft(rightAngle)
-    setSteeringFrontRight(leftAngle)
-    setSteeringRearLeft(leftAngle)
-    setSteeringRearRight(rightAngle)
+    with driveUpdate():
+        setSteeringFrontLeft(rightAngle)
+        setSteeringFrontRight(leftAngle)
+        setSteeringRearLeft(leftAngle)
+        setSteeringRearRight(rightAngle)
     
     
 def turn90Deg(clockwise=True):
     """ Turn 90 degrees on the spot) """
-    spotTurnSteering(40)
     if clockwise == False:
         speedR = 100
     else:
         speedR = -100
     speedL = -speedR
-    setLeftMotorPower(speedL)
-    setRightMotorPower(speedR)
+    with driveUpdate():
+        spotTurnSteering(40)
+        setLeftMotorPower(speedL)
+        setRightMotorPower(speedR)
     sb.watchdogPause(0.6)
-    setSteering(0)
-    setLeftMotorPower(0)
-    setRightMotorPower(0)
+    setDrive(0, 0)
+    
+    
+#==========================================================================================
+# Batched drive updates
+#==========================================================================================
+@contextmanager
+def driveUpdate():
+    """ Context manager which collects all steering and motor changes made inside it
+        and sends them to the board as one burst when the outermost block exits.
+        The robot graphic is redrawn at most once for the whole update.
+        Can also be used as a function decorator: @driveUpdate()
+    """
+    global driveBatchDepth
+    
+    driveBatchDepth += 1
+    try:
+        yield
+    finally:
+        driveBatchDepth -= 1
+        if driveBatchDepth == 0:
+            flushDriveUpdate()
+
+
+def flushDriveUpdate():
+    """ Sends all servo positions and motor powers collected by driveUpdate() """
+    for channel, servoPos in pendingServoPositions.items():
+        sendServoPosition(channel, servoPos)
+    pendingServoPositions.clear()
+    
+    for motor, power in pendingMotorPowers.items():
+        sendMotorPower(motor, power)
+    pendingMotorPowers.clear()
+    
+    if robotGraphicDirty and not deferRobotGraphic:
+        drawVirtualRobot( pygame.display.get_surface() )
+    
+    
+def setDrive(speed, steer):
+    """ Sets the steering angle and the power of both motors as a single update """
+    with driveUpdate():
+        setSteering(steer)
+        setLeftMotorPower(speed)
+        setRightMotorPower(speed)
+    
+    
+def requestRobotRedraw():
+    """ Redraws the robot graphic after an actuator change, or flags it for
+        redrawing later if inside a batched update or redraws are deferred
+    """
+    global robotGraphicDirty
+    
+    if showRobotGraphic:
+        if driveBatchDepth > 0 or deferRobotGraphic:
+            robotGraphicDirty = True
+        else:
+            drawVirtualRobot( pygame.display.get_surface() )
+    
+    
+def refreshVirtualRobot(screen, full=True):
+    """ Redraws the robot graphic if any actuator has changed since it was last drawn.
+        Returns a list of the screen rects which were updated.
+    """
+    if showRobotGraphic and robotGraphicDirty:
+        return drawVirtualRobot(screen, full)
+    return []
     
     
 #==========================================================================================
@@ -158,150 +274,272 @@ def getMotorPowerLimit():
     return sb.motorPowerLimiting
     
 
-def getMotorSupplyVoltage(readingsAv = 10):
-    global timeSinceLastRead, firstSetVoltReadings
-
-    # Only read if over 10 s since last reading
-    timenow = time.time()
-    if timenow - timeSinceLastRead > 1:
-        timeSinceLastRead = timenow
-
-        readings = []
-        for i in range(readingsAv):
-            motorV = sb.sbHardware.motor_voltage
-            readings.append(motorV)
-
-        avReading = statistics.median(readings)
-
-        if len(voltage_readings) > 9:
-            #Throw out any bad readings from array
-            if firstSetVoltReadings:
-                avSet = statistics.mean(voltage_readings)
-                print(f"Set average: {avSet}")
-                for idx in range(len(voltage_readings)-1,0,-1):
-                    print(f"Scanning {idx} value: {voltage_readings[idx]}")
-                    if abs(voltage_readings[idx]-avSet)/avSet > 0.2:
-                        #Remove reading which is 20% off median
-                        voltage_readings.pop(idx)
-                        print(f"Removed {idx}")
-                if len(voltage_readings) > 9:
-                    #Step cleaning set when all values are reasonable
-                    firstSetVoltReadings = False
-                
-            #Take average and only accept new reading if within 5% of it
-            prevAvReading = statistics.mean(voltage_readings)
-
-            if abs(avReading-prevAvReading)/prevAvReading < 0.05:
-                #Remove first item and add new one
-                voltage_readings.pop(0)
-                voltage_readings.append(avReading)
-        else:
-            # Just add reading to array
-            voltage_readings.append(avReading)
+def startBatteryMonitor(onDeratingChanged=None):
+    """ Start sampling the motor supply voltage in the background.
+        onDeratingChanged is called from the monitor thread when low voltage derating starts or ends.
+    """
+    global battery
+    
+    if battery is None:
+        battery = BatteryMonitor.BatteryMonitor(lambda: sb.sbHardware.motor_voltage, onDeratingChanged)
+        battery.start()
+
+
+def stopBatteryMonitor():
+    global battery
+    
+    if battery is not None:
+        battery.stop()
+        battery.join()
+        battery = None
+
+
+def getMotorSupplyVoltage():
+    """ Returns the filtered motor supply voltage from the battery monitor (0 until it has a reading) """
+    if battery is None:
+        return 0.0
+    return battery.voltage
 
-    return statistics.mean(voltage_readings)
+
+def getBatteryPowerLimitCap():
+    """ Returns the maximum motor power limit (%) allowed by the battery monitor """
+    if battery is None:
+        return 100
+    return battery.powerLimitCap()
 
 
 def getPWMPulseLength(channel):
     return sb.sbHardware.channelPulseLengths[channel]
 
 
+def setMotorPowerSafely(motor, power):
+    """ Sets the power of a motor, or holds it until the end of a batched drive update """
+    if driveBatchDepth > 0:
+        pendingMotorPowers[motor] = power
+    else:
+        sendMotorPower(motor, power)
+
+
+def sendServoPosition(channel, servoPos):
+    """ Sends a servo position to the board, unless it is already set to that position """
+    global skippedWrites
+    
+    if sentServoPositions.get(channel) == servoPos:
+        skippedWrites += 1
+        SessionLog.log(SessionLog.servoRecord, channel, servoPos, 0)
+    else:
+        sb.setServoPosition(channel, servoPos)
+        sentServoPositions[channel] = servoPos
+        SessionLog.log(SessionLog.servoRecord, channel, servoPos, 1)
+
+
+def sendMotorPower(motor, power):
+    """ Sends a motor power to the board, unless it is already set to that power at the current power limit """
+    global skippedWrites
+    
+    setting = (power, sb.motorPowerLimiting)
+    if sentMotorPowers.get(motor) == setting:
+        skippedWrites += 1
+        SessionLog.log(SessionLog.motorRecord, motor, power, sb.motorPowerLimiting, 0)
+    else:
+        sb.setMotorPower(motor, power)
+        sentMotorPowers[motor] = setting
+        SessionLog.log(SessionLog.motorRecord, motor, power, sb.motorPowerLimiting, 1)
+
+
+def invalidateShadow():
+    """ Forget the values last sent to the board, so the next write of every servo and motor is sent """
+    sentServoPositions.clear()
+    sentMotorPowers.clear()
+
+
 def setLeftMotorPower(power):
     global motorPowerL
     
-    sb.setMotorPower(1, power)
+    setMotorPowerSafely(1, power)
     motorPowerL = power
     
-    if showRobotGraphic:
-        drawVirtualRobot( pygame.display.get_surface() )
+    requestRobotRedraw()
     
     
 def setRightMotorPower(power):
     global motorPowerR
     
-    sb.setMotorPower(2, power)
+    setMotorPowerSafely(2, power)
     motorPowerR = power
     
-    if showRobotGraphic:
-        drawVirtualRobot( pygame.display.get_surface() )
+    requestRobotRedraw()
     
     
 def stopAll():
     sb.sbHardware.allOff()
+    invalidateShadow()
     
     
-def drawVirtualRobot(screen):
-    """ Draw graphical representation of robot on screen, indicating wheel positions and motor speeds """
+def drawVirtualRobot(screen, full=True):
+    """ Draw graphical representation of robot on screen, indicating wheel positions and motor speeds.
+        The robot graphic is composited from a cached background and body layer, with the
+        wheel and motor layers only re-rendered when their servo positions or motor powers change.
+        If full is True the whole graphic is drawn to the screen, otherwise only changed regions are.
+        Returns a list of the screen rects which were updated (these are also marked as dirty).
+    """
+    global robotGraphicDirty
     
     if screen != None:
-        #Reset screen with a background image
-        image = pygame.image.load( "mars_hubble_canyon.jpg" ).convert()
-        screen.blit( image, [0, 0] )
+        robotGraphicDirty = False
+        changed = updateRobotFrame()
         
-        #Draw body of robot
-        BLACK = [0,0,0]
-        BROWN = [120,60,0]
-        RED   = [255,0,0]
-        BLUE  = [0,0,200]
-        PURPLE = [100,0,100]
-        WHEEL_W = 30
-        WHEEL_H = 70
-        pygame.draw.rect(screen, BLUE, pygame.Rect(335,145,130,175))
-        pygame.draw.rect(screen, BLUE, pygame.Rect(365,30,70,115))
-        pygame.draw.rect(screen, BLUE, pygame.Rect(290,160,220,16))
-        pygame.draw.rect(screen, BLUE, pygame.Rect(296,100,20,280))
-        pygame.draw.rect(screen, BLUE, pygame.Rect(484,100,20,280))
-        pygame.draw.rect(screen, BLUE, pygame.Rect(270,220,30,18))
-        pygame.draw.rect(screen, BLUE, pygame.Rect(500,220,30,18))
-        pygame.draw.rect(screen, BLACK, pygame.Rect(240,195,WHEEL_W,WHEEL_H))
-        pygame.draw.rect(screen, BLACK, pygame.Rect(530,195,WHEEL_W,WHEEL_H))
-            
-        #Draw rotated wheels
-        CIRCLE_DIA = 8
-        WHEEL_L_X = 306
-        WHEEL_R_X = 494
-        WHEEL_F_Y = 62
-        WHEEL_B_Y = 418
-        #Adjust for 90 degrees being zero position of virtual wheels, and apply servo calibration offsets
-        drawRotatedRectangle(screen,WHEEL_L_X,WHEEL_B_Y,WHEEL_W,WHEEL_H,90-servoPosBL,BLACK)
-        pygame.draw.circle(screen, RED,(WHEEL_L_X,WHEEL_B_Y),CIRCLE_DIA)
-        drawRotatedRectangle(screen,WHEEL_R_X,WHEEL_B_Y,WHEEL_W,WHEEL_H,90-servoPosBR,BLACK)
-        pygame.draw.circle(screen, RED,(WHEEL_R_X,WHEEL_B_Y),CIRCLE_DIA)
-        drawRotatedRectangle(screen,WHEEL_L_X,WHEEL_F_Y,WHEEL_W,WHEEL_H,90-servoPosFL,BLACK)
-        pygame.draw.circle(screen, RED,(WHEEL_L_X,WHEEL_F_Y),CIRCLE_DIA)
-        drawRotatedRectangle(screen,WHEEL_R_X,WHEEL_F_Y,WHEEL_W,WHEEL_H,90-servoPosFR,BLACK)
-        pygame.draw.circle(screen, RED,(WHEEL_R_X,WHEEL_F_Y),CIRCLE_DIA)
+        if full:
+            screen.blit( robotFrame, (0,0) )
+            du.markFullScreen()
+            return [robotFrame.get_rect()]
         
-        #Display motor speeds
-        font = pygame.font.Font(None, 28)
-        motorSpeedL = motorPowerL
-        textBitmap = font.render("{:.1f}%".format(motorSpeedL), True, RED )
-        arrowLength = 20 + abs(motorSpeedL * 2)
-        arrowTop = 230-(arrowLength/2)
-        pygame.draw.rect(screen, PURPLE, pygame.Rect(160,arrowTop,30,arrowLength))
-        if motorSpeedL > 0:
-            pygame.draw.polygon(screen, PURPLE, [(175,arrowTop-30),(145,arrowTop),(205,arrowTop)])
-        elif motorSpeedL < 0:
-            arrowBot = arrowTop + arrowLength
-            pygame.draw.polygon(screen, PURPLE, [(175,arrowBot+30),(145,arrowBot),(205,arrowBot)])
-        screen.blit( textBitmap, (160,220) )
-
-        motorSpeedR = -motorPowerR
-        textBitmap = font.render("{:.1f}%".format(motorSpeedR), True, RED )
-        arrowLength = 20 + abs(motorSpeedR * 2)
-        arrowTop = 230-(arrowLength/2)
-        pygame.draw.rect(screen, PURPLE, pygame.Rect(620,230-(arrowLength/2),30,arrowLength))
-        if motorSpeedR < 0:
-            pygame.draw.polygon(screen, PURPLE, [(635,arrowTop-30),(605,arrowTop),(665,arrowTop)])
-        elif motorSpeedR > 0:
-            arrowBot = arrowTop + arrowLength
-            pygame.draw.polygon(screen, PURPLE, [(635,arrowBot+30),(605,arrowBot),(665,arrowBot)])
-        screen.blit( textBitmap, (620,220) )
+        for rect in changed:
+            screen.blit( robotFrame, rect, rect )
+        du.markAllDirty(changed)
+        return changed
     else:
         print("Unable to draw robot when screen is not initialised in pygame.")
+        return []
         
 
-def drawRotatedRectangle(screen,x,y,w,h,rot,colour):
+def restoreRobotRegion(screen, rect):
+    """ Redraw a region of the screen from the last drawn robot graphic
+        (e.g. to erase something drawn over the robot)
+    """
+    if robotFrame is not None:
+        du.markDirty( screen.blit( robotFrame, rect, rect ) )
+        
+
+def getRobotBodyLayer():
+    """ Returns the background image with the static parts of the robot drawn on it.
+        This is only drawn the first time it is needed.
+    """
+    global robotBodyLayer
+    
+    if robotBodyLayer is None:
+        #Start with a copy of the background image
+        layer = assets.getImage("mars_hubble_canyon.jpg").copy()
+        
+        #Draw body of robot
+        BLACK = [0,0,0]
+        BLUE  = [0,0,200]
+        pygame.draw.rect(layer, BLUE, pygame.Rect(335,145,130,175))
+        pygame.draw.rect(layer, BLUE, pygame.Rect(365,30,70,115))
+        pygame.draw.rect(layer, BLUE, pygame.Rect(290,160,220,16))
+        pygame.draw.rect(layer, BLUE, pygame.Rect(296,100,20,280))
+        pygame.draw.rect(layer, BLUE, pygame.Rect(484,100,20,280))
+        pygame.draw.rect(layer, BLUE, pygame.Rect(270,220,30,18))
+        pygame.draw.rect(layer, BLUE, pygame.Rect(500,220,30,18))
+        pygame.draw.rect(layer, BLACK, pygame.Rect(240,195,WHEEL_W,WHEEL_H))
+        pygame.draw.rect(layer, BLACK, pygame.Rect(530,195,WHEEL_W,WHEEL_H))
+        robotBodyLayer = layer
+        
+    return robotBodyLayer
+    
+
+def updateRobotFrame():
+    """ Re-render the wheel and motor layers of the robot graphic which have changed since
+        they were last drawn. Returns a list of the rects which changed.
+    """
+    global robotFrame
+    
+    if robotFrame is None:
+        robotFrame = getRobotBodyLayer().copy()
+        for i in range(len(drawnServoPositions)):
+            drawnServoPositions[i] = None
+        for i in range(len(drawnMotorPowers)):
+            drawnMotorPowers[i] = None
+            
+    changed = []
+    
+    #Wheel layers (drawn at whole degree positions within the servo range)
+    servoPositions = (servoPosFL, servoPosFR, servoPosBL, servoPosBR)
+    for i in range(len(servoPositions)):
+        servoPos = min(max(int(round(servoPositions[i])), servoMinAngle), servoMaxAngle)
+        if servoPos != drawnServoPositions[i]:
+            x, y = WHEEL_CENTRES[i]
+            region = pygame.Rect(0, 0, WHEEL_REGION_SIZE, WHEEL_REGION_SIZE)
+            region.center = (x, y)
+            robotFrame.set_clip(region)
+            robotFrame.blit( getRobotBodyLayer(), region, region )
+            drawWheel(robotFrame, x, y, servoPos)
+            pygame.draw.circle(robotFrame, [255,0,0], (x, y), 8)
+            robotFrame.set_clip(None)
+            drawnServoPositions[i] = servoPos
+            changed.append(region)
+            
+    #Motor layers (drawn at the resolution the power is displayed at)
+    motorPowers = (round(motorPowerL, 1), round(motorPowerR, 1))
+    for i in range(len(motorPowers)):
+        if motorPowers[i] != drawnMotorPowers[i]:
+            region = MOTOR_REGIONS[i]
+            robotFrame.set_clip(region)
+            robotFrame.blit( getRobotBodyLayer(), region, region )
+            if i == 0:
+                drawMotorArrow(robotFrame, 160, motorPowers[i], motorPowers[i])
+            else:
+                #Right motor speed is shown negated
+                drawMotorArrow(robotFrame, 620, -motorPowers[i], motorPowers[i])
+            robotFrame.set_clip(None)
+            drawnMotorPowers[i] = motorPowers[i]
+            changed.append(region)
+            
+    return changed
+    
+
+def drawMotorArrow(surface, x, displaySpeed, power):
+    """ Draw a motor speed arrow with its left edge at x, pointing up for forwards power
+        and down for reverse power, labelled with displaySpeed
+    """
+    RED   = [255,0,0]
+    PURPLE = [100,0,100]
+    centreX = x + 15
+    
+    shadowBitmap, textBitmap = assets.getText("{:.1f}%".format(displaySpeed), 28, RED )
+    arrowLength = 20 + abs(power * 2)
+    arrowTop = 230-(arrowLength/2)
+    pygame.draw.rect(surface, PURPLE, pygame.Rect(x,arrowTop,30,arrowLength))
+    if power > 0:
+        pygame.draw.polygon(surface, PURPLE, [(centreX,arrowTop-30),(centreX-30,arrowTop),(centreX+30,arrowTop)])
+    elif power < 0:
+        arrowBot = arrowTop + arrowLength
+        pygame.draw.polygon(surface, PURPLE, [(centreX,arrowBot+30),(centreX-30,arrowBot),(centreX+30,arrowBot)])
+    surface.blit( textBitmap, (x,220) )
+    
+
+def drawWheel(screen,x,y,servoPos):
+    """ Draw a wheel centred on x,y rotated to match a steering servo position,
+        using the pre-rendered wheel atlas
+    """
+    if len(wheelAtlas) == 0:
+        buildWheelAtlas()
+    
+    #Servo is limited to its safe range, and the atlas holds whole degree rotations
+    servoPos = min(max(int(round(servoPos)), servoMinAngle), servoMaxAngle)
+    image, offset = wheelAtlas[90 - servoPos]
+    screen.blit(image, (x + offset[0], y + offset[1]))
+    
+    
+def buildWheelAtlas():
+    """ Pre-render the wheel at every whole degree rotation the steering servos can be set to.
+        Each entry holds the rotated image and the offset from the wheel centre to its top left corner.
+    """
+    wheelAtlas.clear()
+    convert = pygame.display.get_surface() is not None
+    for servoPos in range(servoMinAngle, servoMaxAngle + 1):
+        #Adjust for 90 degrees being zero position of virtual wheels
+        rot = 90 - servoPos
+        image = rotatedRectangle(WHEEL_W,WHEEL_H,rot,WHEEL_COLOUR)
+        if convert:
+            image = image.convert()
+        rect = image.get_rect()
+        rect.center = (0, 0)
+        wheelAtlas[rot] = (image, rect.topleft)
+    
+    
+def rotatedRectangle(w,h,rot,colour):
+    """ Returns a surface containing a filled rectangle rotated by rot degrees (clockwise) """
     GREEN = [0,255,0]
     # define a surface (rectangle) which can be transformed  
     image1 = pygame.Surface((w, h))  
@@ -310,7 +548,11 @@ def drawRotatedRectangle(screen,x,y,w,h,rot,colour):
     # fill the rectangle / surface with solid color  
     image1.fill(colour)  
     # transform the orignal image (-rot to +ve rotation is clockwise)
-    image2 = pygame.transform.rotate(image1 , -rot)  
+    return pygame.transform.rotate(image1 , -rot)  
+    
+    
+def drawRotatedRectangle(screen,x,y,w,h,rot,colour):
+    image2 = rotatedRectangle(w,h,rot,colour)
     rect = image2.get_rect()  
     # set the centre position of rotated rectangle to the desired position  
     rect.center = (x, y)  
@@ -321,9 +563,9 @@ def drawRotatedRectangle(screen,x,y,w,h,rot,colour):
 def displayError(message):
     screen = pygame.display.get_surface()
     screen.fill( (0,0,0) )
-    font = pygame.font.Font(None, 32)
-    textBitmap = font.render(message, True, [255,0,0] )
+    shadowBitmap, textBitmap = assets.getText(message, 32, [255,0,0] )
     screen.blit( textBitmap, (20, 200) )
+    du.markFullScreen()
     
     
 def main():
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 
-import pygame, random, time
+import pygame, random
 import RobotControl as rc
 import AutonomousDriving as ad
 import dartShooter as ds
-from pygamecontroller import RobotController
+import AssetManager as assets
+import LoopScheduler, LoopTiming
+import HardwareRegistry as hw
+import DisplayUpdates as du
+import HardwareBackend as backend
 from enum import Enum
-from os import system
-import Sensors, ledMatrixDisplays
+from collections import namedtuple
+from os import system, environ
+import Sensors, ledMatrixDisplays, SessionLog, RingLogger, Telemetry
 
 class Mode(Enum):
     """ Modes Enum class """
@@ -38,6 +43,31 @@ class Colour(Enum):
     Purple = (100,0,100)
     
 
+#Menu screen layouts. Button index is the position in the list of buttons.
+MenuButton = namedtuple("MenuButton", ["image", "position", "label", "labelPosition"])
+menuBtnSize = 180
+menuBackground = "LagoonNebula.jpg"
+menuLayouts = {
+    MenuLevel.top: [
+        MenuButton("jupiter1_btn180.gif", (50,35), "Manual Control", (70,220)),
+        MenuButton("mars1_btn180.gif", (300,35), "Sensor Test", (334,220)),
+        MenuButton("pluto_btn180.gif", (550,35), "Wall Avoid", (584,220)),
+        MenuButton("neptune_btn180.gif", (50,260), "Hubble", (105,445)),
+        MenuButton("moon_btn180.gif", (300,260), None, None),
+        MenuButton("venus1_btn180.gif", (550,260), "Exit", (620,445)),
+        ],
+    MenuLevel.close: [
+        MenuButton("mercury1_btn180.gif", (50,150), "Shutdown", (94,335)),
+        MenuButton("neptune_btn180.gif", (300,150), "Desktop", (358,335)),
+        MenuButton("saturn_btn180.gif", (550,150), "Cancel", (604,335)),
+        ],
+    MenuLevel.shutdownReboot: [
+        MenuButton("saturn_btn180.gif", (50,150), "Cancel", (108,335)),
+        MenuButton("uranus_btn180.gif", (300,150), "Reboot", (358,335)),
+        MenuButton("venus1_btn180.gif", (550,150), "Shutdown", (592,335)),
+        ],
+    }
+
 # Configuration constants
 stickDeadZone = 0.2
 
@@ -49,10 +79,7 @@ stopProgram = False
 debugInfo = 2 #Default to showing robot graphic (reset to 0 if running on HyperPixel display)
 
 menu = MenuLevel.top
-borderX = 50
-borderY = 35
-sepX = 250
-sepY = 225
+menuSurfaces = {} #Prerendered screen for each menu level
 clickSequence = 0 #Used to track screen clicks to return to menus from running modes
 
 #Trackers of button states on controller
@@ -64,10 +91,31 @@ rightBtn1Pressed = False
 #Hat editable parameters
 hatEditTracker = 0
 defaultPowerLevel = 50 #Was 30, but increased for maze challenge
-autoCycles = 1
 steeringLook = True
 eyesPos = 0 #Stores which direction eyes are looking (so the LEDs are not repeatedly updated to same pattern)
-mazeState = 0
+shownMazeState = 0 #Maze state last shown on screen
+
+#Main loop scheduling rates (Hz)
+watchdogRate = 20
+controlRate = 50
+shooterRate = 50
+ledRate = 15
+uiRate = 30
+telemetryRate = 20
+scheduler = LoopScheduler.Scheduler()
+robotControl = None
+timingLogFile = "loop_timing.txt" #Main loop stage timings are written here on exit
+log = RingLogger.getLogger("RockyRover")
+sessionLogging = environ.get("ROCKY_SESSION_LOG") == "1" #Record sensor readings, controller events and actuator commands with SessionLog
+telemetryTarget = environ.get("ROCKY_TELEMETRY") #'host' or 'host:port' to send telemetry to (None for no telemetry)
+telemetry = None
+shooterSeenAt = 0.0 #Time of the last dart shooter state transition handled by shooterTask
+powerLimitingPending = False #Set by the battery monitor thread when the power limit needs updating
+blinkCounter = 0
+blinkPause = 0
+sensorDistances = [0,0,0] #Latest left, right and front sensor readings
+robotGraphicOnScreen = False #Whether the screen currently shows the robot graphic (so only changes need drawing)
+sensorGraphicsRects = [] #Screen areas of the sensor beams drawn over the robot graphic
 
 def initStatus(status):
     """ Callback function which displays status during initialisation """
@@ -79,10 +127,12 @@ def initStatus(status):
         print("Waiting for controller {}".format( status ) )
             
 
+@rc.driveUpdate()
 def leftStickChangeHandler(valLR, valUD):
     """ Handler function for left analogue stick.
         Controls motor speed using Up/Down stick position
     """
+    SessionLog.log(SessionLog.stickRecord, 0, valLR, valUD)
     # print(f"Mode: {mode}")
     if mode == Mode.manual:
         
@@ -97,10 +147,10 @@ def leftStickChangeHandler(valLR, valUD):
 
             #Reset steering servos straight if angle is 90 in case we have been in spot steering mode
             if angle == 90:
-                print(f"Reset steering straight as exiting spot turn on left stick. Angle: {angle}")
+                log.debug("Reset steering straight as exiting spot turn on left stick. Angle: {}", angle)
                 # This exits spot steering mode as angle will no longer == 90
                 setSteering(0)
-                print(f"New angle: {angle}")
+                log.debug("New angle: {}", angle)
 
         #Only apply power from L stick if not on spot steering mode (prevents stick noise stopping motors when spot turning)
         if angle != 90:
@@ -108,15 +158,17 @@ def leftStickChangeHandler(valLR, valUD):
             speedR = speedL
             rc.setLeftMotorPower(speedL)
             rc.setRightMotorPower(speedR)
-            print(f"Setting speed from L stick. L power : {speedL}; R Power: {speedR} UD: {valUD} Treated as {newUD}")
+            log.debug("Setting speed from L stick. L power : {}; R Power: {} UD: {} Treated as {}", speedL, speedR, valUD, newUD)
 
 
+@rc.driveUpdate()
 def rightStickChangeHandler(valLR, valUD):
     """ Handler function for right analogue stick.
         Controls steering using Left/Right stick position
     """
     global angle
     
+    SessionLog.log(SessionLog.stickRecord, 1, valLR, valUD)
     if mode == Mode.manual:
         if valLR > -stickDeadZone and valLR < stickDeadZone:
             newLR = 0
@@ -128,23 +180,25 @@ def rightStickChangeHandler(valLR, valUD):
 
             #Turn off motors if in spot turn mode and manual stick steering is activated
             if angle == 90:
-                print(f"Exiting spot mode. Stick LR: {valLR} treated as {newLR}")
+                log.debug("Exiting spot mode. Stick LR: {} treated as {}", valLR, newLR)
                 rc.setLeftMotorPower(0)
                 rc.setRightMotorPower(0)
 
         #Only apply stick value if not in spot turn mode (to stop stick noise cancelling spot steering)
         if angle != 90:        
             angle = newLR * 40
-            print(f"Set steering on right stick. Stick LR: {valLR} treated as {newLR}")
+            log.debug("Set steering on right stick. Stick LR: {} treated as {}", valLR, newLR)
             setSteering(angle)
 
 
+@rc.driveUpdate()
 def leftTriggerChangeHandler(value):
     """ Handler for left trigger.
         If not turning then controls spot turning.
     """
     global angle
     
+    SessionLog.log(SessionLog.triggerRecord, 0, value)
     if mode == Mode.manual:
         #if angle == 0:
             rc.spotTurnSteering(40)
@@ -158,12 +212,14 @@ def leftTriggerChangeHandler(value):
                 eyes.addFrame(ledMatrixDisplays.eye_downleft,2)
     
     
+@rc.driveUpdate()
 def rightTriggerChangeHandler(value):
     """ Handler for right trigger.
         If not turning then controls spot turning.
     """
     global angle
     
+    SessionLog.log(SessionLog.triggerRecord, 1, value)
     if mode == Mode.manual:
         #if angle == 0:
             rc.spotTurnSteering(40)
@@ -181,7 +237,7 @@ def hatChangeHandler(valLR,valUD):
     """ Handler for HAT control on game controller
         Allows parameters to be updated
     """
-    global hatEditTracker, defaultPowerLevel, autoCycles
+    global hatEditTracker, defaultPowerLevel
     
     textsize = 30
     settingCount = 9
@@ -193,7 +249,7 @@ def hatChangeHandler(valLR,valUD):
         elif hatEditTracker > settingCount:
             hatEditTracker = 0
     
-    pygame.draw.rect(screen, Colour.Purple.value, pygame.Rect(10,440,400,30))
+    du.markDirty( pygame.draw.rect(screen, Colour.Purple.value, pygame.Rect(10,440,400,30)) )
     #showText(screen, "HatEdit: {}".format(hatEditTracker), (10,442), size=textsize)
     
     if hatEditTracker == 1:
@@ -217,13 +273,9 @@ def hatChangeHandler(valLR,valUD):
         ad.updateMinFrontDist(10 * valLR)
         showText(screen, "Min. front sensor dist: {}".format(ad.minFrontDist), (10,442), size=textsize)     
     elif hatEditTracker == 5:
-        #Update auto cycle length
-        autoCycles += (5 * valLR)
-        if autoCycles < 5:
-            autoCycles = 5
-        elif autoCycles > 1000:
-            autoCycles = 1000
-        showText(screen, "No. auto cycles before controller read: {}".format(autoCycles), (10,442), size=textsize)     
+        #Update autonomous driving control rate
+        ad.updateAutoControlRate(5 * valLR)
+        showText(screen, "Auto control rate: {} Hz".format(ad.autoControlRate), (10,442), size=textsize)     
     elif hatEditTracker == 6:
         #Update max auto steering angle
         ad.updateMaxSteeringAngle(5 * valLR)
@@ -256,7 +308,7 @@ def startBtnHandler(state):
     
 def homeBtnHandler(state):
     """ Handler for Home button on game controller """
-    global debugInfo
+    global debugInfo, robotGraphicOnScreen
     
     #Toggle state of debug info
     if state == True:
@@ -265,6 +317,8 @@ def homeBtnHandler(state):
             debugInfo = 0
         
         rc.showRobotGraphic = (debugInfo > 0)
+        #Redraw whole robot graphic to clear any debug info displayed over it
+        robotGraphicOnScreen = False
             
     #Reset background if turning debug info off (to clear displayed info)
     if debugInfo == 0:
@@ -299,14 +353,14 @@ def squareBtnHandler(state):
     
 def crossXBtnHandler(state):
     """ Handler for Cross button on game controller 
-        Trigger dart firing mechanism if active,
-        else reset armed flag
+        Trigger dart firing mechanism if active (the dart fires once the motor is up to speed),
+        else reset armed flag if the shooter is not starting up
     """
     if state == 1 :
-        if ds.motorRunning:
+        if ds.spinRequested:
             fireDart()
-        else:
-            ds.armed = False
+        elif ds.state == ds.ShooterState.idle or ds.state == ds.ShooterState.armed:
+            ds.disarm()
             rc.turn90Deg()
     
     
@@ -316,8 +370,7 @@ def armShooter():
     if mode == Mode.manual:
         ds.laserOn()
         eyes.showNow(ledMatrixDisplays.red_cross)
-        ds.armESC()
-        eyes.showNow(ledMatrixDisplays.target)
+        #Shooter arms and spins up in the background (see shooterTask)
         ds.motorOn()
         steeringLook = False
         
@@ -415,12 +468,24 @@ def mouseDownHandler(pos, btn):
                 setMode(Mode.menu)
 
     
+def batteryDeratingChanged(derated):
+    """ Callback from the battery monitor thread when low voltage derating starts or ends.
+        Power limiting is updated by the next control task on the main loop.
+    """
+    global powerLimitingPending
+    
+    log.warning("Battery {:.2f}V, motor power derating {}", rc.getMotorSupplyVoltage(), "on" if derated else "off")
+    powerLimitingPending = True
+
+
+@rc.driveUpdate()
 def updatePowerLimiting():
     """ Sets the maximum motor power based on controller btn states.
         Default power limit is 40% equivalent of motor driver Vin voltage.
         Holding left button 1 raises limit to 80%
         Holding right button 1 raises limit to 60%
         Holding both left & right button 1 raises limit to 100%
+        The limit is capped while the battery monitor is derating for low voltage.
     """
     global steeringLook
     
@@ -434,6 +499,7 @@ def updatePowerLimiting():
     if rightBtn1Pressed:
         powerLimit += thirdLevelAddn
         
+    powerLimit = min(powerLimit, rc.getBatteryPowerLimitCap())
     rc.setMotorPowerLimit(powerLimit)
     
     #Update motor speeds for new power limit level
@@ -455,34 +521,50 @@ def showImage(screen,filename, position = [0,0]):
         If no coordinates specified then will position at top left
     """
     try:
-        image = pygame.image.load( filename ).convert()
-        screen.blit( image, position )
+        du.markDirty( screen.blit( assets.getImage(filename), position ) )
         #print("Image placed at {}".format(position) )
     except: 
         screen.fill( (0,0,0) )
-        font = pygame.font.Font(None, 40)
-        textBitmap = font.render("Failed to load image: " + filename, True, Colour.Red.value )
+        shadowBitmap, textBitmap = assets.getText("Failed to load image: " + filename, 40, Colour.Red.value )
         screen.blit( textBitmap, (50, 200) )
+        du.markFullScreen()
     
     
 def showText(screen, text, position = [0,0], colour = Colour.White, size = 40, shadow=False, shadowCol=Colour.Black ):
     """ Displays text at the specified coordinates
         If no coordinates specified then will position at top left
+        Returns the rect of the screen drawn over.
     """
-    font = pygame.font.Font(None, size)
+    if shadow:
+        shadowBitmap, textBitmap = assets.getText(text, size, colour.value, shadowCol.value )
+        shadowRect = screen.blit( shadowBitmap, (position[0]+1,position[1]+1) )
+    else:
+        shadowBitmap, textBitmap = assets.getText(text, size, colour.value )
     
+    rect = screen.blit( textBitmap, position )
     if shadow:
-        textBitmap = font.render(text, True, shadowCol.value )
-        screen.blit( textBitmap, (position[0]+1,position[1]+1) )
+        rect.union_ip(shadowRect)
     
-    textBitmap = font.render(text, True, colour.value )
-    screen.blit( textBitmap, position )
+    du.markDirty(rect)
+    return rect
     
     
 def showSensorGraphics(leftDist, rightDist, frontDist):
-    setModeBackground()
+    """ Draws the robot graphic with the sensor beams and distances over it.
+        Only the parts of the screen which change are redrawn once the robot graphic is shown.
+    """
+    global robotGraphicOnScreen, sensorGraphicsRects
+    
+    if robotGraphicOnScreen:
+        #Erase the sensor beams drawn last time, and update any changes to the robot
+        for rect in sensorGraphicsRects:
+            rc.restoreRobotRegion(screen, rect)
+        rc.drawVirtualRobot(screen, full=False)
+    else:
+        rc.drawVirtualRobot(screen)
+        robotGraphicOnScreen = True
+    
     scale = 1
-    rc.drawVirtualRobot(screen)
     leftSource = (360,190)
     leftEnd1 = (360 - leftDist/scale,190-20)
     leftEnd2 = (360 - leftDist/scale,190+20)
@@ -492,25 +574,34 @@ def showSensorGraphics(leftDist, rightDist, frontDist):
     frontSource = (400,200)
     frontEnd1 = (400-20,200 - frontDist/scale)
     frontEnd2 = (400+20,200 - frontDist/scale)
-    pygame.draw.polygon(screen, Colour.Yellow.value, [leftSource,leftEnd1,leftEnd2])
-    pygame.draw.polygon(screen, Colour.Yellow.value, [rightSource,rightEnd1,rightEnd2])
-    pygame.draw.polygon(screen, Colour.Yellow.value, [frontSource,frontEnd1,frontEnd2])
+    sensorGraphicsRects = [
+        pygame.draw.polygon(screen, Colour.Yellow.value, [leftSource,leftEnd1,leftEnd2]),
+        pygame.draw.polygon(screen, Colour.Yellow.value, [rightSource,rightEnd1,rightEnd2]),
+        pygame.draw.polygon(screen, Colour.Yellow.value, [frontSource,frontEnd1,frontEnd2]),
+        ]
+    du.markAllDirty(sensorGraphicsRects)
     textsize = 20
-    showText(screen, "{}".format(leftDist), leftSource, size=textsize)
-    showText(screen, "{}".format(rightDist), rightSource, size=textsize)
-    showText(screen, "{}".format(frontDist), frontSource, size=textsize)
+    sensorGraphicsRects.append( showText(screen, "{}".format(leftDist), leftSource, size=textsize) )
+    sensorGraphicsRects.append( showText(screen, "{}".format(rightDist), rightSource, size=textsize) )
+    sensorGraphicsRects.append( showText(screen, "{}".format(frontDist), frontSource, size=textsize) )
     
 
 def showDebugData():
     textsize = 38
     lineHeight = 24
     cursor = (10,352)
-    pygame.draw.rect(screen, Colour.Purple.value, pygame.Rect(10,352,480,160))
+    du.markDirty( pygame.draw.rect(screen, Colour.Purple.value, pygame.Rect(10,352,480,160)) )
     showText(screen, "Debug Information:", cursor, size=textsize)
     cursor = (cursor[0]+20,cursor[1]+lineHeight)
     showText(screen, "Power Limiting: {}%".format( rc.getMotorPowerLimit() ), cursor, size=textsize)
     cursor = (cursor[0],cursor[1]+lineHeight)
     showText(screen, f"Batt: {rc.getMotorSupplyVoltage():.2f}V", cursor, size=textsize)
+    cursor = (cursor[0],cursor[1]+lineHeight)
+    showText(screen, f"Skipped unchanged writes: {rc.skippedWrites}", cursor, size=textsize)
+    cursor = (cursor[0],cursor[1]+lineHeight)
+    stats = assets.getStats()
+    textLookups = max(1, stats["textHits"] + stats["textMisses"])
+    showText(screen, f"Text cache hits: {100 * stats['textHits'] / textLookups:.0f}%", cursor, size=textsize)
     # cursor = (cursor[0],cursor[1]+lineHeight)
     # showText(screen, "Left motor ch1 pulse len: {}/4096".format( rc.getPWMPulseLength(12) ), cursor, size=textsize)
     # cursor = (cursor[0],cursor[1]+lineHeight)
@@ -520,63 +611,53 @@ def showDebugData():
     # cursor = (cursor[0],cursor[1]+lineHeight)
     # showText(screen, "Right motor ch2 pulse len: {}/4096".format( rc.getPWMPulseLength(15) ), cursor, size=textsize)
     
+    #Show main loop stage timings
+    textsize = 20
+    lineHeight = 15
+    cursor = (500,352)
+    du.markDirty( pygame.draw.rect(screen, Colour.Purple.value, pygame.Rect(500,352,290,128)) )
+    showText(screen, "Stage times ms (p50/p95/p99):", cursor, size=textsize)
+    for name, p50, p95, p99, count in LoopTiming.summary():
+        cursor = (cursor[0],cursor[1]+lineHeight)
+        showText(screen, f"{name}: {p50:.1f} / {p95:.1f} / {p99:.1f}", cursor, size=textsize)
+    
 
 def showMenu(level):
     """ Displays the menu graphics on screen """
-    global borderX
-    global borderY
-    global sepX
-    global sepY
     global menu
     
     menu = level
-    
-    if level == MenuLevel.top :
-        # Main menu with top level options
-        showImage( screen, "LagoonNebula.jpg" )
-        borderX = 50
-        borderY = 35
-        sepX = 250
-        sepY = 225
-        showImage( screen, "jupiter1_btn180.gif", (borderX,borderY) )
-        showText(screen, "Manual Control", (borderX+20,borderY+185), Colour.Blue, 30, True )
-        showImage( screen, "mars1_btn180.gif", (borderX+sepX,borderY) )
-        showText(screen, "Sensor Test", (borderX+sepX+34,borderY+185), Colour.Blue, 30, True )
-        showImage( screen, "pluto_btn180.gif", (borderX+2*sepX,borderY) )
-        showText(screen, "Wall Avoid", (borderX+2*sepX+34,borderY+185), Colour.Blue, 30, True )
-        showImage( screen, "neptune_btn180.gif", (borderX,borderY+sepY) )
-        showText(screen, "Hubble", (borderX+55,borderY+sepY+185), Colour.Blue, 30, True )
-        showImage( screen, "moon_btn180.gif", (borderX+sepX,borderY+sepY) )
-        showImage( screen, "venus1_btn180.gif", (borderX+2*sepX,borderY+sepY) )
-        showText(screen, "Exit", (borderX+2*sepX+70,borderY+sepY+185), Colour.Blue, 30, True )
-    elif level == MenuLevel.close :
-        # Program exit confirmation menu
-        showImage( screen, "LagoonNebula.jpg" )
-        borderX = 50
-        borderY = 150
-        sepX = 250
-        showImage( screen, "mercury1_btn180.gif", (borderX,borderY) )
-        showText(screen, "Shutdown", (borderX+44,borderY+185), Colour.Blue, 30, True )
-        showImage( screen, "neptune_btn180.gif", (borderX+sepX,borderY) )
-        showText(screen, "Desktop", (borderX+sepX+58,borderY+185), Colour.Blue, 30, True )
-        showImage( screen, "saturn_btn180.gif", (borderX+2*sepX,borderY) )
-        showText(screen, "Cancel", (borderX+2*sepX+54,borderY+185), Colour.Blue, 30, True )
-    elif level == MenuLevel.shutdownReboot :
-        # Shutdown/Reboot confirmation menu
-        showImage( screen, "LagoonNebula.jpg" )
-        borderX = 50
-        borderY = 150
-        sepX = 250
-        showImage( screen, "saturn_btn180.gif", (borderX,borderY) )
-        showText(screen, "Cancel", (borderX+58,borderY+185), Colour.Blue, 30, True )
-        showImage( screen, "uranus_btn180.gif", (borderX+sepX,borderY) )
-        showText(screen, "Reboot", (borderX+sepX+58,borderY+185), Colour.Blue, 30, True )
-        showImage( screen, "venus1_btn180.gif", (borderX+2*sepX,borderY) )
-        showText(screen, "Shutdown", (borderX+2*sepX+42,borderY+185), Colour.Blue, 30, True )
+    screen.blit( getMenuSurface(level), (0,0) )
+    du.markFullScreen()
+
+
+def getMenuSurface(level):
+    """ Returns the screen image for a menu level, rendering it from the layout on first use """
+    surface = menuSurfaces.get(level)
+    if surface is None:
+        surface = pygame.Surface( screen.get_size() ).convert()
+        showImage( surface, menuBackground )
+        for btn in menuLayouts[level]:
+            showImage( surface, btn.image, btn.position )
+            if btn.label is not None:
+                showText( surface, btn.label, btn.labelPosition, Colour.Blue, 30, True )
+        menuSurfaces[level] = surface
+    return surface
+
+
+def prerenderMenus():
+    """ Render all the menu screens, so showing a menu only costs a blit.
+        Must be called after the display mode has been set.
+    """
+    for level in menuLayouts:
+        getMenuSurface(level)
       
 
 def setModeBackground():
     """ Sets the display background for the current mode """
+    global robotGraphicOnScreen
+    
+    robotGraphicOnScreen = False
     if mode == Mode.manual :
         showImage( screen, "iss_solar_panel_orange.jpg" )
     elif mode == Mode.sensorsTest :
@@ -591,63 +672,26 @@ def getMenuBtn(pos):
     """ Returns the index of the button which the position matches on the screen menu.
         Returns -1 if no button at position.
     """
-    x = pos[0] - borderX
-    y = pos[1] - borderY
-    btnWidth = 180
-    col = -1
-    row = -1
-    btn = -1
-    numCols = 3
-    numRows = 2
-    
-    #Determine button column from X position
-    while x > 0 :
-        if x < btnWidth :
-            #Position inside btn area
-            col += 1
-            break
-        elif x > sepX:
-            #Position beyond seperation to next btn area
-            x -= sepX
-            col += 1
-        else:
-            #Position in between btn areas
-            col = -1
-            break
-    
-    if col >= 0 and col < numCols :
-        #Determine button row from Y position
-        while y > 0 :
-            if y < btnWidth :
-                #Position inside btn area
-                row += 1
-                break
-            elif y > sepY:
-                #Position beyond seperation to next btn area
-                y -= sepY
-                row += 1
-            else:
-                #Position in between btn areas
-                row = -1
-                break
-            
-        if row >= 0 and row < numRows :
-            btn = (numCols * row) + col
-        
-    return btn
+    for index, btn in enumerate( menuLayouts.get(menu, []) ):
+        if pygame.Rect(btn.position, (menuBtnSize,menuBtnSize)).collidepoint(pos):
+            return index
+    
+    return -1
 
 
 def setMode(newMode):
     """ Sets up robot for specified mode. """
-    global mode, mazeState 
+    global mode, shownMazeState
     
-    #Stop hardware
+    #Stop autonomous driving and hardware
+    ad.stopAutonomous()
     rc.stopAll()
     disarmShooter() #This also restores led matrices to eye_open pattern
     
     #Update global mode
     # print(f"Setting mode: {newMode}")
     mode = newMode
+    sensorDistances[:] = [0,0,0]
     
     #Update display for active mode
     if mode == Mode.menu :
@@ -666,12 +710,15 @@ def setMode(newMode):
             ad.initialisePID()
             Sensors.startAll()
             initDriving()
+            ad.startAutonomous(Sensors.snapshot)
         elif mode == Mode.hubbleChallenge :
             #Initialise pixy
             ad.initialisePID()
             Sensors.startAll()
             initDriving()
-            mazeState  = 0
+            ad.mazeState = 0
+            shownMazeState = 0
+            ad.startAutonomous(Sensors.snapshot, maze=True)
 
 def initDriving():
     """ Initialise robot for driving modes """
@@ -706,21 +753,133 @@ def setSteering(setAngle):
                 eyesPos = 0
 
 
-def main():
-    global screen, debugInfo, autoCycles, eyes, mazeState
+def watchdogTask():
+    """ Scheduled task which keeps the motors alive """
+    with LoopTiming.stage("watchdog"):
+        rc.sb.pulseWatchdog()
 
+
+def controlTask():
+    """ Scheduled task which reads the controller and sensors and applies autonomous driving commands """
+    global shownMazeState, powerLimitingPending
+    
+    #Apply a power limit change requested by the battery monitor
+    if powerLimitingPending:
+        powerLimitingPending = False
+        updatePowerLimiting()
     
-    virtual = True #Tracks whether running on real robot or digital twin virtual robot simulation
+    #Exit to menu if both select and start buttons are held down at the same time
+    if selectBtnPressed and startBtnPressed:
+        setMode(Mode.menu)
+
+    if mode == Mode.sensorsTest :
+        #Get sensor readings for display on screen
+        with LoopTiming.stage("sensors"):
+            distances = Sensors.snapshot()
+        #Keep showing the last readings until the sensors have new ones
+        if distances is not None:
+            sensorDistances[:] = distances
+        
+    elif mode == Mode.wallFollowing or mode == Mode.hubbleChallenge :
+        #Autonomous driving runs on its own thread, so just apply its latest commands
+        if not ad.applyPendingCommand():
+            #Driving thread has failed, so stop the robot rather than let it drive on blind
+            log.error("Autonomous driving thread stopped, returning to menu")
+            setMode(Mode.menu)
+        elif ad.autoDriver is not None:
+            sensorDistances[:] = ad.autoDriver.lastSensors
+        
+        if mode == Mode.hubbleChallenge and ad.mazeState != shownMazeState:
+            #Actually this is the maze challenge, but I don't have time to rename to modes.
+            shownMazeState = ad.mazeState
+            du.markDirty( pygame.draw.rect(screen, Colour.Purple.value, pygame.Rect(10,440,400,30)) )
+            showText(screen, "Maze State: {}".format(shownMazeState), (10,442), size=32)
+    
+    #Trigger stick events and check for quit
+    if not robotControl.controllerStatus() or stopProgram:
+        scheduler.stop()
+
+
+def shooterTask():
+    """ Scheduled task which advances the dart shooter state machine """
+    global shooterSeenAt
+    
+    ds.tick()
+    #Check every transition since the last run, as motorOn can start spinning up outside tick
+    for changedAt, newState in list(ds.transitions):
+        if changedAt > shooterSeenAt:
+            shooterSeenAt = changedAt
+            if newState == ds.ShooterState.spinningUp:
+                #Show target once ESC is armed
+                eyes.showNow(ledMatrixDisplays.target)
+
+
+def ledTask():
+    """ Scheduled task which updates the LED matrix displays """
+    global blinkCounter, blinkPause
+    
+    if mode == Mode.menu :
+        #Queue up blink after random number of frames (5 to 12.5 seconds)
+        if blinkCounter == 0:
+            blinkPause = random.randint(5 * ledRate, int(12.5 * ledRate))
+        blinkCounter += 1
+        if blinkCounter > blinkPause:
+            blinkCounter = 0
+            eyes.blink()
+            
+    #Update led RGB matrix displays with next frame of any queued animation
+    with LoopTiming.stage("eyes"):
+        eyes.showNext()
+
+
+def uiTask():
+    """ Scheduled task which draws the screen for the current mode """
+    global robotGraphicOnScreen
+    
+    #Redraw robot graphic, or just the parts which changed since the last frame
+    if mode != Mode.menu and rc.showRobotGraphic:
+        if robotGraphicOnScreen:
+            rc.refreshVirtualRobot(screen, full=False)
+        else:
+            rc.drawVirtualRobot(screen)
+            robotGraphicOnScreen = True
+    
+    if mode == Mode.sensorsTest or ( debugInfo > 0 and
+            (mode == Mode.wallFollowing or mode == Mode.hubbleChallenge) ):
+        with LoopTiming.stage("sensorGraphics"):
+            showSensorGraphics(*sensorDistances)
+            
+    if mode != Mode.menu and debugInfo == 1:
+        #Display debugging info on screen relevent to mode
+        with LoopTiming.stage("debugData"):
+            showDebugData()
+        
+    with LoopTiming.stage("display"):
+        du.update()
+
+
+def telemetryTask():
+    """ Scheduled task which publishes the robot state to the telemetry receiver """
+    with LoopTiming.stage("telemetry"):
+        telemetry.publish( Telemetry.robotState(sensorDistances, scheduler) )
+
+
+def main():
+    global screen, debugInfo, eyes, robotControl, telemetry
+
     
     # Determine screen resolution before pygame window is created
     pygame.init()
     screen_w = 800 #pygame.display.Info().current_w FAILED to detect screen size on bullseyed
     screen_h = 480 #pygame.display.Info().current_h
     
+    #Open hardware devices in the background while waiting for the game controller
+    hw.startInBackground()
+    
     #Run in try..finally structure so that program exits gracefully on hitting any
     #errors in the callback functions
     try:
-        robotControl = RobotController("Rocky Rover Remote Control", initStatus,
+        robotControl = backend.createRobotController("Rocky Rover Remote Control", initStatus,
             leftStickChanged = leftStickChangeHandler,
             rightStickChanged = rightStickChangeHandler,
             leftTriggerChanged = leftTriggerChangeHandler,
@@ -748,17 +907,26 @@ def main():
                 display_mode = pygame.FULLSCREEN
                 #Default to not show debug info when on HyperPixel (on real robot)
                 debugInfo = 0
-                virtual = False
-                autoCycles = 10
                 
             robotControl.screen = pygame.display.set_mode(screen_size,display_mode)
             screen = robotControl.screen
+            #Decode and convert all UI images once up front
+            assets.preload()
+            prerenderMenus()
             # Create LED matrix display instance after pygame display is defined for virtual LED display to work
             eyes = ledMatrixDisplays.LEDMatrixDisplays()
+            #Send frames to the displays from a background thread, as each one takes tens of ms over i2c
+            eyes.startWriter()
             # Display eyes on LED matrix displays
             eyes.addFrame(ledMatrixDisplays.eye_open)
+            print("Hardware initialisation times:")
+            hw.printReport()
+            #Sample the battery voltage in the background, derating motor power when it is low
+            rc.startBatteryMonitor(batteryDeratingChanged)
             # Initialise whether to display robot graphic
             rc.showRobotGraphic = (debugInfo > 0)
+            # Redraw the robot graphic once per UI frame rather than on every actuator change
+            rc.deferRobotGraphic = True
             #Initialise tof sensors
             # Sensors.initialise()
 
@@ -767,142 +935,40 @@ def main():
             keepRunning = False
             
         # -------- Main Program Loop -----------
-        frame = 0
-        blinkCounter = 0
-        blinkPause = 0
-        timeC = time.perf_counter() 
-        while keepRunning == True :
-            frame += 1
-            #message = "Speed: {}, Steering: {}".format(speed,angle)
-            #robotControl.message = message
-
-            # Keep motors alive
-            rc.sb.pulseWatchdog()
-            
-            #Exit to menu if both select and start buttons are held down at the same time
-            if selectBtnPressed and startBtnPressed:
-                setMode(Mode.menu)
-
-            #Check for controller button combinations and queue up animations in different modes
-            if mode == Mode.menu :
-                #Queue up blink after random number of frames
-                if blinkCounter == 0:
-                    blinkPause = random.randint(100,250)
-                blinkCounter += 1
-                if blinkCounter > blinkPause:
-                    blinkCounter = 0
-                    eyes.blink()
-            elif mode == Mode.manual :
-                if debugInfo == 1:
-                    #Display debugging info on screen relevent to mode
-                    showDebugData()
-            elif mode == Mode.sensorsTest :
-                #Get sensor readings and display on screen
-                leftDist = Sensors.readDistance(1)
-                rightDist = Sensors.readDistance(2)
-                frontDist = Sensors.readDistance(3)
-                showSensorGraphics(leftDist, rightDist, frontDist)
-                
-            elif mode == Mode.wallFollowing :
-                #Run preset number of cycles of auto driving code before dropping back to main robot loop
-                #Controller will not respond in inside this loop. Loop exits if front sensor detects obstackle.
-                for a in range( autoCycles ):
-                    #Update steering and motors based on sensor readings
-                    #print("Loop time: {:.2f}".format( time.perf_counter() - timeC ) )
-                    #timeC = time.perf_counter()
-
-                    leftDist = Sensors.readDistance(1)
-                    rightDist = Sensors.readDistance(2)
-                    frontDist = Sensors.readDistance(3)
-                    #print("Sensors read time: {:.2f}".format( time.perf_counter() - timeC ) )
-                    
-                    #Update robot based on autonomous driving algorithm 
-                    ad.wallMidPointPID(leftDist, rightDist, frontDist)
-                    if debugInfo > 0:
-                        showSensorGraphics(leftDist, rightDist, frontDist)
-                    if debugInfo == 1:
-                        #Display debugging info on screen relevent to mode
-                        showDebugData()
-                    #Break from inner auto cycle loop if front sensor distance below min
-                    if frontDist < ad.minFrontDist:
-                        break
-                    
-            elif mode == Mode.hubbleChallenge :
-                #Actually this is the maze challenge, but I don't have time to rename to modes.
-                #Run preset number of cycles of auto driving code before dropping back to main robot loop
-                #Controller will not respond in inside this loop. Loop exits if front sensor detects obstackle.
-                for a in range( autoCycles ):
-                    #Update steering and motors based on sensor readings
-                    #print("Loop time: {:.2f}".format( time.perf_counter() - timeC ) )
-                    #timeC = time.perf_counter()
-
-                    leftDist = Sensors.readDistance(1)
-                    rightDist = Sensors.readDistance(2)
-                    frontDist = Sensors.readDistance(3)
-                    #print("Sensors read time: {:.2f}".format( time.perf_counter() - timeC ) )
-                    
-                    #Update robot based on autonomous driving algorithm 
-                    ad.wallMidPointPID(leftDist, rightDist, frontDist)
-                    if debugInfo > 0:
-                        showSensorGraphics(leftDist, rightDist, frontDist)
-                    if debugInfo == 1:
-                        #Display debugging info on screen relevent to mode
-                        showDebugData()
-                    #Break from inner auto cycle loop if front sensor distance below min
-                    if frontDist < ad.minFrontDist:
-                        #Turn based on state
-                        if mazeState == 0:
-                            rc.turn90Deg(False)
-                        elif mazeState == 1:
-                            rc.turn90Deg(False)
-                        elif mazeState == 2:
-                            rc.turn90Deg(True)
-                        elif mazeState == 3:
-                            rc.turn90Deg(True)
-                        elif mazeState == 4:
-                            rc.turn90Deg(False)
-                        elif mazeState == 5:
-                            rc.turn90Deg(False)
-                        elif mazeState == 6:
-                            rc.turn90Deg(False)
-                        elif mazeState == 7:
-                            rc.turn90Deg(True)
-                        #Check forward is now clear
-                        frontDist = Sensors.readDistance(3)
-                        if frontDist > ad.minFrontDist:
-                            #Increment state and drive forwards for 0.25 seconds
-                            ad.setMotorPower(100)
-                            time.sleep(0.25)
-                            mazeState += 1
-                            pygame.draw.rect(screen, Colour.Purple.value, pygame.Rect(10,440,400,30))
-                            showText(screen, "Maze State: {}".format(mazeState), (10,442), size=32)
-                        
-                        
-                        #Allow controller to be read
-                        break
-                    
-                   
-                        
-            #Update led RGB matrix displays with next frame of any queued animation
-            if frame > 0:
-                eyes.showNext()
-                frame = 0
-            elif virtual:
-                #Re-render current image on screen (only needed for virtual displays)
-                eyes.reshow()
-            pygame.display.flip()
-            #print("Trigger Events: {}".format( time.perf_counter() ) )
-                
-            #Trigger stick events and check for quit
-            keepRunning = robotControl.controllerStatus() and not stopProgram
-            
-            #print("Events Completed: {}".format( time.perf_counter() ) )
-            time.sleep(0.05)
+        if keepRunning == True :
+            if sessionLogging:
+                print("Logging session to {}".format( SessionLog.start() ) )
+            scheduler.addTask("watchdog", watchdogRate, watchdogTask, priority=0)
+            scheduler.addTask("control", controlRate, controlTask, priority=1)
+            scheduler.addTask("shooter", shooterRate, shooterTask, priority=2)
+            scheduler.addTask("leds", ledRate, ledTask, priority=3)
+            scheduler.addTask("ui", uiRate, uiTask, priority=4)
+            if telemetryTarget:
+                host, _, port = telemetryTarget.partition(":")
+                try:
+                    telemetry = Telemetry.Publisher(host, int(port or Telemetry.defaultPort))
+                    scheduler.addTask("telemetry", telemetryRate, telemetryTask, priority=5)
+                except (OSError, ValueError) as e:
+                    print("Telemetry disabled, cannot send to {}: {}".format(telemetryTarget, e))
+            scheduler.run()
+            print("Scheduler stats: {}".format( scheduler.getStats() ) )
     finally:
         #Clean up and turn off hardware (motors)
+        ad.stopAutonomous()
         rc.stopAll()
+        rc.stopBatteryMonitor()
         #Clear rgb matrix displays
+        eyes.stopWriter()
         eyes.clear()
+        print("Asset cache stats: {}".format( assets.getStats() ) )
+        print("Dropped log messages: {}".format( RingLogger.getStats() ) )
+        LoopTiming.dump(timingLogFile)
+        SessionLog.stop()
+        if sessionLogging:
+            print("Session log stats: {}".format( SessionLog.getStats() ) )
+        if telemetry is not None:
+            print("Telemetry stats: {}".format( telemetry.getStats() ) )
+            telemetry.close()
         pygame.quit()
 
 
@@ -3,10 +3,10 @@
 """ Sensor reading functions for PiWars Rocky Rover robot
 """
 
-import time
-import board
-import digitalio
-import adafruit_vl53l1x
+import time, threading
+import HardwareRegistry as hw
+import HardwareBackend as backend
+import SessionLog
 
 #Sensors and channels configuration
 leftSensorAddr = 0x30
@@ -16,16 +16,93 @@ leftSensorEnableIO = 0
 rightSensorEnableIO = 1
 frontSensorEnableIO = 2
 
-i2c = board.I2C()
+def initFrontSensor():
+    """ Open the front tof sensor """
+    tof = backend.createVL53L1X(i2c.get())
+    tof.distance_mode = 1
+    tof.timing_budget = 100
+    return tof
+
+#Devices are opened on first use (or in the background by HardwareRegistry.startInBackground)
+i2c = hw.LazyDevice("i2c", backend.createI2C)
 
 tof1 = 0
 tof2 = 0
-tof3 = adafruit_vl53l1x.VL53L1X(i2c)
-tof3.distance_mode = 1
-tof3.timing_budget = 100
+tof3 = hw.LazyDevice("frontTof", initFrontSensor)
 
 tofs = [tof1,tof2,tof3]
 
+#Distance (mm) reported by the left and right sensors, which are not fitted.
+#Being equal, they keep the wall mid point steering straight ahead.
+unfittedSensorDistance = 10
+
+#Number of readings kept per sensor by the background samplers
+sampleBufferSize = 64
+samplers = [None,None,None]
+
+
+class TofSampler(threading.Thread):
+    """ Background thread which ranges a VL53L1X sensor continuously and stores
+        timestamped readings in a preallocated ring buffer.
+    """
+    
+    def __init__(self, vl53, bufferSize=sampleBufferSize):
+        super().__init__(daemon=True)
+        self.vl53 = vl53
+        self.bufferSize = bufferSize
+        self.times = [0.0] * bufferSize
+        self.distances = [0] * bufferSize
+        self.count = 0 #Total number of readings taken (index of next slot is count % bufferSize)
+        self.lock = threading.Lock()
+        self.stopRequested = threading.Event()
+        
+    def run(self):
+        #Poll the data ready flag at a fraction of the timing budget so readings
+        #are collected soon after they become available
+        budget = self.vl53.timing_budget / 1000
+        pollInterval = budget / 10
+        while not self.stopRequested.is_set():
+            try:
+                if self.vl53.data_ready:
+                    distance = self.vl53.distance # Sensor library returns cm as float
+                    self.vl53.clear_interrupt()
+                    if distance is not None and distance > 0:
+                        self.add(time.perf_counter(), distance * 10)
+                    #Next reading will not be ready until the timing budget has passed
+                    self.stopRequested.wait(budget * 0.9)
+                else:
+                    self.stopRequested.wait(pollInterval)
+            except Exception as e:
+                print(f"Error reading sensor: {e}")
+                self.stopRequested.wait(budget)
+    
+    def add(self, timestamp, distance):
+        """ Store a reading in the ring buffer """
+        with self.lock:
+            idx = self.count % self.bufferSize
+            self.times[idx] = timestamp
+            self.distances[idx] = distance
+            self.count += 1
+            
+    def stop(self):
+        self.stopRequested.set()
+        
+    def latest(self):
+        """ Returns the most recent (timestamp, distance) reading, or None if no readings yet """
+        with self.lock:
+            if self.count == 0:
+                return None
+            idx = (self.count - 1) % self.bufferSize
+            return (self.times[idx], self.distances[idx])
+        
+    def window(self, n):
+        """ Returns up to the last n (timestamp, distance) readings, oldest first """
+        with self.lock:
+            n = min(n, self.count, self.bufferSize)
+            first = self.count - n
+            return [ (self.times[i % self.bufferSize], self.distances[i % self.bufferSize])
+                     for i in range(first, self.count) ]
+
 
 def start(sensor):
     """ Turn on a tof sensor.
@@ -39,6 +116,7 @@ def start(sensor):
 def startAll():
     for a in range(3,4):
         start(a)
+        startSampler(a)
 
 def stop(sensor):
     """ Turn off a tof sensor.
@@ -53,13 +131,59 @@ def stop(sensor):
 
 def stopAll():
     for a in range(3,4):
+        stopSampler(a)
         stop(a)
 
+
+def startSampler(sensor):
+    """ Start a background sampling thread for a tof sensor (which must already be ranging) """
+    if samplers[sensor-1] is None:
+        try:
+            sampler = TofSampler(tofs[sensor-1].get())
+            sampler.start()
+            samplers[sensor-1] = sampler
+        except Exception as e:
+            print(f"Error starting sampler for sensor {sensor}: {e}")
+        
+        
+def stopSampler(sensor):
+    """ Stop the background sampling thread for a tof sensor """
+    sampler = samplers[sensor-1]
+    if sampler is not None:
+        sampler.stop()
+        sampler.join()
+        samplers[sensor-1] = None
+
+
+def latest(sensor):
+    """ Returns the latest (timestamp, distance) reading from a sensor's sampler without blocking.
+        Returns None if the sensor is not being sampled or has no readings yet.
+    """
+    sampler = samplers[sensor-1]
+    if sampler is None:
+        return None
+    return sampler.latest()
+
+
+def window(sensor, n):
+    """ Returns up to the last n (timestamp, distance) readings from a sensor's sampler, oldest first """
+    sampler = samplers[sensor-1]
+    if sampler is None:
+        return []
+    return sampler.window(n)
+
 def readDistance(sensor):
     """ Read the distance from the specified tof sensor.
+        Returns None if the sensor has no reading (rather than 0, which would be an obstacle touching the robot).
     """
     if sensor < 3:
-        distance_in_mm = 10
+        distance_in_mm = unfittedSensorDistance
+    elif samplers[sensor-1] is not None:
+        # Return latest reading from background sampler without blocking
+        reading = samplers[sensor-1].latest()
+        if reading is None:
+            return None
+        distance_in_mm = reading[1]
     else:
         # Try 3 times to get a reading
         vl53 = tofs[sensor-1]
@@ -72,10 +196,23 @@ def readDistance(sensor):
                 break
             else:
                 time.sleep(0.1)
+        if distance_in_mm <= 0:
+            return None
 
+    SessionLog.log(SessionLog.distanceRecord, sensor, distance_in_mm)
     return distance_in_mm
 
 
+def snapshot():
+    """ Returns a tuple of the latest (left, right, front) distances,
+        or None if any of the sensors has no reading yet
+    """
+    distances = (readDistance(1), readDistance(2), readDistance(3))
+    if None in distances:
+        return None
+    return distances
+
+
 def test():
     """ Test sensors connected to multiplexer """
     for a in range(1,4):
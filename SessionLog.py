@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+
+""" Append only binary log of a Rocky Rover session, for reproducing runs.
+    Sensor readings, game controller stick and trigger events and actuator commands are
+    stored as fixed size timestamped records. Logging just appends a tuple to a queue,
+    and a background thread packs and writes the queued records a few times a second.
+    The queue is bounded, so if the file cannot keep up new records are dropped and counted.
+    Log files are memory mapped for reading, so even long sessions open instantly, and
+    a Replayer feeds the logged sensor readings back into AutonomousDriving.
+    RockyRover logs its sessions when run with ROCKY_SESSION_LOG=1.
+
+    Usage:
+        SessionLog.start()
+        SessionLog.log(SessionLog.distanceRecord, 3, 452.0)
+        SessionLog.stop()
+
+        python3 SessionLog.py summary logs/session_20190330_101500.rlog
+        python3 SessionLog.py dump logs/session_20190330_101500.rlog --limit 100
+        python3 SessionLog.py replay logs/session_20190330_101500.rlog --Pk 0.4
+"""
+
+import os, time, mmap, struct, threading, argparse
+from collections import deque, namedtuple
+
+logFolder = "logs"
+flushInterval = 0.2 #Seconds between writes of queued records to the file
+maxQueuedRecords = 20000 #Records held waiting to be written. Later records are dropped when full.
+
+#File header: magic, format version, record size, wall clock time and perf_counter time at start
+headerStruct = struct.Struct("<8sHHdd")
+logMagic = b"ROCKYLOG"
+logVersion = 1
+#Record: perf_counter timestamp, record type, channel and three values
+recordStruct = struct.Struct("<dHHfff")
+
+#Record types
+distanceRecord = 1 #channel: sensor number, a: distance (mm)
+stickRecord = 2 #channel: 0 left or 1 right stick, a: left/right position, b: up/down position
+triggerRecord = 3 #channel: 0 left or 1 right trigger, a: value
+servoRecord = 4 #channel: servo channel, a: servo position, b: 1 if sent to the board or 0 if unchanged
+motorRecord = 5 #channel: motor number, a: power, b: power limit (%), c: 1 if sent to the board or 0 if unchanged
+
+recordNames = {
+    distanceRecord: "distance",
+    stickRecord: "stick",
+    triggerRecord: "trigger",
+    servoRecord: "servo",
+    motorRecord: "motor",
+    }
+
+Record = namedtuple("Record", ["time", "type", "channel", "a", "b", "c"])
+
+queue = None #Records waiting to be written (None when not logging)
+writer = None
+written = 0 #Records written by the last log, once it has stopped
+dropped = 0 #Records dropped because the queue was full
+
+
+def log(recordType, channel, a=0.0, b=0.0, c=0.0):
+    """ Add a record to the session log. Does nothing if logging has not been started.
+        Safe to call from any thread.
+    """
+    global dropped
+    
+    records = queue #Read once, as another thread may stop logging
+    if records is not None:
+        if len(records) >= maxQueuedRecords:
+            dropped += 1
+        else:
+            records.append( (time.perf_counter(), recordType, channel, a, b, c) )
+
+
+class LogWriter(threading.Thread):
+    """ Background thread which writes the queued records to the log file """
+
+    def __init__(self, file, records):
+        super().__init__(daemon=True)
+        self.file = file
+        self.records = records
+        self.written = 0
+        self.stopRequested = threading.Event()
+
+    def run(self):
+        while not self.stopRequested.wait(flushInterval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """ Pack and write all the queued records """
+        count = len(self.records)
+        if count == 0:
+            return
+        buffer = bytearray(count * recordStruct.size)
+        for i in range(count):
+            recordStruct.pack_into(buffer, i * recordStruct.size, *self.records.popleft())
+        self.file.write(buffer)
+        self.file.flush()
+        self.written += count
+
+    def stop(self):
+        self.stopRequested.set()
+
+
+def start(filename=None):
+    """ Start logging to a new file (by default named from the time in the log folder).
+        Returns the name of the file.
+    """
+    global queue, writer, written, dropped
+
+    stop()
+    if filename is None:
+        os.makedirs(logFolder, exist_ok=True)
+        filename = os.path.join(logFolder, time.strftime("session_%Y%m%d_%H%M%S.rlog"))
+    file = open(filename, "ab")
+    if file.tell() == 0:
+        file.write( headerStruct.pack(logMagic, logVersion, recordStruct.size, time.time(), time.perf_counter()) )
+    written = dropped = 0
+    queue = deque(maxlen=maxQueuedRecords)
+    writer = LogWriter(file, queue)
+    writer.start()
+    return filename
+
+
+def stop():
+    """ Stop logging, writing any queued records and closing the file """
+    global queue, writer, written
+
+    if writer is not None:
+        queue = None
+        writer.stop()
+        writer.join()
+        writer.file.close()
+        written = writer.written
+        writer = None
+
+
+def getStats():
+    """ Returns a dictionary of the number of records written and dropped by the current (or last) log """
+    return { "written": written if writer is None else writer.written, "dropped": dropped }
+
+
+class SessionReader:
+    """ Memory mapped reader of a session log file. Records are unpacked when accessed. """
+
+    def __init__(self, filename):
+        self.file = open(filename, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, recordSize, self.startTime, self.startClock = headerStruct.unpack_from(self.map, 0)
+        if magic != logMagic or version != logVersion or recordSize != recordStruct.size:
+            self.close()
+            raise ValueError("{} is not a version {} session log".format(filename, logVersion))
+        #Ignore any partly written record at the end of the file
+        self.count = (len(self.map) - headerStruct.size) // recordStruct.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError("Record index out of range")
+        return Record._make( recordStruct.unpack_from(self.map, headerStruct.size + index * recordStruct.size) )
+
+    def __iter__(self):
+        return self.records()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
+
+    def records(self, types=None):
+        """ Iterate over the records (optionally only those of the given types) in time order """
+        for index in range(self.count):
+            record = Record._make( recordStruct.unpack_from(self.map, headerStruct.size + index * recordStruct.size) )
+            if types is None or record.type in types:
+                yield record
+
+    def toArray(self):
+        """ Returns the records as a NumPy structured array (a view of the mapped file, so no
+            records are copied however long the session was)
+        """
+        import numpy as np
+        dtype = np.dtype([ ("time", "<f8"), ("type", "<u2"), ("channel", "<u2"), ("a", "<f4"), ("b", "<f4"), ("c", "<f4") ])
+        return np.frombuffer(self.map, dtype, count=self.count, offset=headerStruct.size)
+
+    def duration(self):
+        """ Returns the time from the start of logging to the last record (seconds) """
+        if self.count == 0:
+            return 0.0
+        return self[-1].time - self.startClock
+
+    def close(self):
+        try:
+            self.map.close()
+        except BufferError:
+            #Arrays from toArray still view the map, so it is closed when they are released
+            pass
+        self.file.close()
+
+
+ReplayStep = namedtuple("ReplayStep", ["time", "leftDist", "rightDist", "frontDist", "command", "loggedSteering"])
+
+
+class Replayer:
+    """ Feeds the logged sensor readings of a session into the autonomous driving wall mid point
+        controller with its current settings. A control step is run for each complete set of
+        left, right and front readings (as taken by Sensors.snapshot), at the nominal control period.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def run(self, speed=None, callback=None):
+        """ Replay the session. speed is a multiple of real time to pace the replay at
+            (None runs as fast as possible). callback is called with each ReplayStep.
+            Returns a list of ReplayStep, where loggedSteering is the steering angle the
+            robot was set to by the end of the step (or None if not known).
+        """
+        import AutonomousDriving as ad
+        import RobotControl as rc
+
+        ad.initialisePID()
+        controlPeriod = 1 / ad.autoControlRate
+        distances = [0.0, 0.0, 0.0]
+        motorPower = 0
+        steering = None
+        steps = []
+        startClock = time.perf_counter()
+
+        def finishStep():
+            if steps and steps[-1].loggedSteering is None and steering is not None:
+                steps[-1] = steps[-1]._replace(loggedSteering=steering)
+                if callback is not None:
+                    callback(steps[-1])
+
+        for record in self.reader.records( (distanceRecord, servoRecord) ):
+            if record.type == servoRecord:
+                if record.channel == rc.servoFrontLeftChannel:
+                    steering = 90 - (record.a - rc.servoFrontLeftOffset)
+                continue
+            if record.channel < 1 or record.channel > 3:
+                continue
+            distances[record.channel - 1] = record.a
+            if record.channel != 3:
+                continue
+
+            finishStep()
+            if speed is not None:
+                delay = (record.time - self.reader.startClock) / speed - (time.perf_counter() - startClock)
+                if delay > 0:
+                    time.sleep(delay)
+            command = ad.wallMidPointCommand(distances[0], distances[1], distances[2], motorPower, controlPeriod)
+            if command.leftPower is not None:
+                motorPower = command.leftPower
+            steps.append( ReplayStep(record.time - self.reader.startClock, distances[0], distances[1], distances[2], command, None) )
+
+        finishStep()
+        return steps
+
+
+def summary(reader):
+    """ Returns a dictionary of the count of each record type in a log """
+    counts = { name: 0 for name in recordNames.values() }
+    for record in reader:
+        name = recordNames.get(record.type)
+        if name is not None:
+            counts[name] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read and replay Rocky Rover session logs")
+    parser.add_argument("command", choices=["summary", "dump", "replay"])
+    parser.add_argument("filename", help="Session log file")
+    parser.add_argument("--limit", type=int, help="Maximum number of records or steps to print")
+    parser.add_argument("--speed", type=float, help="Replay speed as a multiple of real time (default is as fast as possible)")
+    for name in ("Pk", "Ik", "Dk", "maxSteeringAngle", "minFrontDist", "autoControlRate"):
+        parser.add_argument("--" + name, type=float, help="Override AutonomousDriving.{} for the replay".format(name))
+    args = parser.parse_args()
+
+    with SessionReader(args.filename) as reader:
+        print("{} records over {:.1f}s, started {}".format(len(reader), reader.duration(),
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(reader.startTime))))
+
+        if args.command == "summary":
+            for name, count in summary(reader).items():
+                print("{:<10} {:>9}".format(name, count))
+
+        elif args.command == "dump":
+            for index, record in enumerate(reader):
+                if args.limit is not None and index >= args.limit:
+                    break
+                print("{:10.4f} {:<9} {:>3} {:10.2f} {:10.2f} {:10.2f}".format(record.time - reader.startClock,
+                    recordNames.get(record.type, record.type), record.channel, record.a, record.b, record.c))
+
+        else:
+            os.environ.setdefault("ROCKY_HARDWARE", "sim")
+            import AutonomousDriving as ad
+            for name in ("Pk", "Ik", "Dk", "maxSteeringAngle", "minFrontDist", "autoControlRate"):
+                value = getattr(args, name)
+                if value is not None:
+                    setattr(ad, name, value)
+
+            start = time.perf_counter()
+            steps = Replayer(reader).run(args.speed)
+            elapsed = time.perf_counter() - start
+
+            differences = [ abs(step.command.steering - step.loggedSteering) for step in steps if step.loggedSteering is not None ]
+            for step in steps[:args.limit]:
+                logged = "" if step.loggedSteering is None else "{:8.2f}".format(step.loggedSteering)
+                print("{:10.4f} L {:7.1f} R {:7.1f} F {:7.1f}  steering {:8.2f} logged {}".format(step.time,
+                    step.leftDist, step.rightDist, step.frontDist, step.command.steering, logged))
+            print("Replayed {} steps in {:.3f}s".format(len(steps), elapsed))
+            if differences:
+                print("Steering difference from log: mean {:.2f} max {:.2f} degrees".format(
+                    sum(differences) / len(differences), max(differences)))
+
+
+if __name__ == '__main__':
+    main()
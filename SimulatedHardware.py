@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+
+""" Simulated hardware for running the Rocky Rover code without a robot.
+    Selected by HardwareBackend when ROCKY_HARDWARE=sim is set. The models reproduce
+    the costs which matter to the control loop: every I2C transaction blocks for the
+    time it would take on the bus, the VL53L1X only has new data once per timing
+    budget, the PCA9685 keeps its register state, and the Sentinel board watchdog
+    counts the times it would have cut the motors.
+"""
+
+import math, os, random, threading, time
+
+#Motor supply voltage reported by the simulated Sentinel board
+batteryVoltage = 7.4
+#Time after the last watchdog pulse at which the Sentinel board would stop the motors
+watchdogTimeout = 0.5
+#Draw the LED matrix displays onto the pygame screen
+virtualLEDDisplay = False
+virtualLEDSize = 20
+#Seconds to run the scripted game controller for (None to run until the window is closed)
+simDurationEnvVar = "ROCKY_SIM_DURATION"
+
+
+class SimI2CBus:
+    """ Shared I2C bus. Transactions are serialised and each blocks the caller for
+        the time it would take at the bus clock rate, plus a fixed per transaction overhead.
+    """
+
+    def __init__(self, clockHz=100000, overhead=0.00008):
+        self.clockHz = clockHz
+        self.overhead = overhead
+        self.latencyScale = 1.0 #Set to 0 to remove bus delays
+        self.lock = threading.Lock()
+        self.transactions = 0
+        self.bytesTransferred = 0
+        self.busyTime = 0.0
+
+    def transactionTime(self, nbytes):
+        """ Time in seconds to send the address byte plus nbytes (9 clocks per byte) """
+        return (self.overhead + (nbytes + 1) * 9 / self.clockHz) * self.latencyScale
+
+    def transfer(self, nbytes):
+        """ Block for the duration of one transaction of nbytes """
+        duration = self.transactionTime(nbytes)
+        with self.lock:
+            if duration > 0:
+                time.sleep(duration)
+            self.transactions += 1
+            self.bytesTransferred += nbytes + 1
+            self.busyTime += duration
+
+    def getStats(self):
+        return {
+            "transactions": self.transactions,
+            "bytes": self.bytesTransferred,
+            "busyTime": self.busyTime,
+            }
+
+
+#All simulated devices share one bus, as on the robot
+bus = SimI2CBus()
+
+
+class SimI2CDevice:
+    """ Register file of an I2C device, with the Adafruit_I2C read and write methods """
+
+    def __init__(self, address, registers, autoIncrement=None):
+        self.address = address
+        self.registers = registers
+        self.autoIncrement = autoIncrement #Callable returning whether block writes auto increment
+
+    def readU8(self, reg):
+        bus.transfer(2)
+        return self.registers[reg]
+
+    def write8(self, reg, value):
+        bus.transfer(2)
+        self.registers[reg] = value & 0xFF
+
+    def writeList(self, reg, values):
+        bus.transfer(1 + len(values))
+        increment = self.autoIncrement is None or self.autoIncrement()
+        for i, value in enumerate(values):
+            self.registers[reg + i if increment else reg] = value & 0xFF
+
+
+class SimPWM:
+    """ PCA9685 16 channel PWM board, with the Adafruit_PWM_Servo_Driver PWM interface """
+
+    regMode1 = 0x00
+    regLed0OnL = 0x06
+    regAllLedOnL = 0xFA
+    regPrescale = 0xFE
+    mode1AutoIncrement = 0x20
+
+    def __init__(self, address=0x40, debug=False):
+        self.registers = bytearray(256)
+        self.i2c = SimI2CDevice(address, self.registers,
+            lambda: self.registers[self.regMode1] & self.mode1AutoIncrement)
+        self.debug = debug
+
+    def setPWMFreq(self, freq):
+        prescale = int( math.floor(25000000.0 / 4096.0 / freq - 1.0 + 0.5) )
+        oldMode = self.i2c.readU8(self.regMode1)
+        self.i2c.write8(self.regMode1, (oldMode & 0x7F) | 0x10) #Sleep
+        self.i2c.write8(self.regPrescale, prescale)
+        self.i2c.write8(self.regMode1, oldMode)
+
+    def setPWM(self, channel, on, off):
+        reg = self.regLed0OnL + 4 * channel
+        self.i2c.write8(reg, on & 0xFF)
+        self.i2c.write8(reg + 1, on >> 8)
+        self.i2c.write8(reg + 2, off & 0xFF)
+        self.i2c.write8(reg + 3, off >> 8)
+
+    def setAllPWM(self, on, off):
+        self.i2c.write8(self.regAllLedOnL, on & 0xFF)
+        self.i2c.write8(self.regAllLedOnL + 1, on >> 8)
+        self.i2c.write8(self.regAllLedOnL + 2, off & 0xFF)
+        self.i2c.write8(self.regAllLedOnL + 3, off >> 8)
+        for channel in range(16):
+            reg = self.regLed0OnL + 4 * channel
+            self.registers[reg:reg + 4] = bytes([on & 0xFF, on >> 8, off & 0xFF, off >> 8])
+
+    def getPulse(self, channel):
+        """ Returns the off time register value of a channel """
+        reg = self.regLed0OnL + 4 * channel
+        return self.registers[reg + 2] | (self.registers[reg + 3] << 8)
+
+
+def defaultDistance(address, t):
+    """ Distance in mm seen by a sensor at time t, when no other distance source is set """
+    return 300 + 150 * math.sin(t + address)
+
+
+#Function (address, time) returning the distance in mm seen by a time of flight sensor
+distanceSource = defaultDistance
+
+
+def setDistanceSource(source):
+    """ Set the function (address, time) -> distance in mm used by the simulated sensors """
+    global distanceSource
+    distanceSource = source
+
+
+class SimVL53L1X:
+    """ VL53L1X time of flight sensor, with the adafruit_vl53l1x interface.
+        While ranging, a measurement completes every timing budget. data_ready is set when
+        a measurement has completed since the interrupt was last cleared.
+    """
+
+    def __init__(self, i2c=None, address=0x29):
+        self.address = address
+        self.distance_mode = 2
+        self._timingBudget = 50
+        self.ranging = False
+        self.rangingStart = 0.0
+        self.lastCleared = -1 #Index of the last measurement whose interrupt was cleared
+        bus.transfer(2) #Model id check on start up
+
+    @property
+    def timing_budget(self):
+        return self._timingBudget
+
+    @timing_budget.setter
+    def timing_budget(self, value):
+        bus.transfer(3)
+        self._timingBudget = value
+
+    def measurementIndex(self, now):
+        """ Index of the last completed measurement, or -1 if none """
+        if not self.ranging:
+            return -1
+        return int( (now - self.rangingStart) / (self._timingBudget / 1000) ) - 1
+
+    def start_ranging(self):
+        bus.transfer(2)
+        self.ranging = True
+        self.rangingStart = time.perf_counter()
+        self.lastCleared = -1
+
+    def stop_ranging(self):
+        bus.transfer(2)
+        self.ranging = False
+
+    @property
+    def data_ready(self):
+        bus.transfer(2)
+        return self.measurementIndex(time.perf_counter()) > self.lastCleared
+
+    @property
+    def distance(self):
+        """ Distance in cm of the last completed measurement, or None if there is none """
+        bus.transfer(3)
+        index = self.measurementIndex(time.perf_counter())
+        if index < 0:
+            return None
+        measuredAt = self.rangingStart + (index + 1) * self._timingBudget / 1000
+        return distanceSource(self.address, measuredAt) / 10
+
+    def clear_interrupt(self):
+        bus.transfer(2)
+        self.lastCleared = self.measurementIndex(time.perf_counter())
+
+
+class SimSentinelHardware:
+    """ Low level Sentinel board hardware, accessed by the robot code through sb.sbHardware """
+
+    def __init__(self):
+        self.voltage_multiplier = 1
+        self.channelPulseLengths = [0] * 16
+
+    @property
+    def motor_voltage(self):
+        bus.transfer(3)
+        return batteryVoltage * random.gauss(1, 0.005)
+
+    def allOff(self):
+        bus.transfer(5)
+        self.channelPulseLengths = [0] * 16
+
+
+class SimSentinelBoard:
+    """ Sentinel board, driving 4 steering servos and 2 motors, with a watchdog which
+        stops the motors if it is not pulsed within watchdogTimeout seconds
+    """
+
+    servoMin = 105
+    servoMax = 475
+    maxPulseLength = 4090
+    motorChannels = { 1: (12,13), 2: (14,15) }
+
+    def __init__(self):
+        self.sbHardware = SimSentinelHardware()
+        self.motorPowerLimiting = 50
+        self.lastWatchdogPulse = time.perf_counter()
+        self.watchdogTrips = 0 #Number of times the watchdog would have stopped the motors
+
+    def setServoPosition(self, channel, position):
+        bus.transfer(5)
+        pulse = int( (self.servoMax - self.servoMin) * position / 180 + self.servoMin )
+        self.sbHardware.channelPulseLengths[channel] = pulse
+
+    def setMotorPower(self, motor, power):
+        bus.transfer(5)
+        bus.transfer(5)
+        pulse = int( min(abs(power), 100) * self.maxPulseLength * self.motorPowerLimiting / 10000 )
+        forward, reverse = self.motorChannels[motor]
+        self.sbHardware.channelPulseLengths[forward] = pulse if power > 0 else 0
+        self.sbHardware.channelPulseLengths[reverse] = pulse if power < 0 else 0
+
+    def setMotorPowerLimiting(self, percentage):
+        self.motorPowerLimiting = max(0, min(100, percentage))
+
+    def watchdogExpired(self):
+        return time.perf_counter() - self.lastWatchdogPulse > watchdogTimeout
+
+    def pulseWatchdog(self):
+        if self.watchdogExpired():
+            self.watchdogTrips += 1
+        self.lastWatchdogPulse = time.perf_counter()
+
+    def watchdogPause(self, duration):
+        """ Sleep while keeping the watchdog alive """
+        end = time.perf_counter() + duration
+        while True:
+            self.pulseWatchdog()
+            remaining = end - time.perf_counter()
+            if remaining <= 0:
+                break
+            time.sleep( min(remaining, watchdogTimeout / 2) )
+
+
+class SimLEDMatrix:
+    """ 5x5 RGB LED matrix display, with the RGBMatrix5x5 interface.
+        When virtualLEDDisplay is set the LEDs are drawn onto the pygame screen.
+    """
+
+    def __init__(self, address=0x74):
+        self.address = address
+        self.pixels = [ (0,0,0) ] * 25
+        self.origin = (10 if address == 0x74 else 130, 10)
+        bus.transfer(2)
+
+    def set_pixel(self, x, y, r, g, b):
+        self.pixels[5*y+x] = (r,g,b)
+
+    def clear(self):
+        self.pixels = [ (0,0,0) ] * 25
+
+    def show(self):
+        #Frame is sent in 32 byte blocks
+        for block in range(5):
+            bus.transfer(32)
+        if virtualLEDDisplay:
+            self.drawVirtual()
+
+    def drawVirtual(self):
+        import pygame
+        import DisplayUpdates as du
+
+        screen = pygame.display.get_surface()
+        if screen is None:
+            return
+        for i, colour in enumerate(self.pixels):
+            rect = pygame.Rect(self.origin[0] + (i % 5) * virtualLEDSize, self.origin[1] + (i // 5) * virtualLEDSize,
+                virtualLEDSize - 2, virtualLEDSize - 2)
+            screen.fill(colour, rect)
+        du.markDirty( pygame.Rect(self.origin, (5*virtualLEDSize, 5*virtualLEDSize)) )
+
+
+def defaultScript():
+    """ Returns a list of (time, handler name, arguments) events which drive the robot through
+        manual control, the sensor test and wall following, returning to the menu in between
+    """
+    events = []
+    menuButtons = { "manual": (140,125), "sensorsTest": (390,125), "wallFollowing": (640,125) }
+
+    def returnToMenu(t):
+        events.append( (t, "selectBtnChanged", (True,)) )
+        events.append( (t, "startBtnChanged", (True,)) )
+        events.append( (t + 0.1, "selectBtnChanged", (False,)) )
+        events.append( (t + 0.1, "startBtnChanged", (False,)) )
+
+    events.append( (0.5, "mouseDown", (menuButtons["manual"], 1)) )
+    for i in range(60):
+        t = 1.0 + i * 0.05
+        events.append( (t, "leftStickChanged", (0, -0.8 * math.sin(i / 10))) )
+        events.append( (t, "rightStickChanged", (0.6 * math.sin(i / 7), 0)) )
+    events.append( (4.1, "leftStickChanged", (0, 0)) )
+    events.append( (4.1, "rightStickChanged", (0, 0)) )
+    returnToMenu(4.5)
+    events.append( (5.0, "mouseDown", (menuButtons["sensorsTest"], 1)) )
+    returnToMenu(7.0)
+    events.append( (7.5, "mouseDown", (menuButtons["wallFollowing"], 1)) )
+    returnToMenu(10.0)
+    return events
+
+
+class SimRobotController:
+    """ Scripted game controller, with the pygamecontroller RobotController interface.
+        Script events are passed to the handlers at their scheduled times from controllerStatus().
+        Mouse clicks and window close events from pygame are also handled.
+    """
+
+    def __init__(self, name, initStatus, script=None, duration=None, **handlers):
+        self.name = name
+        self.handlers = handlers
+        self.script = sorted(defaultScript() if script is None else script, key=lambda event: event[0])
+        if duration is None and os.environ.get(simDurationEnvVar):
+            duration = float( os.environ[simDurationEnvVar] )
+        if duration is None and len(self.script) > 0:
+            duration = self.script[-1][0] + 0.5
+        self.duration = duration
+        self.nextEvent = 0
+        self.startTime = None
+        self.initialised = True
+        self.displayControllerOutput = False
+        self.screen = None
+        initStatus(0)
+
+    def controllerStatus(self):
+        """ Passes due events to the handlers. Returns False once the script has finished. """
+        import pygame
+
+        now = time.perf_counter()
+        if self.startTime is None:
+            self.startTime = now
+        elapsed = now - self.startTime
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return False
+            elif event.type == pygame.MOUSEBUTTONDOWN and "mouseDown" in self.handlers:
+                self.handlers["mouseDown"](event.pos, event.button)
+
+        while self.nextEvent < len(self.script) and self.script[self.nextEvent][0] <= elapsed:
+            eventTime, handlerName, args = self.script[self.nextEvent]
+            self.nextEvent += 1
+            handler = self.handlers.get(handlerName)
+            if handler is not None:
+                handler(*args)
+
+        return self.duration is None or elapsed < self.duration
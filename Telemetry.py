@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+""" UDP telemetry of the Rocky Rover state.
+    Samples of motor powers, servo positions, sensor distances, PID terms, battery
+    voltage and main loop timing are packed into fixed size records and sent in
+    batches, several samples to a datagram. The socket is non-blocking, and a batch
+    which cannot be sent straight away is dropped rather than queued, so a slow or
+    missing receiver never holds up the main loop. TelemetryReceiver.py decodes
+    and plots the datagrams.
+
+    Usage:
+        publisher = Telemetry.Publisher("192.168.1.10", 5005)
+        publisher.publish( Telemetry.robotState(distances, scheduler) )
+"""
+
+import time, socket, struct
+from collections import namedtuple
+
+defaultPort = 5005
+samplesPerDatagram = 4
+
+#Datagram header: magic, format version, number of samples and sequence number
+headerStruct = struct.Struct("<4sBBH")
+telemetryMagic = b"RKTM"
+telemetryVersion = 1
+
+sampleFields = ["time", "motorPowerL", "motorPowerR", "servoFL", "servoFR", "servoBL", "servoBR",
+    "leftDist", "rightDist", "frontDist", "pidP", "pidI", "pidD", "pidOutput", "voltage",
+    "controlMs", "uiMs", "misses"]
+Sample = namedtuple("Sample", sampleFields)
+#Time as a double, and the other fields as floats
+sampleStruct = struct.Struct("<d" + "f" * (len(sampleFields) - 1))
+
+
+def robotState(distances, scheduler=None):
+    """ Returns a Sample of the current robot state.
+        distances is a sequence of the latest (left, right, front) sensor distances.
+        Loop timing is taken from the 'control' and 'ui' tasks of the scheduler (if given).
+    """
+    import RobotControl as rc
+    import AutonomousDriving as ad
+
+    pid = ad.pid
+    if pid is None:
+        pidTerms = (0.0, 0.0, 0.0, 0.0)
+    else:
+        pidTerms = (pid.PTerm, pid.ITerm, pid.DTerm, pid.output)
+
+    controlMs = uiMs = 0.0
+    misses = 0
+    if scheduler is not None:
+        for task in scheduler.tasks:
+            if task.name == "control":
+                controlMs = task.lastDuration * 1000
+            elif task.name == "ui":
+                uiMs = task.lastDuration * 1000
+            misses += task.misses
+
+    return Sample(time.time(), rc.motorPowerL, rc.motorPowerR, rc.servoPosFL, rc.servoPosFR, rc.servoPosBL, rc.servoPosBR,
+        distances[0], distances[1], distances[2], *pidTerms, rc.getMotorSupplyVoltage(), controlMs, uiMs, misses)
+
+
+class Publisher:
+    """ Packs samples into datagrams and sends them to a receiver without blocking.
+        The host name is looked up once when the publisher is created, raising OSError
+        if it cannot be resolved.
+    """
+
+    def __init__(self, host, port=defaultPort, batchSize=samplesPerDatagram):
+        self.address = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_DGRAM)[0][4]
+        self.batchSize = batchSize
+        self.buffer = bytearray(headerStruct.size + batchSize * sampleStruct.size)
+        self.count = 0 #Samples in the current batch
+        self.sequence = 0
+        self.sent = 0
+        self.dropped = 0 #Datagrams which could not be sent
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+    def publish(self, sample):
+        """ Add a sample to the current batch, sending the batch when it is full """
+        sampleStruct.pack_into(self.buffer, headerStruct.size + self.count * sampleStruct.size, *sample)
+        self.count += 1
+        if self.count >= self.batchSize:
+            self.flush()
+
+    def flush(self):
+        """ Send the samples in the current batch. The batch is dropped if the socket is not ready. """
+        if self.count == 0:
+            return
+        headerStruct.pack_into(self.buffer, 0, telemetryMagic, telemetryVersion, self.count, self.sequence)
+        size = headerStruct.size + self.count * sampleStruct.size
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        self.count = 0
+        try:
+            self.socket.sendto(memoryview(self.buffer)[:size], self.address)
+            self.sent += 1
+        except OSError:
+            #Socket not ready, no route or no receiver. Telemetry never holds up or stops the main loop.
+            self.dropped += 1
+
+    def getStats(self):
+        return { "sent": self.sent, "dropped": self.dropped }
+
+    def close(self):
+        self.socket.close()
+
+
+def decode(datagram):
+    """ Returns (sequence number, list of Samples) from a telemetry datagram.
+        Raises ValueError if it is not a telemetry datagram.
+    """
+    if len(datagram) < headerStruct.size:
+        raise ValueError("Datagram too short")
+    magic, version, count, sequence = headerStruct.unpack_from(datagram, 0)
+    if magic != telemetryMagic or version != telemetryVersion:
+        raise ValueError("Not a version {} telemetry datagram".format(telemetryVersion))
+    if len(datagram) != headerStruct.size + count * sampleStruct.size:
+        raise ValueError("Datagram size does not match sample count")
+    return sequence, [ Sample._make( sampleStruct.unpack_from(datagram, headerStruct.size + i * sampleStruct.size) )
+        for i in range(count) ]
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+""" Receiver for Rocky Rover telemetry sent by Telemetry.Publisher.
+    Plots the last few seconds of each quantity live with matplotlib, or prints the
+    samples as text if matplotlib is not installed (or --text is given). Lost
+    datagrams are counted from gaps in the sequence numbers.
+
+    Usage:
+        python3 TelemetryReceiver.py [--port 5005] [--window 20] [--text]
+"""
+
+import socket, select, argparse
+from collections import deque
+import Telemetry
+
+#Plots of the sample fields, as (title, fields)
+plots = [
+    ("Motor power %", ["motorPowerL", "motorPowerR"]),
+    ("Servo position deg", ["servoFL", "servoFR", "servoBL", "servoBR"]),
+    ("Distance mm", ["leftDist", "rightDist", "frontDist"]),
+    ("PID", ["pidP", "pidI", "pidD", "pidOutput"]),
+    ("Battery V", ["voltage"]),
+    ("Task time ms", ["controlMs", "uiMs"]),
+    ]
+
+
+class Receiver:
+    """ Receives telemetry datagrams and keeps a window of the latest samples """
+
+    def __init__(self, port=Telemetry.defaultPort, window=20.0):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("", port))
+        self.socket.setblocking(False)
+        self.window = window
+        self.samples = deque()
+        self.received = 0
+        self.lost = 0
+        self.invalid = 0
+        self.lastSequence = None
+
+    def poll(self):
+        """ Read all waiting datagrams. Returns the list of new samples. """
+        newSamples = []
+        while True:
+            try:
+                datagram = self.socket.recv(65536)
+            except BlockingIOError:
+                break
+            try:
+                sequence, samples = Telemetry.decode(datagram)
+            except ValueError:
+                self.invalid += 1
+                continue
+            if self.lastSequence is not None:
+                self.lost += (sequence - self.lastSequence - 1) & 0xFFFF
+            self.lastSequence = sequence
+            self.received += 1
+            newSamples += samples
+
+        self.samples.extend(newSamples)
+        if self.samples:
+            oldest = self.samples[-1].time - self.window
+            while self.samples[0].time < oldest:
+                self.samples.popleft()
+        return newSamples
+
+    def wait(self, timeout):
+        """ Wait up to timeout seconds for a datagram to arrive """
+        select.select([self.socket], [], [], timeout)
+
+
+def runText(receiver):
+    """ Print each sample as it arrives """
+    names = Telemetry.sampleFields[1:]
+    print(" ".join( "{:>9}".format(name[:9]) for name in names ))
+    while True:
+        receiver.wait(1.0)
+        for sample in receiver.poll():
+            print(" ".join( "{:9.2f}".format(getattr(sample, name)) for name in names ))
+
+
+def runPlot(receiver, plt, refreshInterval=0.1):
+    """ Plot the window of samples, redrawing every refreshInterval seconds """
+    figure, axes = plt.subplots(len(plots), 1, sharex=True, figsize=(10, 12))
+    lines = []
+    for axis, (title, fields) in zip(axes, plots):
+        axis.set_ylabel(title)
+        lines.append( [ axis.plot([], [], label=field)[0] for field in fields ] )
+        axis.legend(loc="upper left", fontsize="small")
+    axes[-1].set_xlabel("Time (s)")
+    plt.show(block=False)
+
+    while plt.fignum_exists(figure.number):
+        if receiver.poll():
+            latest = receiver.samples[-1].time
+            times = [ sample.time - latest for sample in receiver.samples ]
+            for axis, axisLines, (title, fields) in zip(axes, lines, plots):
+                for line, field in zip(axisLines, fields):
+                    line.set_data(times, [ getattr(sample, field) for sample in receiver.samples ])
+                axis.relim()
+                axis.autoscale_view()
+            axes[-1].set_xlim(-receiver.window, 0)
+            figure.suptitle("Received {} datagrams, lost {}".format(receiver.received, receiver.lost))
+        plt.pause(refreshInterval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Receive and plot Rocky Rover telemetry")
+    parser.add_argument("--port", type=int, default=Telemetry.defaultPort, help="UDP port to listen on")
+    parser.add_argument("--window", type=float, default=20.0, help="Seconds of samples to plot")
+    parser.add_argument("--text", action="store_true", help="Print samples instead of plotting them")
+    args = parser.parse_args()
+
+    receiver = Receiver(args.port, args.window)
+    print("Listening for telemetry on UDP port {}".format(args.port))
+
+    plt = None
+    if not args.text:
+        try:
+            import matplotlib.pyplot as plt
+        except ImportError:
+            print("matplotlib is not installed, so printing samples as text")
+
+    try:
+        if plt is None:
+            runText(receiver)
+        else:
+            runPlot(receiver, plt)
+    except KeyboardInterrupt:
+        pass
+    print("Received {} datagrams, lost {}, invalid {}".format(receiver.received, receiver.lost, receiver.invalid))
+
+
+if __name__ == '__main__':
+    main()
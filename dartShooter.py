@@ -1,7 +1,14 @@
 #!/usr/bin/env python3
 
+""" Dart shooter control for PiWars Rocky Rover robot.
+    The shooter is run as a state machine which is advanced by calling tick()
+    regularly from the main loop, so none of the functions here block the caller.
+"""
+
 import AdafruitPWMboard as pwmb
 import time
+from collections import deque
+from enum import Enum
 
 #Define the channels which the servos are connected to
 laserChannel = 5
@@ -9,44 +16,103 @@ triggerChannel = 7
 escChannel = 6
 
 maxMotorPower = int( 180 * 0.6 ) #Above 60% max power the  rubber band comes off motor
+rampStartPower = 40
 triggerOpenPos = 85
 triggerClosedPos = 160
-    
+triggerStep = 5
+
+#State machine timings (seconds)
+armTime = 2.0 #Time the ESC needs the min pulse to arm
+rampStepTime = 0.05 #Time between each step up in motor power
+triggerStepTime = 0.05 #Time between each step of the trigger servo
+triggerHoldTime = 0.5 #Time trigger is held closed at the end of its travel
+retractTime = 0.3 #Time allowed for the trigger to return to open before the next dart can fire
+
+
+class ShooterState(Enum):
+    """ Dart shooter states """
+    idle = 0
+    arming = 1
+    armed = 2
+    spinningUp = 3
+    ready = 4
+    firing = 5
+    retracting = 6
+
+
+state = ShooterState.idle
+stateChangedAt = 0.0
+transitions = deque(maxlen=32) #Recent (time, state) transitions, for debugging
 armed = False
 motorRunning = False
+spinRequested = False
+queuedFires = 0
+
+
+def setState(newState, now=None):
+    """ Move to a new state, recording the time of the transition """
+    global state, stateChangedAt
+
+    if now is None:
+        now = time.monotonic()
+    state = newState
+    stateChangedAt = now
+    transitions.append( (now, newState) )
+
 
 def armESC():
-    """ Arms the dart shooter esc """
-    global armed
-    
-    if armed == False:
+    """ Starts arming the dart shooter esc """
+    if armed == False and state != ShooterState.arming:
         pwmb.setServoPosition(escChannel, 0)
-        time.sleep(2)
-        armed = True
+        setState(ShooterState.arming)
 
 
 def motorOn():
-    """ Turns on the dart shooter motor by ramping up power """
-    global motorRunning
-    
-    for angle in range(40, maxMotorPower):
-        pwmb.setServoPosition(escChannel, angle) 
-        time.sleep(0.05)
-    motorRunning = True
-    
+    """ Requests the dart shooter motor is turned on by ramping up power.
+        The ESC is armed first if needed.
+    """
+    global spinRequested
+
+    spinRequested = True
+    if armed == False:
+        armESC()
+    elif state == ShooterState.armed:
+        setState(ShooterState.spinningUp)
+
 
 def motorOff():
     """ Turns off the dart shooter motor """
-    global motorRunning
+    global motorRunning, spinRequested, queuedFires
 
     pwmb.setPercentageOn(escChannel, 0) #Off
+    if state == ShooterState.firing or state == ShooterState.retracting:
+        pwmb.setServoPosition(triggerChannel, triggerOpenPos)
     motorRunning = False
-    
-    
+    spinRequested = False
+    queuedFires = 0
+    if armed:
+        setState(ShooterState.armed)
+    else:
+        setState(ShooterState.idle)
+
+
+def disarm():
+    """ Forget that the ESC is armed, so it is armed again before the motor next starts.
+        The motor is turned off first if it is running or spinning up.
+    """
+    global armed
+
+    if spinRequested or motorRunning:
+        motorOff()
+    armed = False
+    if state != ShooterState.arming:
+        setState(ShooterState.idle)
+
+
 def laserOn():
     """ Turns off the laser """
     pwmb.setConstantOn(laserChannel)
-    
+
 
 def laserOff():
     """ Turns off the laser """
@@ -54,34 +120,80 @@ def laserOff():
 
 
 def fire():
-    """ Pushes dart onto flywheel """
-    for angle in range(triggerOpenPos, triggerClosedPos, 5):
-        pwmb.setServoPosition(triggerChannel, angle) 
-        time.sleep(0.05)
-    time.sleep(0.5)
-    pwmb.setServoPosition(triggerChannel, triggerOpenPos)
-    
-    
+    """ Queues a dart to be pushed onto the flywheel once the motor is up to speed """
+    global queuedFires
+
+    if spinRequested:
+        queuedFires += 1
+
+
+def tick(now=None):
+    """ Advances the state machine. Call regularly from the main loop.
+        Returns True if the state changed.
+    """
+    global armed, motorRunning, queuedFires
+
+    if now is None:
+        now = time.monotonic()
+    previousState = state
+    elapsed = now - stateChangedAt
+
+    if state == ShooterState.arming:
+        if elapsed >= armTime:
+            armed = True
+            if spinRequested:
+                setState(ShooterState.spinningUp, now)
+            else:
+                setState(ShooterState.armed, now)
+
+    elif state == ShooterState.spinningUp:
+        power = rampStartPower + int(elapsed / rampStepTime)
+        if power >= maxMotorPower:
+            motorRunning = True
+            setState(ShooterState.ready, now)
+        else:
+            pwmb.setServoPosition(escChannel, power)
+
+    elif state == ShooterState.ready:
+        if queuedFires > 0:
+            queuedFires -= 1
+            setState(ShooterState.firing, now)
+            pwmb.setServoPosition(triggerChannel, triggerOpenPos)
+
+    elif state == ShooterState.firing:
+        triggerSteps = len(range(triggerOpenPos, triggerClosedPos, triggerStep))
+        step = int(elapsed / triggerStepTime)
+        if step < triggerSteps:
+            pwmb.setServoPosition(triggerChannel, triggerOpenPos + step * triggerStep)
+        elif elapsed >= triggerSteps * triggerStepTime + triggerHoldTime:
+            pwmb.setServoPosition(triggerChannel, triggerOpenPos)
+            setState(ShooterState.retracting, now)
+
+    elif state == ShooterState.retracting:
+        if elapsed >= retractTime:
+            setState(ShooterState.ready, now)
+
+    return state != previousState
+
+
 def main():
     # ===========================================================================
     # Arm ESC and start up motor
     # ===========================================================================
     try:
-        
-        print("Setting min pulse to arm (for 2 seconds)")
-        armESC()
-        
+
         print("Laser on")
         laserOn()
-        
-        print("Ramping up")
+
+        print("Arming and ramping up")
         motorOn()
-        
         fire()
-        #time.sleep(5)
-        #fire()
-        #time.sleep(5)
-        #fire()
+
+        #Run state machine until dart has been fired
+        while state != ShooterState.ready or queuedFires > 0:
+            if tick():
+                print(f"Shooter state: {state.name}")
+            time.sleep(0.01)
         time.sleep(1)
 
     finally:
@@ -91,4 +203,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
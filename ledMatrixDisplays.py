@@ -1,6 +1,66 @@
 #!/usr/bin/env python3
 
-from rgbmatrix5x5 import RGBMatrix5x5
+import threading
+import HardwareRegistry as hw
+import HardwareBackend as backend
+import RingLogger
+
+log = RingLogger.getLogger("ledMatrixDisplays")
+
+
+class FrameWriter(threading.Thread):
+    """ Background thread which sends frames to the LED matrix displays, so the
+        slow i2c transfer of a frame does not hold up the main loop. Only the latest
+        frame requested for each display is sent.
+    """
+    
+    def __init__(self, showPattern):
+        super().__init__(daemon=True)
+        self.showPattern = showPattern
+        self.pending = {} #Display: (pattern, rotate), or None to resend the current frame
+        self.written = 0
+        self.replaced = 0 #Frames replaced by a later frame before they were sent
+        self.lock = threading.Lock()
+        self.framesWaiting = threading.Event()
+        self.stopRequested = threading.Event()
+        
+    def run(self):
+        while not self.stopRequested.is_set():
+            self.framesWaiting.wait()
+            self.framesWaiting.clear()
+            self.flush()
+        self.flush()
+            
+    def flush(self):
+        """ Send the latest requested frame for each display """
+        with self.lock:
+            frames = self.pending
+            self.pending = {}
+        for display, frame in frames.items():
+            try:
+                if frame is None:
+                    display.show()
+                else:
+                    self.showPattern(display, *frame)
+                self.written += 1
+            except Exception as e:
+                print(f"Error showing LED matrix frame: {e}")
+            
+    def request(self, display, frame):
+        """ Queue a (pattern, rotate) frame, or None to resend the current frame, for a display """
+        with self.lock:
+            if display in self.pending:
+                if frame is None:
+                    return
+                if self.pending[display] is not None:
+                    self.replaced += 1
+            self.pending[display] = frame
+        self.framesWaiting.set()
+        
+    def stop(self):
+        self.stopRequested.set()
+        self.framesWaiting.set()
+
 
 class LEDMatrixDisplays:
     """ Wrapper class representing a pair of 5x5 RGB LED matrix i2c display breakouts
@@ -10,19 +70,47 @@ class LEDMatrixDisplays:
     frameQueueR = []
     
     def __init__(self):
-        try:
-            self.d1 = RGBMatrix5x5(0x74)
-        except:
-            self.d1 = None
-
-        try:
-            self.d2 = RGBMatrix5x5(0x77)
-        except:
-            self.d2 = None
+        #Probe both displays in parallel. Displays which are not found are set to None.
+        leftDisplay = hw.LazyDevice("leftEye", lambda: backend.createLEDMatrix(0x74))
+        rightDisplay = hw.LazyDevice("rightEye", lambda: backend.createLEDMatrix(0x77))
+        hw.startInBackground(["leftEye", "rightEye"])
+        self.d1 = leftDisplay.tryGet()
+        self.d2 = rightDisplay.tryGet()
+        self.writer = None
             
         self.clear()
         
+    def startWriter(self):
+        """ Send frames from a background thread from now on """
+        if self.writer is None:
+            self.writer = FrameWriter(self.showPattern)
+            self.writer.start()
+        
+    def stopWriter(self):
+        """ Wait for the background thread to send its last frames and stop it """
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer.join()
+            self.writer = None
+        
+    def show(self,display,pattern=None,rotate=0):
+        """ Show a pattern (or resend the current frame if pattern is None) on a display,
+            from the background thread if it is running
+        """
+        if display is None:
+            return
+        if self.writer is not None:
+            self.writer.request(display, None if pattern is None else (pattern,rotate))
+        elif pattern is None:
+            display.show()
+        else:
+            self.showPattern(display,pattern,rotate)
+        
     def clear(self):
+        if self.writer is not None:
+            self.show(self.d1,blank)
+            self.show(self.d2,blank)
+            return
         if self.d1 is not None:
             self.d1.clear()
             self.d1.show()
@@ -31,14 +119,12 @@ class LEDMatrixDisplays:
             self.d2.show()
         
     def reshow(self):
-        if self.d1 is not None:
-            self.d1.show()
-        if self.d2 is not None:    
-            self.d2.show()
+        self.show(self.d1)
+        self.show(self.d2)
         
     def showPattern(self,display,pattern,rotate=0):
         """ Display an array of rgb values on the display, with optional rotate of the pattern """
-        print(f"Showing on display {display}")
+        log.debug("Showing on display {}", display)
         if display is not None:
             if rotate==1:
                 #Rotate 90 deg
@@ -67,7 +153,7 @@ class LEDMatrixDisplays:
                     for x in range(0,5):
                         i = 5*y+4-x
                         display.set_pixel(x,y,pattern[i][0],pattern[i][1],pattern[i][2])
-            print("display show")
+            log.debug("display show")
             display.show()
 
 
@@ -87,16 +173,16 @@ class LEDMatrixDisplays:
         if len(self.frameQueueL) > 0:
             #Get next pattern from front of queue
             pattern = self.frameQueueL.pop(0)
-            self.showPattern(self.d1,pattern,2)
-        elif self.d1 is not None:
-            self.d1.show()
+            self.show(self.d1,pattern,2)
+        else:
+            self.show(self.d1)
             
         if len(self.frameQueueR) > 0:
             #Get next pattern from front of queue
             pattern = self.frameQueueR.pop(0)
-            self.showPattern(self.d2,pattern)
-        elif self.d2 is not None:
-            self.d2.show()
+            self.show(self.d2,pattern)
+        else:
+            self.show(self.d2)
     
     
     def showNow(self,pattern,display=0):
@@ -106,15 +192,15 @@ class LEDMatrixDisplays:
             Any other value = both displays
         """
         if display != 2:
-            self.showPattern(self.d1,pattern,2)
+            self.show(self.d1,pattern,2)
         
         if display != 1:
-            self.showPattern(self.d2,pattern)
+            self.show(self.d2,pattern)
         
         
     def blink(self):
         """ Queue up blink animation frames for both eyes """
-        print("blink queued")
+        log.debug("blink queued")
         self.addFrame(eye_lid1)
         self.addFrame(eye_lid2)
         self.addFrame(eye_lid3)
@@ -132,6 +218,8 @@ m = (255,0,127)
 w = (255,255,255)
 r = (255,0,0)
 
+blank = [o] * 25
+
 eye_open = [
 o,w,w,w,o,
 w,w,b,w,w,